@@ -0,0 +1,238 @@
+"""
+Immutable frame artifacts, named by their content hash.
+
+Renders keep writing `{color}.png` into the output directories. Each finished
+image is then published here, as `by-hash/<hash>.png`, which is never written
+again, and `manifest.json` maps each (profile, color) to the hash of its current
+image:
+
+    {"profiles": {"default": {"black": {"hash": "...", "updated_at": "..."}}}}
+
+So a download always reads a complete file, even while the next frame is being
+rendered; an artifact can be served with long-lived cache headers, since its
+name changes whenever its content does; and "did it change" is a comparison of
+hashes.
+
+Artifacts are hard links to the rendered file when possible, so publishing
+doesn't copy anything. Old artifacts are pruned by count and age, but never the
+ones the manifest points to, nor the ones `store()` was asked to keep for a while
+(the frames of a `/timeline`, until its client has fetched them).
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .atomic_files import write_atomically, write_temp_file
+
+_logger: logging.Logger = logging.getLogger()
+
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{16,64}$")
+
+# How many rendered files' hashes to remember
+_MAX_KNOWN_FILES = 64
+
+
+class ArtifactStore:
+    """
+    Args:
+        root: The directory of the manifest and the artifacts
+        keep_count: Keep at least the newest this many artifacts
+        max_age: Artifacts older than this are pruned, unless they're among the newest `keep_count`
+    """
+
+    def __init__(self, root: Path, keep_count: int = 64, max_age: datetime.timedelta = datetime.timedelta(days=2)):
+        self.root = root
+        self.keep_count = keep_count
+        self.max_age = max_age
+        self.artifacts_dir = root / "by-hash"
+        self.manifest_path = root / "manifest.json"
+        self.artifacts_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.artifacts_dir.glob(".*.tmp"):
+            # Left behind by a publish that was cut short
+            path.unlink(missing_ok=True)
+        self._lock = threading.Lock()
+        self._manifest: Dict[str, Dict[str, Dict[str, str]]] = self._load_manifest()
+        # (inode, size, mtime) of rendered files -> their hash
+        self._hashes: "OrderedDict[Tuple[int, int, int], str]" = OrderedDict()
+        # Hashes of stored artifacts -> the timestamp until which they're kept
+        self._kept_until: Dict[str, float] = {}
+        self._stats = {"published": 0, "unchanged": 0, "stored": 0, "pruned": 0}
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))["profiles"]
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError) as ex:
+            _logger.warning(f"Ignoring unreadable frame manifest {self.manifest_path}: {ex}")
+            return {}
+        # Drop entries whose artifact is gone
+        return {
+            profile: {
+                color: entry for color, entry in colors.items() if self.path(entry["hash"]).exists()
+            }
+            for profile, colors in manifest.items()
+        }
+
+    def _write_manifest(self) -> None:
+        """Write the manifest next to its destination, then rename. Call with the lock held."""
+        write_atomically(self.manifest_path, json.dumps({"profiles": self._manifest}, indent=2, sort_keys=True).encode("utf-8"))
+
+    def path(self, content_hash: str) -> Path:
+        """
+        Raises:
+            ValueError: If `content_hash` isn't a hash
+        """
+        if not _HASH_PATTERN.match(content_hash):
+            raise ValueError(f"Not a content hash: {content_hash!r}")
+        return self.artifacts_dir / f"{content_hash}.png"
+
+    def current(self, profile: str, color: str) -> Optional[str]:
+        """The hash of the current image of (profile, color), if there is one."""
+        with self._lock:
+            entry = self._manifest.get(profile, {}).get(color)
+            return entry["hash"] if entry else None
+
+    def publish(self, profile: str, color: str, source: Path) -> Tuple[str, Path]:
+        """
+        Make the rendered file `source` the current image of (profile, color).
+
+        The renders replace their files (rather than write into them), so a file's
+        inode, size and modification time identify its content, and `source` is only
+        read when it's a new file. It's linked (or copied) before it's hashed, so an
+        artifact is always named by the hash of its own bytes, even if another render
+        replaces `source` in the meantime.
+
+        Returns:
+            The artifact's hash, and its path
+
+        Raises:
+            FileNotFoundError: If `source` doesn't exist
+        """
+        stat = source.stat()
+        with self._lock:
+            known = self._hashes.get((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            entry = self._manifest.get(profile, {}).get(color)
+        if known is not None and entry and entry["hash"] == known:
+            with self._lock:
+                self._stats["unchanged"] += 1
+            return (known, self.path(known))
+
+        # A name of its own, like the temporary files of `atomic_files`, so
+        # concurrent publishes never link over each other's
+        tmp_path = self.artifacts_dir / f".{uuid.uuid4().hex}.tmp"
+        try:
+            try:
+                os.link(source, tmp_path)
+                # The link is the very file that gets hashed
+                linked = tmp_path.stat()
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # No hard links on this file system
+                tmp_path = write_temp_file(self.artifacts_dir, source.read_bytes())
+                linked = None
+            content_hash = hashlib.sha256(tmp_path.read_bytes()).hexdigest()[:32]
+            artifact = self.path(content_hash)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            # Under the lock, so `prune()` can't delete an existing artifact before it's current
+            if artifact.exists():
+                tmp_path.unlink()
+            else:
+                os.replace(tmp_path, artifact)
+            if linked is not None:
+                self._hashes[(linked.st_ino, linked.st_size, linked.st_mtime_ns)] = content_hash
+                while len(self._hashes) > _MAX_KNOWN_FILES:
+                    self._hashes.popitem(last=False)
+            entry = self._manifest.get(profile, {}).get(color)
+            if entry and entry["hash"] == content_hash:
+                self._stats["unchanged"] += 1
+                return (content_hash, artifact)
+            self._manifest.setdefault(profile, {})[color] = {
+                "hash": content_hash,
+                "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+            self._write_manifest()
+            self._stats["published"] += 1
+        _logger.debug(f"Published {profile}/{color} as {content_hash}")
+        return (content_hash, artifact)
+
+    def store(self, data: bytes, keep_for: Optional[datetime.timedelta] = None) -> str:
+        """
+        Keep `data` as an artifact, without making it the current image of anything
+        (e.g. a frame of `/timeline`). It's pruned like the others, but not for
+        `keep_for`, so whoever was handed its hash has the time to fetch it.
+
+        Returns:
+            The artifact's hash
+        """
+        content_hash = hashlib.sha256(data).hexdigest()[:32]
+        artifact = self.path(content_hash)
+        with self._lock:
+            # An existing artifact is left as it is, even its modification time:
+            # it may be a hard link to a rendered file, identified by its mtime
+            if not artifact.exists():
+                write_atomically(artifact, data)
+                self._stats["stored"] += 1
+            if keep_for is not None:
+                until = (datetime.datetime.now(datetime.timezone.utc) + keep_for).timestamp()
+                self._kept_until[content_hash] = max(until, self._kept_until.get(content_hash, until))
+        return content_hash
+
+    def manifest(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        with self._lock:
+            return {profile: dict(colors) for profile, colors in self._manifest.items()}
+
+    def prune(self, now_utc: Optional[datetime.datetime] = None) -> int:
+        """
+        Delete the artifacts that are neither current, kept by `store()`, nor among
+        the newest `keep_count`, once they're older than `max_age`.
+
+        Returns:
+            How many artifacts were deleted
+        """
+        now = (now_utc or datetime.datetime.now(datetime.timezone.utc)).timestamp()
+        with self._lock:
+            current = {entry["hash"] for colors in self._manifest.values() for entry in colors.values()}
+            self._kept_until = {key: until for (key, until) in self._kept_until.items() if until > now}
+            current.update(self._kept_until)
+            artifacts = []
+            for path in self.artifacts_dir.glob("*.png"):
+                try:
+                    artifacts.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    pass
+            artifacts.sort(reverse=True)
+            pruned = 0
+            for (mtime, path) in artifacts[self.keep_count:]:
+                if path.stem in current or now - mtime < self.max_age.total_seconds():
+                    continue
+                path.unlink(missing_ok=True)
+                pruned += 1
+            self._stats["pruned"] += pruned
+        if pruned:
+            _logger.info(f"Pruned {pruned} old frame artifacts")
+        return pruned
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "artifacts": sum(1 for _ in self.artifacts_dir.glob("*.png")),
+                "keep_count": self.keep_count,
+                "max_age_hours": self.max_age.total_seconds() / 3600,
+                "kept": len(self._kept_until),
+                **self._stats,
+            }
@@ -0,0 +1,48 @@
+"""
+Writing files that other threads and processes read while they're replaced.
+
+A file is written to a new temporary file next to its destination, then renamed
+over it, so readers see the old file or the new one, never half of one. Every
+write gets its own uniquely named temporary file, so concurrent writes of the
+same destination (different renders of the same frame, the pre-rendering task
+and a request) don't write into each other's: the last rename wins.
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+_logger: logging.Logger = logging.getLogger()
+
+# `mkstemp()` makes the files readable by the owner only
+_FILE_MODE = 0o644
+
+
+def write_temp_file(directory: Path, data: bytes, name: str = "") -> Path:
+    """
+    Write `data` to a new, uniquely named hidden file in `directory`, to be
+    renamed over its destination with `os.replace()`.
+
+    Args:
+        name: Part of the file name, to tell what it's for
+    """
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        os.fchmod(fd, _FILE_MODE)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return Path(tmp_path)
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """Write `data` to `path`, so that readers never see half a file."""
+    tmp_path = write_temp_file(path.parent, data, name=path.name)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,156 @@
+"""
+Raw packed 1-bit planes, for devices that would rather not decode PNGs.
+
+A plane is the frame packed 8 pixels per byte, most significant bit first, row
+after row from the top, with no header. A 0 bit is ink and a 1 bit is paper: the
+same layout as the Waveshare driver buffers (and as Pillow's mode "1"). At
+528x880 a plane is 66 bytes per row, 58,080 bytes in all.
+
+- `plane`: one color (red or black)
+- `combined`: the black plane immediately followed by the red plane
+- either one can be PackBits run-length encoded (see `packbits_encode()`), which
+  shrinks the mostly-blank planes a lot
+
+The planes are packed once per rendered frame and kept in memory by
+`BitplaneCache`, keyed by the PNG file's path, size and modification time.
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+# Above this brightness a pixel is paper, like `image_to_mono()` in main.py
+_PAPER_THRESHOLD = 200
+
+
+def pack_plane(image: Image.Image) -> bytes:
+    """
+    Pack a plane, where dark pixels are ink, into a 1-bit-per-pixel buffer.
+
+    Rows are padded to whole bytes with paper, if the width isn't a multiple of 8.
+    """
+    if image.mode != "1":
+        image = image.convert("L").point(lambda x: 255 if x > _PAPER_THRESHOLD else 0, mode="1")
+    return image.tobytes()
+
+
+def packbits_encode(data: bytes) -> bytes:
+    """
+    PackBits run-length encoding (as in TIFF and the Macintosh): a header byte n
+    of 0..127 is followed by n+1 literal bytes, and a header of 129..255 (-127..-1
+    as a signed byte) is followed by one byte, repeated 257-n times.
+    """
+    out = bytearray()
+    n = len(data)
+    i = 0
+    while i < n:
+        run_end = i + 1
+        while run_end < n and run_end - i < 128 and data[run_end] == data[i]:
+            run_end += 1
+        if run_end - i >= 3:
+            out.append(257 - (run_end - i))
+            out.append(data[i])
+            i = run_end
+            continue
+        # Literal bytes, until the next run of 3 or more
+        start = i
+        while i < n and i - start < 128:
+            if i + 2 < n and data[i] == data[i + 1] == data[i + 2]:
+                break
+            i += 1
+        out.append(i - start - 1)
+        out += data[start:i]
+    return bytes(out)
+
+
+def packbits_decode(data: bytes) -> bytes:
+    """The inverse of `packbits_encode()`."""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        header = data[i]
+        if header < 128:
+            out += data[i + 1:i + 2 + header]
+            i += 2 + header
+        elif header > 128:
+            out += bytes([data[i + 1]]) * (257 - header)
+            i += 2
+        else:
+            i += 1
+    return bytes(out)
+
+
+class BitplaneCache:
+    """
+    Keeps the packed planes of the last few rendered frames in memory.
+
+    Args:
+        max_entries: How many packed buffers to keep
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Any, ...], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _key(png_path: Path, rle: bool) -> Tuple[Any, ...]:
+        stat = png_path.stat()
+        return (str(png_path), stat.st_size, stat.st_mtime_ns, rle)
+
+    def _get(self, key: Tuple[Any, ...]) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            return data
+
+    def cached(self, png_path: Path, rle: bool = False) -> Optional[bytes]:
+        """
+        The packed plane of a rendered PNG if it's already packed, without packing
+        it: only a `stat()`, so it can be called on the event loop.
+
+        Raises:
+            FileNotFoundError: If the PNG doesn't exist
+        """
+        return self._get(self._key(png_path, rle))
+
+    def plane(self, png_path: Path, rle: bool = False) -> bytes:
+        """
+        Return the packed plane of a rendered PNG, packing it on first use.
+
+        Raises:
+            FileNotFoundError: If the PNG doesn't exist
+        """
+        key = self._key(png_path, rle)
+        data = self._get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            self._stats["misses"] += 1
+
+        if rle:
+            data = packbits_encode(self.plane(png_path, rle=False))
+        else:
+            with Image.open(png_path) as image:
+                data = pack_plane(image)
+
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(len(data) for data in self._entries.values()),
+                **self._stats,
+            }
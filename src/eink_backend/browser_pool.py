@@ -0,0 +1,390 @@
+"""
+A pool of long-lived headless Firefox instances used to screenshot HTML pages.
+
+Starting `firefox --screenshot` for every frame means paying for a full browser
+boot on each render. Instead, this module keeps a few headless Firefox processes
+running and drives them over Marionette, the remote-control protocol that is
+built into Firefox (no geckodriver or selenium needed).
+
+Each pool member:
+- is started with its own throw-away profile directory
+- is recycled after `max_renders_per_browser` screenshots, to keep memory in check
+- is discarded and replaced if it stops answering (see `BrowserPool.health_check()`)
+
+The Marionette wire format is `<length>:<json>`, where a command is
+`[0, message_id, command_name, params]` and a response is
+`[1, message_id, error, result]`.
+"""
+
+import base64
+import json
+import logging
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_logger: logging.Logger = logging.getLogger()
+
+DEFAULT_WINDOW_WIDTH = 528
+DEFAULT_WINDOW_HEIGHT = 880
+
+# Written to the profile, so that every browser in the pool behaves the same
+# way as `firefox --screenshot` did: no first-run pages, no updates, 1:1 pixels.
+_PROFILE_PREFS = {
+    "marionette.port": 0,  # 0 means "pick a free port and write it to MarionetteActivePort"
+    "browser.shell.checkDefaultBrowser": False,
+    "browser.startup.homepage_override.mstone": "ignore",
+    "browser.startup.page": 0,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "app.update.enabled": False,
+    "app.update.auto": False,
+    "layout.css.devPixelsPerPx": "1.0",
+    "toolkit.telemetry.reportingpolicy.firstRun": False,
+}
+
+
+class BrowserPoolError(Exception):
+    """Raised when a pooled browser cannot be started or fails to render."""
+    pass
+
+
+class _MarionetteClient:
+    """Minimal synchronous Marionette client, just enough to take screenshots."""
+
+    def __init__(self, port: int, timeout: float):
+        self._sock = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+        self._reader = self._sock.makefile("rb")
+        self._last_id = 0
+        # The server starts by sending a greeting with its protocol version
+        greeting = self._receive()
+        if greeting.get("marionetteProtocol", 0) < 3:
+            raise BrowserPoolError(f"Unsupported Marionette protocol: {greeting}")
+
+    def _send(self, message: List[Any]) -> None:
+        data = json.dumps(message).encode("utf-8")
+        self._sock.sendall(str(len(data)).encode("ascii") + b":" + data)
+
+    def _receive(self) -> Any:
+        length_digits = b""
+        while True:
+            c = self._reader.read(1)
+            if not c:
+                raise BrowserPoolError("Marionette connection closed")
+            if c == b":":
+                break
+            length_digits += c
+        data = self._reader.read(int(length_digits))
+        return json.loads(data.decode("utf-8"))
+
+    def command(self, name: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        self._last_id += 1
+        message_id = self._last_id
+        self._send([0, message_id, name, params or {}])
+        while True:
+            response = self._receive()
+            # Skip anything that isn't the response to this command
+            if response[0] == 1 and response[1] == message_id:
+                break
+        error, result = response[2], response[3]
+        if error:
+            raise BrowserPoolError(f"{name} failed: {error.get('error')}: {error.get('message')}")
+        return result
+
+    def set_timeout(self, timeout: float) -> None:
+        self._sock.settimeout(timeout)
+
+    def close(self) -> None:
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+@dataclass
+class _PooledBrowser:
+    process: subprocess.Popen
+    profile_dir: Path
+    client: _MarionetteClient
+    window_width: int
+    started_at: float = field(default_factory=time.monotonic)
+    renders: int = 0
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+
+class BrowserPool:
+    """
+    A bounded pool of warm headless Firefox instances.
+
+    Args:
+        size: Maximum number of browser processes alive at once
+        max_renders_per_browser: Recycle a browser after this many screenshots
+        window_width: Width of the viewport, in pixels (the device width)
+        window_height: Initial height of the viewport (the page is captured in full anyway)
+        startup_timeout: Seconds to wait for a new browser to accept connections
+        render_timeout: Seconds to wait for a single page load + screenshot
+        firefox_binary: The Firefox executable to launch
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_renders_per_browser: int = 200,
+        window_width: int = DEFAULT_WINDOW_WIDTH,
+        window_height: int = DEFAULT_WINDOW_HEIGHT,
+        startup_timeout: float = 30,
+        render_timeout: float = 60,
+        firefox_binary: str = "firefox",
+    ):
+        if size < 1:
+            raise ValueError("Browser pool size must be at least 1")
+        self.size = size
+        self.max_renders_per_browser = max_renders_per_browser
+        self.window_width = window_width
+        self.window_height = window_height
+        self.startup_timeout = startup_timeout
+        self.render_timeout = render_timeout
+        self.firefox_binary = firefox_binary
+
+        self._idle: "queue.LifoQueue[_PooledBrowser]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Notified when a browser goes back to `_idle`, or a slot is freed for a new one
+        self._available = threading.Condition(self._lock)
+        self._alive_count = 0
+        self._closed = False
+        self._stats = {"renders": 0, "launched": 0, "recycled": 0, "discarded": 0}
+
+    def _launch(self) -> _PooledBrowser:
+        profile_dir = Path(tempfile.mkdtemp(prefix="eink-firefox-"))
+        prefs = "\n".join(
+            f"user_pref({json.dumps(k)}, {json.dumps(v)});" for k, v in _PROFILE_PREFS.items()
+        )
+        (profile_dir / "user.js").write_text(prefs + "\n", encoding="utf-8")
+
+        process = subprocess.Popen(
+            [
+                self.firefox_binary,
+                "--headless",
+                "--marionette",
+                "--no-remote",
+                "--profile",
+                str(profile_dir),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            port_file = profile_dir / "MarionetteActivePort"
+            deadline = time.monotonic() + self.startup_timeout
+            client = None
+            while client is None:
+                if process.poll() is not None:
+                    raise BrowserPoolError(f"Firefox exited during startup with code {process.returncode}")
+                if time.monotonic() > deadline:
+                    raise BrowserPoolError(f"Firefox did not start within {self.startup_timeout} seconds")
+                if port_file.exists() and port_file.read_text().strip():
+                    try:
+                        client = _MarionetteClient(
+                            port=int(port_file.read_text().strip()),
+                            timeout=self.render_timeout,
+                        )
+                        break
+                    except OSError:
+                        pass
+                time.sleep(0.1)
+            client.command("WebDriver:NewSession", {"capabilities": {"pageLoadStrategy": "normal"}})
+            client.command(
+                "WebDriver:SetWindowRect",
+                {"width": self.window_width, "height": self.window_height},
+            )
+        except Exception:
+            process.kill()
+            process.wait()
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+
+        with self._lock:
+            self._stats["launched"] += 1
+        _logger.info(f"Browser pool: started Firefox (pid {process.pid})")
+        return _PooledBrowser(process=process, profile_dir=profile_dir, client=client, window_width=self.window_width)
+
+    def _close_browser(self, browser: _PooledBrowser) -> None:
+        try:
+            if browser.is_alive():
+                browser.client.set_timeout(5)
+                browser.client.command("Marionette:Quit", {"flags": ["eForceQuit"]})
+        except Exception:
+            pass
+        browser.client.close()
+        try:
+            browser.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            browser.process.kill()
+            browser.process.wait()
+        shutil.rmtree(browser.profile_dir, ignore_errors=True)
+        self._free_slot()
+
+    def _free_slot(self) -> None:
+        """A browser was closed, or failed to start: a waiter may launch another one."""
+        with self._available:
+            self._alive_count -= 1
+            self._available.notify()
+
+    def _put_idle(self, browser: _PooledBrowser) -> None:
+        with self._available:
+            self._idle.put(browser)
+            self._available.notify()
+
+    def _acquire(self) -> _PooledBrowser:
+        deadline = time.monotonic() + self.render_timeout
+        while True:
+            if self._closed:
+                raise BrowserPoolError("Browser pool is shut down")
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._available:
+                if self._alive_count < self.size:
+                    self._alive_count += 1
+                    break
+                # The pool is at its size limit: wait for a browser to be released,
+                # or closed (discarded or recycled), which makes room for a new one.
+                # Both notify under this lock, so checking `_idle` here misses neither.
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BrowserPoolError(f"No browser became available within {self.render_timeout} seconds")
+                if self._idle.empty():
+                    self._available.wait(timeout=remaining)
+        try:
+            return self._launch()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _release(self, browser: _PooledBrowser) -> None:
+        if self._closed:
+            self._close_browser(browser)
+            return
+        if browser.renders >= self.max_renders_per_browser:
+            _logger.info(f"Browser pool: recycling Firefox (pid {browser.process.pid}) after {browser.renders} renders")
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._close_browser(browser)
+            return
+        self._put_idle(browser)
+
+    def screenshot(self, url: str, window_width: Optional[int] = None) -> bytes:
+        """
+        Load `url` in one of the pooled browsers and capture the full page.
+
+        Args:
+            url: The page to load, usually a `file://` URL
+            window_width: Width of the viewport for this page, if not the pool's own
+
+        Returns:
+            The screenshot, as PNG-encoded bytes
+
+        Raises:
+            BrowserPoolError: If no browser could be started or the render failed
+        """
+        browser = self._acquire()
+        try:
+            browser.client.set_timeout(self.render_timeout)
+            window_width = window_width or self.window_width
+            if browser.window_width != window_width:
+                browser.client.command(
+                    "WebDriver:SetWindowRect",
+                    {"width": window_width, "height": self.window_height},
+                )
+                browser.window_width = window_width
+            browser.client.command("WebDriver:Navigate", {"url": url})
+            result = browser.client.command("WebDriver:TakeScreenshot", {"full": True, "hash": False})
+        except Exception as ex:
+            # Don't put a browser in an unknown state back into the pool
+            with self._lock:
+                self._stats["discarded"] += 1
+            self._close_browser(browser)
+            if isinstance(ex, BrowserPoolError):
+                raise
+            raise BrowserPoolError(f"Screenshot of {url} failed: {ex}") from ex
+        browser.renders += 1
+        with self._lock:
+            self._stats["renders"] += 1
+        self._release(browser)
+        return base64.b64decode(result["value"])
+
+    def warm_up(self, count: Optional[int] = None) -> None:
+        """Start browsers ahead of time, so the first render doesn't pay for the boot."""
+        count = self.size if count is None else min(count, self.size)
+        while self._idle.qsize() < count:
+            with self._lock:
+                if self._alive_count >= self.size:
+                    return
+                self._alive_count += 1
+            try:
+                browser = self._launch()
+            except Exception:
+                self._free_slot()
+                raise
+            self._put_idle(browser)
+
+    def health_check(self) -> None:
+        """
+        Ping every idle browser and replace the ones that stopped answering.
+        Browsers that are busy rendering are left alone.
+        """
+        checked: List[_PooledBrowser] = []
+        while True:
+            try:
+                browser = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if not browser.is_alive():
+                    raise BrowserPoolError("process exited")
+                browser.client.set_timeout(5)
+                browser.client.command("WebDriver:GetWindowHandle")
+                checked.append(browser)
+            except Exception as ex:
+                _logger.warning(f"Browser pool: Firefox (pid {browser.process.pid}) failed health check: {ex}")
+                with self._lock:
+                    self._stats["discarded"] += 1
+                self._close_browser(browser)
+        for browser in checked:
+            self._put_idle(browser)
+        try:
+            self.warm_up(count=1)
+        except Exception as ex:
+            _logger.error(f"Browser pool: could not start a replacement browser: {ex}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "alive": self._alive_count,
+                "idle": self._idle.qsize(),
+                "max_renders_per_browser": self.max_renders_per_browser,
+                **self._stats,
+            }
+
+    def shutdown(self) -> None:
+        """Close all idle browsers. Busy browsers are closed when they are released."""
+        with self._available:
+            self._closed = True
+            self._available.notify_all()
+        while True:
+            try:
+                browser = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_browser(browser)
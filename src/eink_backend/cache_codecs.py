@@ -0,0 +1,123 @@
+"""
+How each data type's data is stored in the data cache.
+
+The data cache stores every data type as compact JSON, in the shape its codec
+makes, with the codec's schema version next to it (see `data_cache.Codec`).
+Lists of records are stored as columns, one array per field, so the field
+names are stored once rather than once per record: the weather's 48 hourlies,
+the chores, the seats.
+
+When a dataclass here changes, bump its codec's `version`, and either add a
+migration from the previous version to `migrations`, or don't: rows written with
+a version that can't be migrated are discarded, and fetched again.
+"""
+
+import datetime
+import logging
+import typing
+from dataclasses import fields
+from typing import Any, Dict, List, Type
+
+from .chores import Chore, ChoreData
+from .data_cache import Codec
+from .efrat_zmanim import ShabbatZmanim
+from .seating import Seat, SeatingData
+from .weather import WeatherDaily, WeatherForecast, WeatherHourly
+
+_logger: logging.Logger = logging.getLogger()
+
+
+def _field_codecs(cls: Type) -> Dict[str, typing.Tuple[Any, Any]]:
+    """The field name -> (encode, decode) of the fields of `cls` that JSON doesn't have a type for."""
+    converters = {}
+    for (name, hint) in typing.get_type_hints(cls).items():
+        # `datetime` is a `date` too, so it goes first
+        if hint is datetime.datetime:
+            converters[name] = (datetime.datetime.isoformat, datetime.datetime.fromisoformat)
+        elif hint is datetime.date:
+            converters[name] = (datetime.date.isoformat, datetime.date.fromisoformat)
+    return converters
+
+
+def encode_record(record: Any) -> Dict[str, Any]:
+    """A dataclass instance, as a dict of JSON values."""
+    converters = _field_codecs(type(record))
+    encoded = {}
+    for field in fields(record):
+        value = getattr(record, field.name)
+        if value is not None and field.name in converters:
+            value = converters[field.name][0](value)
+        encoded[field.name] = value
+    return encoded
+
+
+def decode_record(cls: Type, encoded: Dict[str, Any]) -> Any:
+    """The inverse of `encode_record()`."""
+    converters = _field_codecs(cls)
+    return cls(**{
+        name: converters[name][1](value) if value is not None and name in converters else value
+        for (name, value) in encoded.items()
+    })
+
+
+def encode_columns(cls: Type, records: List[Any]) -> Dict[str, List[Any]]:
+    """A list of dataclass instances, as one list of JSON values per field."""
+    encoded = [encode_record(record) for record in records]
+    return {field.name: [record[field.name] for record in encoded] for field in fields(cls)}
+
+
+def decode_columns(cls: Type, columns: Dict[str, List[Any]]) -> List[Any]:
+    """The inverse of `encode_columns()`."""
+    names = list(columns)
+    return [decode_record(cls, dict(zip(names, values))) for values in zip(*columns.values())]
+
+
+def _encode_weather(forecast: WeatherForecast) -> Dict[str, Any]:
+    return {
+        "current": encode_record(forecast.current),
+        "hourlies": encode_columns(WeatherHourly, forecast.hourlies),
+        "tomorrow": encode_record(forecast.tomorrow),
+    }
+
+
+def _decode_weather(encoded: Dict[str, Any]) -> WeatherForecast:
+    return WeatherForecast(
+        current=decode_record(WeatherHourly, encoded["current"]),
+        hourlies=decode_columns(WeatherHourly, encoded["hourlies"]),
+        tomorrow=decode_record(WeatherDaily, encoded["tomorrow"]),
+    )
+
+
+def _encode_zmanim(zmanim: ShabbatZmanim) -> Dict[str, Any]:
+    # The times are a mix of times of day and texts (e.g. the parasha)
+    return {
+        "name": zmanim.name,
+        "times": {key: value.isoformat() if isinstance(value, datetime.datetime) else value for (key, value) in zmanim.times.items()},
+        "datetimes": [key for (key, value) in zmanim.times.items() if isinstance(value, datetime.datetime)],
+    }
+
+
+def _decode_zmanim(encoded: Dict[str, Any]) -> ShabbatZmanim:
+    datetimes = set(encoded["datetimes"])
+    return ShabbatZmanim(
+        name=encoded["name"],
+        times={key: datetime.datetime.fromisoformat(value) if key in datetimes else value for (key, value) in encoded["times"].items()},
+    )
+
+
+CODECS: Dict[str, Codec] = {
+    "zmanim": Codec(version=1, encode=_encode_zmanim, decode=_decode_zmanim),
+    "weather": Codec(version=1, encode=_encode_weather, decode=_decode_weather),
+    # The rendered HTML
+    "calendar": Codec(version=1, encode=str, decode=str),
+    "chores": Codec(
+        version=1,
+        encode=lambda data: {"chores": encode_columns(Chore, data.chores), "error": data.error},
+        decode=lambda encoded: ChoreData(chores=decode_columns(Chore, encoded["chores"]), error=encoded["error"]),
+    ),
+    "seating": Codec(
+        version=1,
+        encode=lambda data: {"seats": encode_columns(Seat, data.seats), "error": data.error},
+        decode=lambda encoded: SeatingData(seats=decode_columns(Seat, encoded["seats"]), error=encoded["error"]),
+    ),
+}
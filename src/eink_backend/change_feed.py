@@ -0,0 +1,127 @@
+"""
+Push changes to the displays, instead of having them poll on a fixed interval.
+
+`ChangeFeed` holds one small snapshot of the display's state: the current frame
+hash, the `ETag` of each color, and what changed last. Every change bumps its
+`sequence`. Clients wait for a sequence newer than the one they saw:
+
+- long-poll (`/changes/wait`): the request blocks until there's a change, or
+  until its timeout
+- Server-Sent Events (`/changes/stream`): one long response, with an event per
+  change (and the sequence as the event id, so a reconnecting client resumes
+  from `Last-Event-ID`)
+
+The sequence is only held in memory, so it starts over when the backend restarts.
+A client that saw a sequence newer than the current one saw it before a restart:
+it gets the current snapshot right away, rather than wait for the new sequence
+to catch up.
+
+All waiting clients share a single `asyncio.Event`, which is set (and replaced)
+on each change. So a connection costs one coroutine and no queue; a slow
+client just skips to the latest snapshot.
+
+Changes are published from the scheduler's threads, so `publish()` is
+thread-safe and hands the wake-up over to the event loop.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+_logger: logging.Logger = logging.getLogger()
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._snapshot: Dict[str, Any] = {
+            "sequence": 0,
+            "frame_hash": None,
+            "etags": {},
+            "changed": [],
+            "changed_at": None,
+        }
+        self._listeners = 0
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Wake up the clients waiting on `loop`. Call once, from the event loop."""
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._snapshot)
+
+    def publish_frame(self, frame_hash: str, etags: Dict[str, str]) -> bool:
+        """
+        Publish the frame that's now current. Does nothing if it's the frame that was
+        already published.
+
+        Returns:
+            True if the frame changed
+        """
+        with self._lock:
+            if frame_hash == self._snapshot["frame_hash"]:
+                return False
+            self._bump(["frame"], frame_hash=frame_hash, etags=dict(etags))
+        return True
+
+    def publish_data(self, data_types: List[str]) -> None:
+        """Publish that fresh data, of data types that are on the display, was cached."""
+        if not data_types:
+            return
+        with self._lock:
+            self._bump(list(data_types))
+
+    def _bump(self, changed: List[str], **fields: Any) -> None:
+        """Update the snapshot and wake up the waiting clients. Call with the lock held."""
+        self._snapshot.update(
+            fields,
+            sequence=self._snapshot["sequence"] + 1,
+            changed=changed,
+            changed_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        )
+        _logger.debug(f"Change {self._snapshot['sequence']}: {', '.join(changed)}")
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        changed = self._changed
+        self._changed = asyncio.Event()
+        changed.set()
+
+    async def wait(self, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait until there's a change after sequence `since`. A `since` newer than the
+        current sequence is from before a restart, so the current snapshot is
+        returned right away.
+
+        Returns:
+            The snapshot, or None if nothing changed within `timeout` seconds
+        """
+        with self._lock:
+            self._listeners += 1
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while True:
+                snapshot = self.snapshot()
+                if snapshot["sequence"] != since:
+                    return snapshot
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0 or self._changed is None:
+                    return None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return None
+        finally:
+            with self._lock:
+                self._listeners -= 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"listeners": self._listeners, **self._snapshot}
@@ -138,7 +138,8 @@ def render_chores(chores: List[Chore], now_utc: datetime, color: str) -> str:
     # - unassigned items are last
     # - by the assignee's database ordinal
     # - sort by how often (more often, i.e. lower frequency_in_weeks is sooner)
-    chores.sort(key=lambda c: (not c.assignee, c.assignee_ordinal, c.frequency_in_weeks))
+    # (into a new list, since the cached chores are shared by concurrent renders)
+    chores = sorted(chores, key=lambda c: (not c.assignee, c.assignee_ordinal, c.frequency_in_weeks))
 
     chore_template = Template(
         textwrap.dedent(
@@ -0,0 +1,151 @@
+"""
+Validators for conditional requests (`ETag`, `Last-Modified`) of the rendered frames.
+
+Most polls of `/eink/{color}` find the same frame they got last time. With a
+strong `ETag` derived from the frame's content, a client that sends it back in
+`If-None-Match` gets a `304 Not Modified` of a few hundred bytes instead of the
+whole PNG.
+
+The ETag is a hash of the file's bytes, so a frame that's rendered again (or
+promoted from the pre-rendered ones) with the same pixels keeps its ETag. The
+hashes are kept by `ContentTags`, keyed by the file's path, size and
+modification time, so answering a poll only takes a `stat()`, and the file is
+only read once each time it changes.
+"""
+
+import email.utils
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Validators:
+    etag: str
+    """Strong ETag, including the quotes"""
+    last_modified: str
+    """HTTP date"""
+    mtime: float
+
+    def headers(self) -> Dict[str, str]:
+        # no-cache: clients may keep the frame, but have to check back before using it
+        return {"ETag": self.etag, "Last-Modified": self.last_modified, "Cache-Control": "no-cache"}
+
+    @classmethod
+    def from_hash(cls, content_hash: str, mtime: float) -> "Validators":
+        """The validators of a file whose content hash is already known."""
+        return cls(
+            etag=f'"{content_hash}"',
+            last_modified=email.utils.formatdate(mtime, usegmt=True),
+            mtime=mtime,
+        )
+
+    def derive(self, variant: str) -> "Validators":
+        """Validators of another representation of the same file (e.g. its bitplanes)."""
+        tag = hashlib.sha256(f"{self.etag}/{variant}".encode()).hexdigest()[:32]
+        return Validators(etag=f'"{tag}"', last_modified=self.last_modified, mtime=self.mtime)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an `If-None-Match` header matches `etag`. It uses the weak comparison,
+    as RFC 9110 says to for `If-None-Match`, so `W/"x"` matches `"x"`.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def is_not_modified(
+    validators: Validators, if_none_match: Optional[str], if_modified_since: Optional[str]
+) -> bool:
+    """
+    Whether a request with these headers should get a 304. `If-Modified-Since` is
+    only looked at when there's no `If-None-Match`, as RFC 9110 says.
+    """
+    if if_none_match:
+        return etag_matches(if_none_match, validators.etag)
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates only have whole seconds
+        return int(validators.mtime) <= since.timestamp()
+    return False
+
+
+class ContentTags:
+    """
+    The validators of files, hashed once per version of the file.
+
+    Args:
+        max_entries: How many files' hashes to keep
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Any, ...], Validators]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _get(self, key: Tuple[Any, ...]) -> Optional[Validators]:
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            return found
+
+    def cached(self, path: Path) -> Optional[Validators]:
+        """
+        The validators of the file if its current version was already hashed,
+        without hashing it: only a `stat()`, so it can be called on the event loop.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+        """
+        stat = path.stat()
+        return self._get((str(path), stat.st_size, stat.st_mtime_ns))
+
+    def validators(self, path: Path) -> Validators:
+        """
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+        """
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        found = self._get(key)
+        if found is not None:
+            return found
+        with self._lock:
+            self._stats["misses"] += 1
+
+        # The file may be replaced since the `stat()` above: key the hash by the
+        # version of the file that was actually read
+        with path.open("rb") as file:
+            stat = os.fstat(file.fileno())
+            key = (str(path), stat.st_size, stat.st_mtime_ns)
+            found = Validators.from_hash(hashlib.sha256(file.read()).hexdigest()[:32], mtime=stat.st_mtime)
+        with self._lock:
+            self._entries[key] = found
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return found
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._stats}
@@ -2,8 +2,14 @@ import logging
 import sqlite3
 import pickle
 import datetime
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Optional, TypeVar, Callable
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TypeVar, Callable
 
 # Database path in the app directory
 DB_PATH = Path("/app/data_cache.sqlite")
@@ -17,11 +23,188 @@ EXPIRATION_HOURS = {
     "seating": 6,
 }
 
+# How long after its expiration a data type's data is still served (in hours),
+# while it's refreshed in the background, see `get_servable_data()`
+MAX_STALE_HOURS = {
+    "zmanim": 48,
+    "weather": 3,
+    "calendar": 12,
+    "chores": 12,
+    "seating": 12,
+}
+
 T = TypeVar('T')
 
 _logger: logging.Logger = None
 """This is the logger that the data_cache uses"""
 
+# Each thread (the scheduler's, the render workers, the event loop) keeps one
+# connection open, rather than connecting for every query. In WAL mode, readers
+# don't block the writer, or each other. Writes are serialized by `_write_lock`,
+# so they wait for each other here instead of failing with "database is locked".
+#
+# `sqlite3` keeps the prepared statements of each connection, by their SQL, so
+# the queries below are fixed strings with parameters.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # Durable at each checkpoint rather than each commit; fine for a cache
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=67108864",
+    # In KiB, when negative
+    "PRAGMA cache_size=-8192",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+_STATEMENT_CACHE_SIZE = 32
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_connections_lock = threading.Lock()
+# thread -> its connection
+_open_connections: Dict[threading.Thread, sqlite3.Connection] = {}
+# Bumped by `close_connections()`, so the threads open new ones
+_generation = 0
+
+
+# The memory tier: the deserialized data of each data type, with its timestamp
+# and expiration, so a warm render does no SQLite reads and no decoding. Writes
+# go through both tiers. The objects are shared by every reader, so they must not
+# be modified.
+_memory: Dict[str, Tuple[Any, datetime.datetime, datetime.datetime]] = {}
+_memory_lock = threading.Lock()
+_memory_stats = {"hits": 0, "misses": 0}
+
+
+@dataclass(frozen=True)
+class Codec:
+    """
+    How a data type's data is stored: `encode` turns it into JSON values, and
+    `decode` turns them back. Rows are stored with the `version` they were
+    written with.
+    """
+    version: int
+    encode: Callable[[Any], Any]
+    decode: Callable[[Any], Any]
+    migrations: Dict[int, Callable[[Any], Any]] = field(default_factory=dict)
+    """Version -> a function from the encoded data of that version to the encoded data of the next one"""
+
+
+JSON_CODEC = Codec(version=1, encode=lambda data: data, decode=lambda encoded: encoded)
+"""For the data types without a codec of their own: their data is JSON values already"""
+
+# data type -> its codec, see `register_codecs()`
+_codecs: Dict[str, Codec] = {}
+# data type -> the size of its last stored row, and how long its last encode and decode took
+_codec_stats: Dict[str, Dict[str, Any]] = {}
+_codec_stats_lock = threading.Lock()
+
+_DISCARDED = object()
+
+
+def register_codecs(codecs: Dict[str, Codec]) -> None:
+    """Set the codecs of data types (see `cache_codecs.CODECS`)."""
+    _codecs.update(codecs)
+
+
+def _record_codec_stat(data_type: str, **stats: Any) -> None:
+    with _codec_stats_lock:
+        _codec_stats.setdefault(data_type, {}).update(stats)
+
+
+def encode(data_type: str, data: Any) -> Tuple[bytes, int]:
+    """
+    The bytes to store for `data_type`.
+
+    Returns:
+        The bytes, and the schema version they're in
+    """
+    codec = _codecs.get(data_type, JSON_CODEC)
+    started = time.perf_counter()
+    # With the keys sorted, the same data is always the same bytes, with the same `content_hash()`
+    blob = json.dumps(codec.encode(data), separators=(",", ":"), ensure_ascii=False, sort_keys=True).encode()
+    _record_codec_stat(data_type, version=codec.version, bytes=len(blob), encode_ms=round((time.perf_counter() - started) * 1000, 3))
+    return (blob, codec.version)
+
+
+def content_hash(blob: bytes) -> str:
+    """The hash of the stored bytes of some data, to tell whether a refresh changed it."""
+    return hashlib.sha256(blob).hexdigest()[:32]
+
+
+def decode(data_type: str, blob: bytes, version: int) -> Any:
+    """
+    The inverse of `encode()`. Data of an older version is migrated to the current one.
+
+    Raises:
+        ValueError: If the data can't be migrated (e.g. it's of a newer version, or
+            there's no migration from its version), or decoded
+    """
+    codec = _codecs.get(data_type, JSON_CODEC)
+    started = time.perf_counter()
+    try:
+        encoded = json.loads(blob)
+        if version > codec.version:
+            raise ValueError(f"version {version} is newer than {codec.version}")
+        for from_version in range(version, codec.version):
+            if from_version not in codec.migrations:
+                raise ValueError(f"no migration from version {from_version}")
+            encoded = codec.migrations[from_version](encoded)
+        data = codec.decode(encoded)
+    except ValueError:
+        raise
+    except Exception as ex:
+        raise ValueError(f"can't decode: {ex!r}") from ex
+    _record_codec_stat(data_type, decode_ms=round((time.perf_counter() - started) * 1000, 3))
+    return data
+
+
+def _connection() -> sqlite3.Connection:
+    """This thread's connection to the database, opened the first time it's needed."""
+    key = (str(DB_PATH), _generation)
+    if getattr(_local, "key", None) == key:
+        return _local.connection
+    # Only this thread uses it, but `close_connections()` may close it from another
+    conn = sqlite3.connect(str(DB_PATH), cached_statements=_STATEMENT_CACHE_SIZE, check_same_thread=False)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    _local.connection = conn
+    _local.key = key
+    with _connections_lock:
+        # Close the connections of the threads that are gone
+        for thread in [thread for thread in _open_connections if not thread.is_alive()]:
+            _open_connections.pop(thread).close()
+        _open_connections[threading.current_thread()] = conn
+    return conn
+
+
+@contextmanager
+def _transaction() -> Iterator[sqlite3.Connection]:
+    """A write transaction on this thread's connection, committed at the end, or rolled back on an error."""
+    conn = _connection()
+    with _write_lock:
+        with conn:
+            yield conn
+
+
+def invalidate_memory(data_type: Optional[str] = None) -> None:
+    """Drop `data_type` (or every data type) from the memory tier, so it's read from SQLite again."""
+    with _memory_lock:
+        if data_type is None:
+            _memory.clear()
+        else:
+            _memory.pop(data_type, None)
+
+
+def close_connections() -> None:
+    """Close every thread's connection (e.g. on shutdown). Threads reconnect on their next query."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        connections = list(_open_connections.values())
+        _open_connections.clear()
+    for conn in connections:
+        conn.close()
+
 def _humanize_age(now_utc: datetime.datetime, timestamp: datetime.datetime) -> str:
     """Return a compact human-readable age string."""
     delta_seconds = max(0, int((now_utc - timestamp).total_seconds()))
@@ -51,39 +234,38 @@ def init_db(logger: logging.Logger):
 
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS data_cache (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data_type TEXT NOT NULL UNIQUE,
-            data BLOB NOT NULL,
-            timestamp DATETIME NOT NULL,
-            expiration DATETIME NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    with _transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS data_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data_type TEXT NOT NULL UNIQUE,
+                data BLOB NOT NULL,
+                timestamp DATETIME NOT NULL,
+                expiration DATETIME NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(data_cache)")}
+        if "schema_version" not in columns:
+            # The rows from before there were codecs are pickles, with no version
+            conn.execute("ALTER TABLE data_cache ADD COLUMN schema_version INTEGER")
+        if "content_hash" not in columns:
+            # Older rows count as changed when they were last fetched, and on their next fetch
+            conn.execute("ALTER TABLE data_cache ADD COLUMN content_hash TEXT")
+            conn.execute("ALTER TABLE data_cache ADD COLUMN changed_at DATETIME")
 
 
 def clean_expired_records(older_than_days: int = 30):
     """Delete cached data records that have been expired for more than the specified days."""
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.cursor()
-
     cutoff_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
 
-    cursor.execute(
-        "DELETE FROM data_cache WHERE expiration < ?",
-        (cutoff_date,)
-    )
-
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with _transaction() as conn:
+        cursor = conn.execute(
+            "DELETE FROM data_cache WHERE expiration < ?",
+            (cutoff_date,)
+        )
+        deleted_count = cursor.rowcount
+    invalidate_memory()
 
     if deleted_count > 0:
         _logger.info(f"Deleted {deleted_count} expired cache records older than {older_than_days} days")
@@ -101,32 +283,174 @@ def get_cached_data(data_type: str, now_utc: datetime.datetime) -> Optional[tupl
         tuple: (data, timestamp) if valid cached data exists, None otherwise.
                 timestamp is always UTC timezone-aware.
     """
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.cursor()
+    found = _get_entry(data_type)
+    if found is not None:
+        (data, timestamp, expiration) = found
+        if expiration > now_utc:
+            _logger.debug(f"get_cached_data(): fetched {data_type} data from cache with timestamp {timestamp.isoformat()}")
+            return (data, timestamp)
+
+    _logger.debug(f"get_cached_data(): no valid cached data for {data_type} (none, or may have already expired)")
+    return None
+
+
+@dataclass(frozen=True)
+class CachedData:
+    data: Any
+    timestamp: datetime.datetime
+    """When the data was cached (UTC timezone-aware)"""
+    expiration: datetime.datetime
+    """UTC timezone-aware"""
+    stale: bool
+    """The data has expired, but it's still within `MAX_STALE_HOURS` of its expiration"""
+
+
+def get_servable_data(data_type: str, now_utc: datetime.datetime) -> Optional[CachedData]:
+    """
+    The cached data, if it hasn't expired, or if it expired less than
+    `MAX_STALE_HOURS` ago, in which case it's marked `stale`: it's better to show
+    it than nothing, while it's being refreshed.
+
+    Returns:
+        None if there's no data, or it's been expired for too long
+    """
+    found = _get_entry(data_type)
+    if found is None:
+        return None
+    (data, timestamp, expiration) = found
+    if now_utc >= expiration + datetime.timedelta(hours=MAX_STALE_HOURS.get(data_type, 0)):
+        _logger.debug(f"get_servable_data(): the cached {data_type} data expired at {expiration.isoformat()}, too long ago")
+        return None
+    return CachedData(data=data, timestamp=timestamp, expiration=expiration, stale=expiration <= now_utc)
 
-    cursor.execute(
-        "SELECT data, timestamp FROM data_cache WHERE data_type = ? AND expiration > ?",
-        (data_type, now_utc)
-    )
 
-    result = cursor.fetchone()
-    conn.close()
+def get_latest_data(data_type: str) -> Optional[tuple[Any, datetime.datetime]]:
+    """
+    The cached data, however long ago it expired: for renders of other times than
+    now (previews, timelines), which the expiration has nothing to do with.
 
-    if result:
-        data_blob, timestamp_str = result
-        data = pickle.loads(data_blob)
-        # Parse ISO format and explicitly set UTC timezone if not already present
-        timestamp = datetime.datetime.fromisoformat(timestamp_str)
-        if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
-        _logger.debug(f"get_cached_data(): fetched {data_type} data from cache with timestamp {timestamp.isoformat()}")
-        return (data, timestamp)
+    Returns:
+        tuple: (data, timestamp), or None if there's no data
+    """
+    found = _get_entry(data_type)
+    if found is None:
+        return None
+    return (found[0], found[1])
+
+
+def _get_entry(data_type: str) -> Optional[Tuple[Any, datetime.datetime, datetime.datetime]]:
+    """The data of `data_type`, with its timestamp and expiration, from the memory tier, or else from SQLite."""
+    with _memory_lock:
+        found = _memory.get(data_type)
+        _memory_stats["hits" if found is not None else "misses"] += 1
+    if found is not None:
+        return found
+
+    result = _connection().execute(
+        "SELECT data, timestamp, expiration, schema_version FROM data_cache WHERE data_type = ?",
+        (data_type,)
+    ).fetchone()
+    if not result:
+        return None
+    data_blob, timestamp_str, expiration_str, schema_version = result
+    data = _load(data_type, data_blob, schema_version, timestamp_str)
+    if data is _DISCARDED:
+        return None
+    # Parse ISO format and explicitly set UTC timezone if not already present
+    found = (data, _parse_utc(timestamp_str), _parse_utc(expiration_str))
+    with _memory_lock:
+        # Unless a newer save got there first
+        if data_type not in _memory:
+            _memory[data_type] = found
+    return found
+
+
+def _load(data_type: str, data_blob: bytes, schema_version: Optional[int], timestamp_str: str) -> Any:
+    """
+    The data of a row, or `_DISCARDED` if it can't be read anymore, in which
+    case the row is deleted, so the data type is fetched again.
 
-    _logger.debug(f"get_cached_data(): no valid cached data for {data_type} (none, or may have already expired)")
-    return None
+    Rows of an older schema version are written again in the current one, once,
+    as are the rows from before there were codecs (with no `schema_version`),
+    which are pickles.
+    """
+    current_version = _codecs.get(data_type, JSON_CODEC).version
+    try:
+        if schema_version is None:
+            data = pickle.loads(data_blob)
+        else:
+            data = decode(data_type, data_blob, schema_version)
+        if schema_version != current_version:
+            (new_blob, new_version) = encode(data_type, data)
+    except Exception as ex:
+        _logger.warning(f"Discarding the cached {data_type} data (schema version {schema_version}): {ex}")
+        with _codec_stats_lock:
+            stats = _codec_stats.setdefault(data_type, {})
+            stats["discarded"] = stats.get("discarded", 0) + 1
+        with _transaction() as conn:
+            conn.execute("DELETE FROM data_cache WHERE data_type = ? AND timestamp = ?", (data_type, timestamp_str))
+        return _DISCARDED
+
+    if schema_version != current_version:
+        with _transaction() as conn:
+            # Unless a newer save got there first
+            conn.execute(
+                "UPDATE data_cache SET data = ?, schema_version = ?, content_hash = ? WHERE data_type = ? AND timestamp = ?",
+                (new_blob, new_version, content_hash(new_blob), data_type, timestamp_str)
+            )
+        _logger.info(f"Migrated the cached {data_type} data from schema version {schema_version} to {new_version} ({len(data_blob)} -> {len(new_blob)} bytes)")
+    return data
 
 
-def save_cached_data(data_type: str, data: T, now_utc: datetime.datetime) -> None:
+@dataclass(frozen=True)
+class CacheEntryInfo:
+    """What's known about a cached data type, without loading its data."""
+    data_type: str
+    timestamp: datetime.datetime
+    """When the data was fetched and cached (UTC timezone-aware)"""
+    expiration: datetime.datetime
+    """UTC timezone-aware"""
+    changed_at: datetime.datetime
+    """When the data was last fetched different from what was cached before (UTC timezone-aware)"""
+    content_hash: Optional[str]
+    """See `content_hash()`. None for rows from before there were content hashes"""
+
+
+def _parse_utc(value: str) -> datetime.datetime:
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def get_entries() -> List[CacheEntryInfo]:
+    """The timestamp and expiration of each cached data type, whether it has expired or not."""
+    rows = _connection().execute(
+        "SELECT data_type, timestamp, expiration, COALESCE(changed_at, timestamp), content_hash FROM data_cache"
+    ).fetchall()
+    return [
+        CacheEntryInfo(
+            data_type=data_type,
+            timestamp=_parse_utc(timestamp_str),
+            expiration=_parse_utc(expiration_str),
+            changed_at=_parse_utc(changed_at_str),
+            content_hash=data_hash,
+        )
+        for data_type, timestamp_str, expiration_str, changed_at_str, data_hash in rows
+    ]
+
+
+def get_expirations() -> Dict[str, datetime.datetime]:
+    """
+    When each cached data type expires, whether it already has or not.
+
+    Returns:
+        dict: data type -> expiration time (UTC timezone-aware)
+    """
+    return {entry.data_type: entry.expiration for entry in get_entries()}
+
+
+def save_cached_data(data_type: str, data: T, now_utc: datetime.datetime) -> bool:
     """
     Save data to cache with its expiration time.
 
@@ -134,34 +458,47 @@ def save_cached_data(data_type: str, data: T, now_utc: datetime.datetime) -> Non
         data_type: The type of data (e.g., 'weather', 'zmanim')
         data: The data to cache
         now_utc: The reference time to calculate expiration (should be UTC timezone-aware).
+
+    Returns:
+        Whether the data changed: False if it's the same as the cached data (by
+        its `content_hash()`), in which case only its timestamp and expiration
+        are updated, and its `changed_at` stays as it was
     """
     if data_type not in EXPIRATION_HOURS:
         _logger.warning(f"Unknown data type: {data_type}")
-        return
-
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.cursor()
+        return False
 
     expiration = now_utc + datetime.timedelta(hours=EXPIRATION_HOURS[data_type])
 
-    data_blob = pickle.dumps(data)
-
-    cursor.execute(
-        """
-        INSERT INTO data_cache (data_type, data, timestamp, expiration)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(data_type) DO UPDATE SET
-            data = excluded.data,
-            timestamp = excluded.timestamp,
-            expiration = excluded.expiration
-        """,
-        (data_type, data_blob, now_utc.isoformat(), expiration.isoformat())
-    )
-
-    conn.commit()
-    conn.close()
+    (data_blob, schema_version) = encode(data_type, data)
+    data_hash = content_hash(data_blob)
+
+    with _transaction() as conn:
+        previous = conn.execute(
+            "SELECT content_hash FROM data_cache WHERE data_type = ?",
+            (data_type,)
+        ).fetchone()
+        changed = previous is None or previous[0] != data_hash
+        conn.execute(
+            """
+            INSERT INTO data_cache (data_type, data, timestamp, expiration, schema_version, content_hash, changed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(data_type) DO UPDATE SET
+                data = excluded.data,
+                timestamp = excluded.timestamp,
+                expiration = excluded.expiration,
+                schema_version = excluded.schema_version,
+                content_hash = excluded.content_hash,
+                changed_at = CASE WHEN ? THEN excluded.changed_at ELSE data_cache.changed_at END
+            """,
+            (data_type, data_blob, now_utc.isoformat(), expiration.isoformat(), schema_version, data_hash, now_utc.isoformat(), changed)
+        )
+        # Still under the write lock, so the two tiers are updated in the same order
+        with _memory_lock:
+            _memory[data_type] = (data, now_utc, expiration)
 
-    _logger.info(f"Cached {data_type} data, expires at {expiration.isoformat()}")
+    _logger.info(f"Cached {data_type} data{'' if changed else ' (unchanged)'}, expires at {expiration.isoformat()}")
+    return changed
 
 
 def is_data_expired(data_type: str, now_utc: datetime.datetime) -> bool:
@@ -220,3 +557,20 @@ def cache_or_fetch(data_type: str, fetch_fn: Callable[[], T], now_utc: datetime.
         save_cached_data(data_type, data, now_utc=now_utc)
 
     return data
+
+
+def status() -> Dict[str, Any]:
+    """The state of the database connections, the memory tier and the codecs, for `/cache-status`."""
+    with _connections_lock:
+        open_connections = len(_open_connections)
+    with _memory_lock:
+        memory = {"data_types": sorted(_memory), **_memory_stats}
+    with _codec_stats_lock:
+        codecs = {data_type: dict(stats) for (data_type, stats) in sorted(_codec_stats.items())}
+    return {
+        "db_path": str(DB_PATH),
+        "open_connections": open_connections,
+        "memory_tier": memory,
+        "codecs": codecs,
+        "journal_mode": _connection().execute("PRAGMA journal_mode").fetchone()[0],
+    }
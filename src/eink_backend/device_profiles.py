@@ -0,0 +1,168 @@
+"""
+Named device profiles, so one backend can drive several panels.
+
+A profile describes one kind of panel: its size and mounting orientation, which
+color planes it has, which set of layouts it shows, and the threshold that turns
+a screenshot into 1-bit planes. Every profile gets its own output directory.
+
+The data collection and the template values are shared by all profiles; only
+the template substitution and the rasterization are done per profile. So another
+display costs one more screenshot per frame, not another run of the pipeline.
+
+Profiles are read from a JSON file (see `load_profiles()`):
+
+    {
+        "profiles": [
+            {"name": "kitchen", "width": 800, "height": 480, "rotate": 90,
+             "colors": ["black"], "template_set": "small"}
+        ]
+    }
+
+There is always a `default` profile: the 528x880 black and red entrance panel,
+whose output stays where it always was. The file may redefine it.
+"""
+
+import json
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+_logger: logging.Logger = logging.getLogger()
+
+DEFAULT_PROFILE_NAME = "default"
+
+PLANE_COLORS = ("black", "red")
+
+# Above this brightness a pixel is paper
+DEFAULT_THRESHOLD = 200
+
+_VALID_ROTATIONS = (0, 90, 180, 270)
+_VALID_NAME = re.compile(r"^[a-zA-Z_-]+$")
+
+
+@dataclass(frozen=True)
+class DeviceProfile:
+    name: str
+    width: int
+    """Panel width in pixels, in the panel's own orientation"""
+    height: int
+    """Panel height in pixels, in the panel's own orientation"""
+    colors: Tuple[str, ...] = PLANE_COLORS
+    """The color planes the panel has"""
+    template_set: Optional[str] = None
+    """Subdirectory of `assets/` with this profile's layouts; None for the default layouts"""
+    threshold: int = DEFAULT_THRESHOLD
+    rotate: int = 0
+    """Degrees clockwise to turn the rendered layout, for panels mounted sideways or upside down"""
+
+    @property
+    def layout_width(self) -> int:
+        """The width the layout is rendered at, before it's rotated onto the panel."""
+        return self.width if self.rotate in (0, 180) else self.height
+
+    @property
+    def layout_height(self) -> int:
+        return self.height if self.rotate in (0, 180) else self.width
+
+    @property
+    def output_colors(self) -> Tuple[str, ...]:
+        """The images rendered for this profile: its planes, and `joined` for previews."""
+        return (*self.colors, "joined")
+
+    @property
+    def cache_profile(self) -> str:
+        """What goes into the frame cache key, besides the HTML and the color."""
+        parts = [f"{self.width}x{self.height}"]
+        if self.rotate:
+            parts.append(f"rot{self.rotate}")
+        if self.threshold != DEFAULT_THRESHOLD:
+            parts.append(f"t{self.threshold}")
+        if self.colors != PLANE_COLORS:
+            parts.append("+".join(self.colors))
+        return "-".join(parts)
+
+    def source_color(self, color: str) -> str:
+        """
+        The color of the HTML that `color` is rendered from. A panel without a red
+        plane gets its black plane from the joined HTML, so red content shows up in
+        black instead of disappearing.
+        """
+        if color == "black" and "red" not in self.colors:
+            return "joined"
+        return color
+
+    def template_path(self, layout_path: Path) -> Path:
+        """This profile's version of a layout from `assets/`."""
+        if not self.template_set:
+            return layout_path
+        return layout_path.parent / self.template_set / layout_path.name
+
+    def output_dir(self, base_dir: Path) -> Path:
+        """Where this profile's images go. The default profile writes to `base_dir` itself."""
+        if self.name == DEFAULT_PROFILE_NAME:
+            return base_dir
+        return base_dir / "profiles" / self.name
+
+
+DEFAULT_PROFILE = DeviceProfile(name=DEFAULT_PROFILE_NAME, width=528, height=880)
+
+
+def _parse_profile(raw: Dict[str, Any]) -> DeviceProfile:
+    raw = dict(raw)
+    try:
+        name = str(raw.pop("name"))
+        width = int(raw.pop("width"))
+        height = int(raw.pop("height"))
+    except KeyError as ex:
+        raise ValueError(f"Device profile {raw} is missing {ex}")
+    colors = tuple(raw.pop("colors", PLANE_COLORS))
+    profile = DeviceProfile(
+        name=name,
+        width=width,
+        height=height,
+        colors=colors,
+        template_set=raw.pop("template_set", None),
+        threshold=int(raw.pop("threshold", DEFAULT_THRESHOLD)),
+        rotate=int(raw.pop("rotate", 0)),
+    )
+    if not _VALID_NAME.match(profile.name):
+        raise ValueError(f"Device profile name {profile.name!r} may only have letters, '_' and '-'")
+    if profile.width <= 0 or profile.height <= 0:
+        raise ValueError(f"Device profile {profile.name} has a bad size: {profile.width}x{profile.height}")
+    if profile.rotate not in _VALID_ROTATIONS:
+        raise ValueError(f"Device profile {profile.name} has a bad rotation: {profile.rotate}")
+    if not profile.colors or not set(profile.colors) <= set(PLANE_COLORS) or "black" not in profile.colors:
+        raise ValueError(f"Device profile {profile.name} has bad colors: {profile.colors}")
+    if profile.template_set and not _VALID_NAME.match(profile.template_set):
+        raise ValueError(f"Device profile {profile.name} has a bad template set: {profile.template_set!r}")
+    if raw:
+        _logger.warning(f"Device profile {profile.name}: ignoring unknown settings {sorted(raw)}")
+    return profile
+
+
+def load_profiles(path: Optional[Path] = None) -> Dict[str, DeviceProfile]:
+    """
+    Load the device profiles, with the default profile first.
+
+    Args:
+        path: The JSON file of profiles. If None, there's only the default profile.
+
+    Raises:
+        ValueError: If a profile is malformed, or two profiles have the same name
+    """
+    profiles = {DEFAULT_PROFILE_NAME: DEFAULT_PROFILE}
+    if path is None:
+        return profiles
+    document = json.loads(path.read_text(encoding="utf-8"))
+    raw_profiles = document["profiles"] if isinstance(document, dict) else document
+    seen = set()
+    for raw in raw_profiles:
+        profile = _parse_profile(raw)
+        if profile.name in seen:
+            raise ValueError(f"Device profile {profile.name} is defined twice in {path}")
+        seen.add(profile.name)
+        profiles[profile.name] = profile
+    _logger.info(f"Loaded device profiles from {path}: {', '.join(profiles)}")
+    return profiles
@@ -0,0 +1,148 @@
+"""
+Content-addressed cache of rendered frames.
+
+A frame is identified by a hash of the final HTML, the color and the device
+profile. If the same HTML comes around again (which is most of the time, since
+the data only changes every hour or so) the finished PNG is taken from here and
+the browser, mono conversion and clipping are all skipped.
+
+Each entry can hold several formats of the same frame (e.g. `png`), stored on
+disk as `<key>.<format>`. A small in-memory index keeps the sizes and the LRU
+order, so lookups don't need to touch the disk. Entries are evicted, least
+recently used first, when the cache grows past `max_bytes` or `max_entries`.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .atomic_files import write_atomically
+
+_logger: logging.Logger = logging.getLogger()
+
+
+def frame_cache_key(html_content: str, color: str, profile: str) -> str:
+    """Return the content hash that identifies a frame."""
+    h = hashlib.sha256()
+    for part in (profile, color, html_content):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+@dataclass
+class _Entry:
+    formats: Dict[str, int] = field(default_factory=dict)
+    """Maps a format name to the size in bytes of its file"""
+
+    @property
+    def size(self) -> int:
+        return sum(self.formats.values())
+
+
+class FrameCache:
+    """
+    LRU, size-bounded, on-disk cache of frames with an in-memory index.
+
+    Args:
+        cache_dir: Directory to keep the cached files in
+        max_bytes: Evict entries once the files take more than this
+        max_entries: Evict entries once there are more than this many frames
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 512):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._index: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._load_index()
+
+    def _path(self, key: str, fmt: str) -> Path:
+        return self.cache_dir / f"{key}.{fmt}"
+
+    def _load_index(self) -> None:
+        """Rebuild the index from the files on disk, oldest first."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith(".") and path.name.endswith(".tmp"):
+                # Left behind by a write that was cut short
+                path.unlink(missing_ok=True)
+                continue
+            if path.name.startswith(".") or "." not in path.name:
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files, key=lambda f: f[0]):
+            key, fmt = path.name.split(".", 1)
+            entry = self._index.setdefault(key, _Entry())
+            self._index.move_to_end(key)
+            entry.formats[fmt] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used entries until the limits are met. Call with the lock held."""
+        while self._index and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, entry = self._index.popitem(last=False)
+            for fmt in entry.formats:
+                try:
+                    self._path(key, fmt).unlink()
+                except FileNotFoundError:
+                    pass
+            self._total_bytes -= entry.size
+            self._stats["evictions"] += 1
+
+    def get(self, key: str, fmt: str = "png") -> Optional[bytes]:
+        """Return the cached bytes of the frame in the given format, or None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or fmt not in entry.formats:
+                self._stats["misses"] += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            data = self._path(key, fmt).read_bytes()
+        except FileNotFoundError:
+            # Removed behind our back, forget about it
+            with self._lock:
+                entry = self._index.get(key)
+                if entry and fmt in entry.formats:
+                    self._total_bytes -= entry.formats.pop(fmt)
+                    if not entry.formats:
+                        del self._index[key]
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return data
+
+    def put(self, key: str, data: bytes, fmt: str = "png") -> None:
+        """Store a format of a frame, evicting old entries if needed."""
+        write_atomically(self._path(key, fmt), data)
+        with self._lock:
+            entry = self._index.setdefault(key, _Entry())
+            self._index.move_to_end(key)
+            self._total_bytes += len(data) - entry.formats.get(fmt, 0)
+            entry.formats[fmt] = len(data)
+            self._stats["stores"] += 1
+            self._evict()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": (self._stats["hits"] / lookups) if lookups else None,
+                **self._stats,
+            }
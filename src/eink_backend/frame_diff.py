@@ -0,0 +1,211 @@
+"""
+Partial-refresh updates: which regions of the frame changed since the last frame
+a device got.
+
+The planes are the packed 1-bit buffers from `bitplanes.py`. Rectangles are in
+whole bytes horizontally (x and width are multiples of 8), since that's what the
+panel's partial-refresh window takes, and it means a rectangle's pixel data is
+just a slice of each packed row.
+
+`DeviceFrames` remembers the last frame delivered to each device, and works out
+the update for its next request:
+
+- the dirty rectangles of each plane, with their pixel data
+- whether a full refresh is recommended instead: when there's no frame to diff
+  against, when most of the frame changed anyway, or after enough partial
+  refreshes in a row that the panel needs a full one to clear the ghosting
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_logger: logging.Logger = logging.getLogger()
+
+# Changed rows this close to each other go in the same rectangle
+_ROW_GAP = 8
+
+
+@dataclass(frozen=True)
+class Rect:
+    """A region of a plane, in pixels."""
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def area(self) -> int:
+        return self.width * self.height
+
+
+@dataclass
+class FrameUpdate:
+    """What a device should do to get from the frame it has to the current one."""
+    frame_id: str
+    base_frame_id: Optional[str]
+    full_refresh: bool
+    reason: str
+    rects: Dict[str, List[Rect]] = field(default_factory=dict)
+    data: Dict[str, List[bytes]] = field(default_factory=dict)
+
+
+def frame_id(planes: Dict[str, bytes]) -> str:
+    """A short id of a frame's content."""
+    digest = hashlib.sha1()
+    for name in sorted(planes):
+        digest.update(name.encode())
+        digest.update(planes[name])
+    return digest.hexdigest()[:16]
+
+
+def dirty_rects(old: bytes, new: bytes, width: int, height: int) -> List[Rect]:
+    """
+    The rectangles that cover every pixel that differs between two packed planes.
+
+    Rows that changed are grouped into bands (allowing gaps of up to `_ROW_GAP`
+    unchanged rows), and each band gets the narrowest byte-aligned rectangle that
+    covers its changes. So a clock and a weather block at different heights come
+    out as two small rectangles, rather than one that spans both.
+    """
+    stride = (width + 7) // 8
+    if len(old) != stride * height or len(new) != stride * height:
+        raise ValueError(f"Planes must be {stride * height} bytes for {width}x{height}")
+    changed = np.frombuffer(old, dtype=np.uint8).reshape(height, stride) != np.frombuffer(
+        new, dtype=np.uint8
+    ).reshape(height, stride)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return []
+
+    rects = []
+    # Split the changed rows wherever the gap to the next one is too big
+    breaks = np.flatnonzero(np.diff(rows) > _ROW_GAP + 1)
+    for band in np.split(rows, breaks + 1):
+        top = int(band[0])
+        bottom = int(band[-1]) + 1
+        columns = np.flatnonzero(changed[top:bottom].any(axis=0))
+        left = int(columns[0])
+        right = int(columns[-1]) + 1
+        rects.append(Rect(x=left * 8, y=top, width=min(right * 8, width) - left * 8, height=bottom - top))
+    return rects
+
+
+def crop_plane(plane: bytes, width: int, rect: Rect) -> bytes:
+    """The packed pixel data of `rect`, row after row from its top."""
+    stride = (width + 7) // 8
+    left = rect.x // 8
+    right = left + (rect.width + 7) // 8
+    rows = np.frombuffer(plane, dtype=np.uint8).reshape(-1, stride)
+    return rows[rect.y:rect.y + rect.height, left:right].tobytes()
+
+
+class DeviceFrames:
+    """
+    The last frame delivered to each device, and the updates from it.
+
+    Args:
+        width: Frame width in pixels
+        height: Frame height in pixels
+        max_partial_refreshes: Partial refreshes in a row before a full one is recommended
+        full_refresh_ratio: Recommend a full refresh when the dirty rectangles cover
+            more than this fraction of the frame
+        max_devices: How many devices to remember
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        max_partial_refreshes: int = 10,
+        full_refresh_ratio: float = 0.5,
+        max_devices: int = 32,
+    ):
+        self.width = width
+        self.height = height
+        self.max_partial_refreshes = max_partial_refreshes
+        self.full_refresh_ratio = full_refresh_ratio
+        self.max_devices = max_devices
+        self._lock = threading.Lock()
+        # device -> (frame id, planes, partial refreshes since the last full one)
+        self._devices: "OrderedDict[str, Any]" = OrderedDict()
+        self._stats = {"full": 0, "partial": 0, "unchanged": 0}
+
+    def update(self, device: str, planes: Dict[str, bytes], have: Optional[str] = None) -> FrameUpdate:
+        """
+        Work out the update for `device`, and remember `planes` as its frame.
+
+        Args:
+            device: Some stable id of the device
+            planes: The current frame's packed planes, by name
+            have: The id of the frame the device says it's showing. The diff is only
+                against the remembered frame if the ids match, so a device that missed
+                a response (or restarted) gets a full refresh rather than a broken one.
+        """
+        new_id = frame_id(planes)
+        with self._lock:
+            previous = self._devices.get(device)
+
+        reason = None
+        partials = 0
+        if previous is None:
+            reason = "no previous frame for this device"
+        else:
+            (old_id, old_planes, partials) = previous
+            if have is not None and have != old_id:
+                reason = "device has a different frame"
+            elif set(old_planes) != set(planes):
+                reason = "different planes"
+            elif partials >= self.max_partial_refreshes:
+                reason = f"{partials} partial refreshes since the last full one"
+
+        update = FrameUpdate(frame_id=new_id, base_frame_id=None, full_refresh=True, reason=reason or "")
+        if reason is None:
+            update.base_frame_id = old_id
+            rects = {name: dirty_rects(old_planes[name], planes[name], self.width, self.height) for name in planes}
+            # Both planes are refreshed together, so what matters is the plane that changed most
+            dirty_area = max(sum(rect.area for rect in plane_rects) for plane_rects in rects.values())
+            if dirty_area == 0:
+                update.full_refresh = False
+                update.reason = "unchanged"
+            elif dirty_area > self.full_refresh_ratio * self.width * self.height:
+                update.reason = "most of the frame changed"
+            else:
+                update.full_refresh = False
+                update.reason = "partial"
+                update.rects = rects
+
+        if update.full_refresh:
+            whole = Rect(x=0, y=0, width=self.width, height=self.height)
+            update.rects = {name: [whole] for name in planes}
+            partials = 0
+        elif update.rects:
+            partials += 1
+        update.data = {
+            name: [crop_plane(planes[name], self.width, rect) for rect in plane_rects]
+            for (name, plane_rects) in update.rects.items()
+        }
+
+        with self._lock:
+            self._stats["full" if update.full_refresh else update.reason] += 1
+            self._devices[device] = (new_id, planes, partials)
+            self._devices.move_to_end(device)
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        _logger.debug(f"Frame update for {device}: {update.reason}, {sum(len(r) for r in update.rects.values())} rects")
+        return update
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "devices": {
+                    device: {"frame_id": old_id, "partial_refreshes": partials}
+                    for (device, (old_id, _, partials)) in self._devices.items()
+                },
+                **self._stats,
+            }
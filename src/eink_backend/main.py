@@ -1,29 +1,48 @@
+import asyncio
 from bs4 import BeautifulSoup
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
+import base64
 import datetime
+import hashlib
+import io
+import json
 import logging
-import shutil
+import math
 from string import Template
 import subprocess
-from typing import Any, Dict, List, Optional, Set, Tuple
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from pathlib import Path
 import os
 import re
+import threading
+import time
 from enum import Enum
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from fastapi.params import Query
 from pyluach import dates, parshios
 import zoneinfo
 import traceback
-import sqlite3
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
-
-from . import my_calendar, weather, efrat_zmanim, chores, seating, data_cache
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
+
+from . import my_calendar, weather, efrat_zmanim, chores, seating, data_cache, cache_codecs, render, pillow_layout, prerender, timeline
+from .artifacts import ArtifactStore
+from .atomic_files import write_atomically, write_temp_file
+from .bitplanes import BitplaneCache, pack_plane, packbits_encode
+from .browser_pool import BrowserPool, BrowserPoolError
+from .change_feed import ChangeFeed
+from .device_profiles import DEFAULT_PROFILE, DEFAULT_PROFILE_NAME, DeviceProfile, load_profiles
+from .conditional import ContentTags, Validators, is_not_modified
+from .frame_diff import DeviceFrames
+from .frame_cache import FrameCache, frame_cache_key
+from .render_workers import RenderQueueFullError, RenderTimeoutError, RenderWorkers
+from .served_bytes import ServedBytes, ServedFile
+from .single_flight import SingleFlight
 from .config import LOCAL_TZ
 from .chores_db import ChoresDatabase
 from .chores_api import create_chores_router, seed_default_chore_plans, refresh_tomorrow_chore_plan
@@ -55,11 +74,107 @@ SATURDAY = 5
 # Data refresh interval for the background scheduler
 _DATA_REFRESH_INTERVAL = datetime.timedelta(minutes=15)
 
+# Longest a `/changes/wait` long-poll may block, and how often `/changes/stream`
+# sends a keep-alive comment
+_LONG_POLL_MAX_TIMEOUT = datetime.timedelta(minutes=5)
+_CHANGE_STREAM_KEEPALIVE = datetime.timedelta(seconds=25)
+
+# How long the background scheduler gets to fetch and cache expired data, before
+# `/poll` tells the devices to expect it
+_DATA_FETCH_ALLOWANCE = datetime.timedelta(minutes=1)
+
+# How many warm headless browsers to keep for rendering. 0 disables the pool,
+# and every render starts its own `firefox --screenshot` process instead.
+_BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+# Restart each pooled browser after this many renders, to keep its memory in check
+_BROWSER_MAX_RENDERS = int(os.getenv("BROWSER_MAX_RENDERS", "200"))
+_BROWSER_HEALTH_CHECK_INTERVAL = datetime.timedelta(minutes=5)
+
+# When true, a render takes a single "joined" screenshot and derives the red and
+# black planes from it, instead of screenshotting the page once per color.
+_SINGLE_CAPTURE_RENDER = os.getenv("SINGLE_CAPTURE_RENDER", "").lower() == "true"
+
+# Render the frames of each upcoming change point (see `prerender.py`) this long
+# before they are due, so `/eink/{color}` serves files that are already there
+_PRERENDER_FRAMES = os.getenv("PRERENDER_FRAMES", "true").lower() == "true"
+_PRERENDER_LEAD_TIME = datetime.timedelta(minutes=5)
+_PRERENDER_CHECK_INTERVAL = datetime.timedelta(minutes=1)
+
+# Renders requested over HTTP run on this many worker threads, so they don't
+# block the event loop. By default, one per pooled browser.
+_RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, _BROWSER_POOL_SIZE))))
+# How many more renders may wait for a worker, before answering 503
+_RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "8"))
+# How long a request waits for its render, before answering 504
+_RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "90"))
+
+# `/timeline` renders at most this many samples (a week, every 5 minutes), and
+# works out the frame keys of this many samples per render job
+_TIMELINE_MAX_SAMPLES = 2016
+_TIMELINE_SAMPLES_PER_JOB = 24
+# How long the frames of a `/timeline` are kept, for its client to fetch them
+_TIMELINE_FRAMES_KEEP_FOR = datetime.timedelta(hours=1)
+
+# Retention of the hash-named frame artifacts (see `artifacts.py`): the newest
+# ones are kept regardless of age, the others until they're this old
+_FRAME_ARTIFACTS_KEEP_COUNT = int(os.getenv("FRAME_ARTIFACTS_KEEP_COUNT", "64"))
+_FRAME_ARTIFACTS_MAX_AGE = datetime.timedelta(hours=float(os.getenv("FRAME_ARTIFACTS_MAX_AGE_HOURS", "48")))
+_FRAME_ARTIFACTS_PRUNE_INTERVAL = datetime.timedelta(hours=1)
+
 root_dir = Path(os.path.abspath(__file__)).parent.parent.parent
 """This should point to the parent of the `src` directory"""
 out_dir = Path("/tmp/eink-display")
 out_dir.mkdir(parents=True, exist_ok=True)
 
+DEVICE_HEIGHT = DEFAULT_PROFILE.height
+DEVICE_WIDTH = DEFAULT_PROFILE.width
+
+# The panels this backend drives, by name. Each gets its own output directory
+# (see `device_profiles.py`); the default one writes to `out_dir` itself.
+_DEVICE_PROFILES_FILE = os.getenv("DEVICE_PROFILES")
+device_profiles = load_profiles(Path(_DEVICE_PROFILES_FILE) if _DEVICE_PROFILES_FILE else None)
+
+# Finished frames, keyed by a hash of their HTML, so unchanged frames aren't rendered again
+frame_cache = FrameCache(cache_dir=Path("/tmp/eink-frame-cache"))
+
+# Every rendered image, by its content hash, and the manifest of the current ones
+frame_artifacts = ArtifactStore(
+    root=Path("/tmp/eink-frames"), keep_count=_FRAME_ARTIFACTS_KEEP_COUNT, max_age=_FRAME_ARTIFACTS_MAX_AGE
+)
+
+# The current frame hash, pushed to the displays by `/changes/wait` and `/changes/stream`
+change_feed = ChangeFeed()
+
+# Content hashes of the rendered frames, for the ETags of `/eink`
+content_tags = ContentTags()
+
+# The bytes of the frames, CSS and icons the endpoints serve, so they're sent from memory
+served_bytes = ServedBytes()
+render.on_extracted_write.append(served_bytes.invalidate)
+
+# Packed 1-bit planes of the last few rendered frames, for `/eink-bits`
+bitplane_cache = BitplaneCache()
+
+# The last frame delivered to each device, for the partial updates of `/eink-diff`, by profile
+device_frames = {
+    name: DeviceFrames(width=profile.width, height=profile.height)
+    for name, profile in device_profiles.items()
+}
+
+# Worker threads for the renders requested by the HTTP endpoints
+render_workers = RenderWorkers(
+    workers=_RENDER_WORKERS, max_queued=_RENDER_QUEUE_SIZE, job_timeout=_RENDER_TIMEOUT_SECONDS
+)
+
+# The render jobs of `/timeline` in flight, at most one per worker, so they
+# queue up here rather than fill the render queue the devices use
+timeline_slots = asyncio.Semaphore(_RENDER_WORKERS)
+
+# Identical renders, and identical live fetches from upstream, that overlap in
+# time are only done once; later callers wait for the first one's result
+render_flights = SingleFlight(name="render")
+fetch_flights = SingleFlight(name="fetch")
+
 
 def _is_data_type_relevant_at_time(data_type: str, now_utc: datetime.datetime) -> bool:
     """
@@ -104,6 +219,17 @@ scheduler: Optional[BackgroundScheduler] = None
 # Global chores database instance
 chores_db: Optional[ChoresDatabase] = None
 
+# Global pool of warm headless browsers, used for rendering
+browser_pool: Optional[BrowserPool] = None
+
+# Global record of the published and pre-rendered frames
+frame_schedule: Optional[prerender.FrameSchedule] = None
+_prerender_lock = threading.Lock()
+
+# The data types whose stale data was served, and that are being refreshed in the background
+_refreshing: Set[str] = set()
+_refreshing_lock = threading.Lock()
+
 
 def collect_all_data_task():
     """
@@ -111,32 +237,76 @@ def collect_all_data_task():
     Called every DATA_REFRESH_INTERVAL by the scheduler.
     Each data type is only refreshed if it has expired.
     """
-    now_utc = datetime.datetime.now(datetime.timezone.utc)
     _logger.info("Starting scheduled data collection task")
+    _collect_expired_data(["zmanim", "weather", "calendar", "chores", "seating"])
+    _logger.info("Scheduled data collection task completed")
+
+
+def refresh_data_task(data_type: str):
+    """
+    Background task that refreshes one data type, whose stale data was just
+    served (see `request_data_refresh()`), if it's still expired.
+    """
+    try:
+        _collect_expired_data([data_type])
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(data_type)
 
-    data_types = [
-        ("zmanim", lambda: efrat_zmanim.collect_data(now_utc=now_utc)),
-        ("weather", lambda: weather.collect_data(now_utc=now_utc)),
-        ("calendar", lambda: my_calendar.collect_data()),
-        ("chores", lambda: chores.collect_data(now_utc=now_utc)),
-        ("seating", lambda: seating.collect_data(now_utc=now_utc)),
-    ]
 
-    for data_type, fetch_fn in data_types:
+def _collect_expired_data(data_types: List[str]):
+    """Fetch and cache the data types that have expired, then tell the displays, and re-render the frames."""
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+
+    frames_invalidated = False
+    refreshed_on_display = []
+    for data_type in data_types:
         try:
             # Check if data is expired
             if data_cache.is_data_expired(data_type, now_utc=now_utc):
                 _logger.info(f"Collecting fresh {data_type} data")
-                data = fetch_fn()
-                if data is not None:
-                    data_cache.save_cached_data(data_type, data, now_utc=now_utc)
+                data = fetch_fresh_data(data_type, now_utc=now_utc)
+                # Fetching the same data again changes nothing on the display
+                if data is not None and data_cache.save_cached_data(data_type, data, now_utc=now_utc):
+                    if _is_data_type_relevant_at_time(data_type, now_utc):
+                        refreshed_on_display.append(data_type)
+                    if frame_schedule and frame_schedule.invalidate(data_type):
+                        frames_invalidated = True
             else:
                 _logger.debug(f"Skipping {data_type} - still fresh")
         except Exception as ex:
             _logger.error(f"Error collecting {data_type}: {ex}")
             traceback.print_exc()
 
-    _logger.info("Scheduled data collection task completed")
+    change_feed.publish_data(refreshed_on_display)
+
+    # Re-render the frames that showed the old data
+    if frames_invalidated:
+        prerender_frames_task()
+
+
+def request_data_refresh(data_type: str):
+    """Refresh `data_type` in the background, unless it's already being refreshed. Doesn't wait for it."""
+    with _refreshing_lock:
+        if data_type in _refreshing:
+            return
+        _refreshing.add(data_type)
+    _logger.info(f"Refreshing the {data_type} data in the background")
+    try:
+        if scheduler and scheduler.running:
+            scheduler.add_job(
+                refresh_data_task,
+                args=[data_type],
+                id=f'refresh_{data_type}',
+                name=f'Refresh the stale {data_type} data',
+                replace_existing=True,
+            )
+        else:
+            threading.Thread(target=refresh_data_task, args=(data_type,), name=f"refresh-{data_type}", daemon=True).start()
+    except Exception:
+        with _refreshing_lock:
+            _refreshing.discard(data_type)
+        raise
 
 
 def cleanup_audit_log_task():
@@ -161,6 +331,117 @@ def cleanup_audit_log_task():
         traceback.print_exc()
 
 
+def browser_pool_health_check_task():
+    """Background task that replaces pooled browsers that stopped responding."""
+    global browser_pool
+    if not browser_pool:
+        return
+    try:
+        browser_pool.health_check()
+        _logger.debug(f"Browser pool health check completed: {browser_pool.status()}")
+    except Exception as ex:
+        _logger.error(f"Error checking browser pool health: {ex}")
+        traceback.print_exc()
+
+
+def _zmanim_change_times(now_utc: datetime.datetime) -> Dict[str, Any]:
+    """The zmanim that `prerender.change_points()` needs, for the Shabbat nearest to `now_utc`."""
+    zmanim = efrat_zmanim.collect_data(now_utc=now_utc)
+    times = zmanim.times if zmanim else {}
+    return {
+        "tset_shabat": times.get("tset_shabat_as_datetime"),
+        "tzet_shabat": times.get("tzet_shabat"),
+    }
+
+
+def _expected_data_refreshes(now_utc: datetime.datetime) -> Dict[str, datetime.datetime]:
+    """
+    When fresh data is expected for each cached data type that is on the display:
+    the first run of `collect_all_data_task` after the data expires, plus the time
+    it takes to fetch it.
+    """
+    job = scheduler.get_job('collect_all_data') if scheduler and scheduler.running else None
+    next_run = job.next_run_time.astimezone(datetime.timezone.utc) if job and job.next_run_time else None
+    refreshes = {}
+    for data_type, expiration in data_cache.get_expirations().items():
+        if next_run:
+            runs_until_expired = max(0, math.ceil((expiration - next_run) / _DATA_REFRESH_INTERVAL))
+            refresh = next_run + runs_until_expired * _DATA_REFRESH_INTERVAL
+        else:
+            refresh = max(expiration, now_utc) + _DATA_REFRESH_INTERVAL
+        refresh += _DATA_FETCH_ALLOWANCE
+        if _is_data_type_relevant_at_time(data_type, refresh):
+            refreshes[data_type] = refresh
+    return refreshes
+
+
+def prerender_frames_task():
+    """
+    Background task that keeps the published frames current, and renders the
+    frames of the change points in the next `_PRERENDER_LEAD_TIME` ahead of time.
+    Each staged frame set is promoted by a one-off job at its change point.
+    """
+    if not frame_schedule:
+        return
+    if not _prerender_lock.acquire(blocking=False):
+        _logger.debug("Pre-rendering is already running; skipping")
+        return
+    try:
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        frame_schedule.promote_due(now_utc)
+        if not frame_schedule.is_current(now_utc):
+            generation = frame_schedule.generation
+            render_frame_set(now_utc=now_utc)
+            valid_until = prerender.next_change_point(now_utc, **_zmanim_change_times(now_utc)).at
+            frame_schedule.mark_published(valid_from=now_utc, valid_until=valid_until, generation=generation)
+        publish_current_frame()
+
+        upcoming = prerender.change_points(
+            start_utc=now_utc, end_utc=now_utc + _PRERENDER_LEAD_TIME, **_zmanim_change_times(now_utc)
+        )
+        for change_point in upcoming:
+            if frame_schedule.is_staged(change_point):
+                continue
+            generation = frame_schedule.generation
+            directory = frame_schedule.staging_dir_for(change_point)
+            render_frame_set(now_utc=change_point.at, dest_dir=directory)
+            valid_until = prerender.next_change_point(change_point.at, **_zmanim_change_times(change_point.at)).at
+            if frame_schedule.stage(change_point, valid_until=valid_until, directory=directory, generation=generation):
+                _logger.info(f"Pre-rendered frames for {change_point.at.isoformat()} ({', '.join(change_point.reasons)})")
+                if scheduler and scheduler.running:
+                    scheduler.add_job(
+                        promote_prerendered_frames_task,
+                        'date',
+                        run_date=change_point.at,
+                        id=f'promote_frames_{change_point.at.strftime("%Y%m%d_%H%M%S")}',
+                        name=f'Publish the frames pre-rendered for {change_point.at.isoformat()}',
+                        replace_existing=True,
+                    )
+    except CacheMissError as ex:
+        _logger.warning(f"Cannot pre-render frames yet: {ex}")
+    except Exception as ex:
+        _logger.error(f"Error pre-rendering frames: {ex}")
+        traceback.print_exc()
+    finally:
+        _prerender_lock.release()
+
+
+def promote_prerendered_frames_task():
+    """Background task, run at a change point, that publishes the frames pre-rendered for it."""
+    if frame_schedule:
+        frame_schedule.promote_due(datetime.datetime.now(datetime.timezone.utc))
+        publish_current_frame()
+
+
+def prune_frame_artifacts_task():
+    """Background task that deletes the frame artifacts that are past their retention."""
+    try:
+        frame_artifacts.prune()
+    except Exception as ex:
+        _logger.error(f"Error pruning frame artifacts: {ex}")
+        traceback.print_exc()
+
+
 def refresh_tomorrow_chore_plan_task():
     """Background task that refreshes tomorrow's persisted chores plan."""
     global chores_db
@@ -178,9 +459,13 @@ def refresh_tomorrow_chore_plan_task():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize the database on startup, start the scheduler, and clean up on shutdown."""
-    global scheduler, chores_db
+    global scheduler, chores_db, browser_pool, frame_schedule
+
+    # Wake up the displays waiting for changes, from the scheduler's threads too
+    change_feed.attach(asyncio.get_running_loop())
 
     # Initialize the cache database
+    data_cache.register_codecs(cache_codecs.CODECS)
     data_cache.init_db(_logger)
     data_cache.clean_expired_records(older_than_days=30)
     _logger.info("Cache database initialized.")
@@ -211,6 +496,16 @@ async def lifespan(app: FastAPI):
             # Don't fail startup if sync fails, just log the error
             pass
 
+    # Start the pool of warm browsers used for rendering
+    if _BROWSER_POOL_SIZE > 0:
+        browser_pool = BrowserPool(size=_BROWSER_POOL_SIZE, max_renders_per_browser=_BROWSER_MAX_RENDERS)
+        try:
+            browser_pool.warm_up(count=1)
+            _logger.info(f"Browser pool started (size {_BROWSER_POOL_SIZE}).")
+        except Exception as e:
+            # Renders will retry launching, or fall back to a one-off Firefox
+            _logger.error(f"Error warming up the browser pool: {e}")
+
     # Start the background scheduler
     scheduler = BackgroundScheduler()
     scheduler.add_job(
@@ -236,6 +531,35 @@ async def lifespan(app: FastAPI):
         id='refresh_tomorrow_chore_plan',
         name='Refresh tomorrow chore plan daily at midnight'
     )
+    scheduler.add_job(
+        prune_frame_artifacts_task,
+        'interval',
+        seconds=int(_FRAME_ARTIFACTS_PRUNE_INTERVAL.total_seconds()),
+        id='prune_frame_artifacts',
+        name=f'Prune frame artifacts every {int(_FRAME_ARTIFACTS_PRUNE_INTERVAL.total_seconds() / 60)} minutes'
+    )
+    if _PRERENDER_FRAMES:
+        frame_schedule = prerender.FrameSchedule(
+            out_dir=out_dir,
+            staging_dir=out_dir / ".prerender",
+            is_data_relevant=_is_data_type_relevant_at_time,
+        )
+        scheduler.add_job(
+            prerender_frames_task,
+            'interval',
+            seconds=int(_PRERENDER_CHECK_INTERVAL.total_seconds()),
+            next_run_time=datetime.datetime.now(datetime.timezone.utc),
+            id='prerender_frames',
+            name=f'Pre-render frames {int(_PRERENDER_LEAD_TIME.total_seconds() / 60)} minutes before they are due'
+        )
+    if browser_pool:
+        scheduler.add_job(
+            browser_pool_health_check_task,
+            'interval',
+            seconds=int(_BROWSER_HEALTH_CHECK_INTERVAL.total_seconds()),
+            id='browser_pool_health_check',
+            name=f'Check browser pool health every {int(_BROWSER_HEALTH_CHECK_INTERVAL.total_seconds() / 60)} minutes'
+        )
     scheduler.start()
     _logger.info(f"Background scheduler started (collecting data every {int(_DATA_REFRESH_INTERVAL.total_seconds() / 60)} minutes).")
 
@@ -245,7 +569,18 @@ async def lifespan(app: FastAPI):
     if scheduler and scheduler.running:
         scheduler.shutdown()
         _logger.info("Background scheduler stopped.")
+
+    # Stop taking renders
+    render_workers.shutdown()
+
+    # Close the pooled browsers
+    if browser_pool:
+        browser_pool.shutdown()
+        _logger.info("Browser pool stopped.")
     
+    # Close the cache database's connections
+    data_cache.close_connections()
+
     # Close the chores database
     if chores_db:
         chores_db.close()
@@ -270,17 +605,11 @@ def untaint_filename(filename: str) -> str:
     return re.sub(r"[^a-zA-Z_-]", "_", filename)
 
 
-def image_to_mono(src: Image.Image):
-    THRESH = 200
-    fn = lambda x: 255 if x > THRESH else 0
+def image_to_mono(src: Image.Image, threshold: int = 200):
+    fn = lambda x: 255 if x > threshold else 0
     return src.convert("L").point(fn, mode="1")
 
 
-def convert_png_to_mono_png(src: Path, dest: Path) -> Path:
-    src_image = Image.open(src)
-    mono_image = image_to_mono(src_image)
-    mono_image.save(dest)
-
 class ColorName(str, Enum):
     """Valid color names for the e-ink display output."""
     RED = "red"
@@ -292,20 +621,30 @@ _VALID_COLOR_NAMES = [color.value for color in ColorName]
 def _is_valid_color(color: str) -> bool:
     return color in _VALID_COLOR_NAMES
 
-def clip_image_to_device_dimensions_in_place(file_to_modify: Path, color: str) -> None:
-    DEVICE_HEIGHT = 880
-    DEVICE_WIDTH = 528
 
-    image = Image.open(file_to_modify)
-    if image.width > DEVICE_WIDTH or image.height > DEVICE_HEIGHT:
+class RenderEngine(str, Enum):
+    """How a frame is rasterized."""
+    BROWSER = "browser"
+    """Screenshot the HTML layout with Firefox"""
+    PILLOW = "pillow"
+    """Draw the matching `*.native.json` layout directly with Pillow"""
+
+def clip_image_to_device_dimensions(
+    image: Image.Image, color: str, width: int = DEVICE_WIDTH, height: int = DEVICE_HEIGHT
+) -> Image.Image:
+    """
+    Crop the image to the device dimensions, drawing a warning in the corner if
+    it was too large. Images that already fit are returned as they are.
+    """
+    if image.width > width or image.height > height:
         text = "Image too large."
-        if image.width > DEVICE_WIDTH:
+        if image.width > width:
             text += (
-                f" Width of image is {image.width}, exceeding max of {DEVICE_WIDTH}."
+                f" Width of image is {image.width}, exceeding max of {width}."
             )
-        if image.height > DEVICE_HEIGHT:
+        if image.height > height:
             text += (
-                f" Height of image is {image.height}, exceeding max of {DEVICE_HEIGHT}."
+                f" Height of image is {image.height}, exceeding max of {height}."
             )
         print(text)
         font_size = 10
@@ -314,44 +653,137 @@ def clip_image_to_device_dimensions_in_place(file_to_modify: Path, color: str) -
         left, top, right, bottom = font.getbbox(text)
         text_width = bottom - top
         text_height = right - left
-        text_x = DEVICE_WIDTH - text_width
-        text_y = DEVICE_HEIGHT - text_height
+        text_x = width - text_width
+        text_y = height - text_height
 
         text_fill = (0, 0, 0)
         if color in ("red", "black"):
             text_fill = 0
         draw.text((text_x, text_y), text, font=font, fill=text_fill)
         draw.text((text_x, text_y), text, font=font, fill=text_fill)
-        cropped_image = image.crop((0, 0, DEVICE_WIDTH, DEVICE_HEIGHT))
-        cropped_image.save(file_to_modify)
-
-
-def render_html_template_single_color(color: str, html_content: str) -> Path:
-    content_filename = "/tmp/content.html"
-    Path(content_filename).write_text(data=html_content, encoding="utf-8")
-    out_firefox_filename = f"/app/tmp/firefox-{color}.png"
-    p = subprocess.run(
-        [
-            "firefox",
-            "--screenshot",
-            out_firefox_filename,
-            "--window-size=528",
-            f"file://{content_filename}",
-        ],
-        timeout=60,
+        image = image.crop((0, 0, width, height))
+    return image
+
+
+def _fit_image_to_profile(image: Image.Image, color: str, profile: DeviceProfile) -> Image.Image:
+    """Threshold the planes, clip to the layout size, and turn the layout onto the panel."""
+    if color in ("red", "black") and image.mode != "1":
+        image = image_to_mono(image, threshold=profile.threshold)
+    image = clip_image_to_device_dimensions(
+        image, color=color, width=profile.layout_width, height=profile.layout_height
     )
-    p.check_returncode()
-    p = subprocess.run(["chmod", "666", out_firefox_filename])
-    p.check_returncode()
-
-    out_path = out_dir / f"{color}.png"
-    make_mono = color in ("red", "black")
-    if make_mono:
-        convert_png_to_mono_png(src=out_firefox_filename, dest=out_path)
+    if profile.rotate:
+        image = image.rotate(-profile.rotate, expand=True)
+    return image
+
+
+def take_screenshot(content_filename: str, window_width: int = DEVICE_WIDTH) -> bytes:
+    """
+    Screenshot the HTML file, using a warm browser from the pool when possible,
+    and a one-off `firefox --screenshot` process otherwise.
+
+    Returns:
+        The screenshot, as PNG-encoded bytes
+    """
+    if browser_pool:
+        try:
+            return browser_pool.screenshot(f"file://{content_filename}", window_width=window_width)
+        except BrowserPoolError as ex:
+            _logger.error(f"Browser pool render failed, falling back to a one-off Firefox: {ex}")
+    with tempfile.TemporaryDirectory(prefix="eink-screenshot-") as tmp_dir:
+        out_firefox_filename = str(Path(tmp_dir) / "screenshot.png")
+        p = subprocess.run(
+            [
+                "firefox",
+                "--screenshot",
+                out_firefox_filename,
+                f"--window-size={window_width}",
+                f"file://{content_filename}",
+            ],
+            timeout=60,
+        )
+        p.check_returncode()
+        return Path(out_firefox_filename).read_bytes()
+
+
+def _screenshot_to_device_png(png_bytes: bytes, color: str, profile: DeviceProfile = DEFAULT_PROFILE) -> bytes:
+    """
+    Turn a screenshot into the final PNG for `color`: mono conversion for red and
+    black, then clipping and rotation, all on the same in-memory image, and a
+    single encode. A joined screenshot that already fits the device is passed
+    through as-is.
+    """
+    image = Image.open(io.BytesIO(png_bytes))
+    fitted = _fit_image_to_profile(image, color=color, profile=profile)
+    if fitted is image and color == ColorName.JOINED.value:
+        return png_bytes
+    return _encode_png(fitted)
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def screenshot_html(html_content: str, profile: DeviceProfile = DEFAULT_PROFILE) -> bytes:
+    """Screenshot the HTML at the profile's layout width. The HTML goes through a scratch file, for Firefox."""
+    with tempfile.TemporaryDirectory(prefix="eink-render-") as scratch_dir:
+        content_filename = str(Path(scratch_dir) / "content.html")
+        Path(content_filename).write_text(data=html_content, encoding="utf-8")
+        return take_screenshot(content_filename=content_filename, window_width=profile.layout_width)
+
+
+def render_html_template_single_color(
+    color: str, html_content: str, dest_dir: Path = out_dir, profile: DeviceProfile = DEFAULT_PROFILE
+) -> bytes:
+    """
+    Screenshot the HTML and write the final PNG to `dest_dir / {color}.png`.
+
+    Returns:
+        The PNG that was written
+    """
+    png_bytes = _screenshot_to_device_png(screenshot_html(html_content, profile=profile), color=color, profile=profile)
+    _write_output_file(dest_dir / f"{color}.png", png_bytes)
+    return png_bytes
+
+
+def render_html_template_all_colors(
+    html_content: str, dest_dir: Path = out_dir, profile: DeviceProfile = DEFAULT_PROFILE
+) -> Dict[str, bytes]:
+    """
+    Screenshot the "joined" HTML once, and write the red, black and joined outputs
+    (the ones the profile has) from that single capture.
+
+    All three files are fully written before any of them replaces the previous
+    output, so a client never gets a red plane from one frame and a black plane
+    from another.
+
+    Returns:
+        The PNG written for each color
+    """
+    screenshot = screenshot_html(html_content, profile=profile)
+    joined_image = Image.open(io.BytesIO(screenshot)).convert("RGB")
+    images = {ColorName.JOINED.value: joined_image}
+    if "red" in profile.colors:
+        images.update(render.split_joined_into_planes(joined_image))
     else:
-        shutil.copy(src=out_firefox_filename, dst=str(out_path))
-    clip_image_to_device_dimensions_in_place(file_to_modify=out_path, color=color)
-    return out_path
+        images[ColorName.BLACK.value] = joined_image
+
+    pngs = {
+        color: _encode_png(_fit_image_to_profile(image, color=color, profile=profile))
+        for color, image in images.items()
+    }
+    tmp_paths: Dict[str, Path] = {}
+    try:
+        for color, png in pngs.items():
+            tmp_paths[color] = write_temp_file(dest_dir, png, name=f"{color}.png")
+        for color in list(tmp_paths):
+            os.replace(tmp_paths.pop(color), dest_dir / f"{color}.png")
+    finally:
+        for tmp_path in tmp_paths.values():
+            tmp_path.unlink(missing_ok=True)
+    return pngs
 
 
 def is_tset_soon(tset_shabat: datetime.datetime, now_utc: datetime.datetime) -> bool:
@@ -408,6 +840,10 @@ def _is_now_after_starlight(now_utc: datetime.datetime, tzet_shabbat: Optional[s
     return False
 
 
+def _render_timestamp(now_utc: datetime.datetime) -> str:
+    return now_utc.astimezone(LOCAL_TZ).strftime("%Y-%d-%m %H:%M:%S")
+
+
 def collect_all_values_of_data(
     zmanim: Optional[efrat_zmanim.ShabbatZmanim],
     weather_forecast: weather.WeatherForecast,
@@ -466,7 +902,7 @@ def collect_all_values_of_data(
     page_dict = {
         "day_of_week": now_local.date().strftime("%A"),
         "date": now_local.date().strftime("%-d of %B %Y"),
-        "render_timestamp": now_local.strftime("%Y-%d-%m %H:%M:%S"),
+        "render_timestamp": _render_timestamp(now_utc),
         "heb_date": heb_date.hebrew_date_string(),
         "additional_css": additional_css,
     }
@@ -538,7 +974,7 @@ def load_template_from_file(file: Path) -> Tuple[Template, List[str]]:
     return (template, template_required_keys)
 
 
-def load_template_by_time(now_utc: datetime.datetime) -> Tuple[Template, List[str]]:
+def template_path_by_time(now_utc: datetime.datetime) -> Path:
     now_local = now_utc.astimezone(LOCAL_TZ)
     wkday = now_local.weekday()
     hour = now_local.hour
@@ -552,7 +988,13 @@ def load_template_by_time(now_utc: datetime.datetime) -> Tuple[Template, List[st
     # (Uses the same logic as _is_data_type_relevant_at_time for seating)
     if (wkday == FRIDAY and hour >= 16) or (wkday == SATURDAY and 10 <= hour <= 13):
         template_path = Path("/app/assets/layout-shabbat-seating.html")
-    return load_template_from_file(file=template_path)
+    return template_path
+
+
+def load_template_by_time(
+    now_utc: datetime.datetime, profile: DeviceProfile = DEFAULT_PROFILE
+) -> Tuple[Template, List[str]]:
+    return load_template_from_file(file=profile.template_path(template_path_by_time(now_utc=now_utc)))
 
 
 def find_missing_template_keys(
@@ -570,8 +1012,16 @@ def find_missing_template_keys(
     return missing_keys
 
 
-def generate_html_content(color: str, now_utc: datetime.datetime, force_refresh: bool = False) -> str:
-    collected = collect_data(now_utc=now_utc, force_refresh=force_refresh)
+def generate_all_values(
+    color: str, now_utc: datetime.datetime, force_refresh: bool = False, latest_data: bool = False
+) -> Dict[str, Any]:
+    """
+    Build the dictionary of values that fills in the layout, for one color.
+
+    Args:
+        latest_data: See `get_cached_data_or_error()`
+    """
+    collected = collect_data(now_utc=now_utc, force_refresh=force_refresh, latest_data=latest_data)
     try:
         all_values = collect_all_values_of_data(
             zmanim=collected.zmanim,
@@ -588,29 +1038,175 @@ def generate_html_content(color: str, now_utc: datetime.datetime, force_refresh:
         # TODO: indent the exception under the warning
         traceback.print_exc()
         all_values = {"Error": str(ex)}
-    (template, template_required_keys) = load_template_by_time(now_utc=now_utc)
+    all_values["color"] = color
+    all_values["stale_data"] = _stale_data_note(collected.stale)
+    return all_values
+
+
+def _stale_data_note(stale: Dict[str, datetime.datetime]) -> str:
+    """
+    The note in the footer of the data that's shown stale, and when it was fetched,
+    e.g. " (stale: weather from 14:05)". It doesn't change from one render to the
+    next, so the frames are still cached.
+    """
+    if not stale:
+        return ""
+    fetched = ", ".join(
+        f"{data_type} from {timestamp.astimezone(LOCAL_TZ).strftime('%H:%M')}" for (data_type, timestamp) in sorted(stale.items())
+    )
+    return f" (stale: {fetched})"
+
+
+def generate_html_content(
+    color: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+    all_values: Optional[Dict[str, Any]] = None,
+    latest_data: bool = False,
+) -> str:
+    """
+    Fill in the profile's layout for `color`. Pass `all_values` (from
+    `generate_all_values()`) to reuse the values already generated for another profile.
+
+    Args:
+        latest_data: See `get_cached_data_or_error()`
+    """
+    if all_values is None:
+        all_values = generate_all_values(color=color, now_utc=now_utc, force_refresh=force_refresh, latest_data=latest_data)
+    all_values = dict(all_values)
+    (template, template_required_keys) = load_template_by_time(now_utc=now_utc, profile=profile)
     missing_keys = find_missing_template_keys(
         all_values=all_values, template_required_keys=template_required_keys
     )
     # Fill in missing keys
     for k in missing_keys:
         all_values[k[1:]] = "[ERR]"
-    all_values["color"] = color
     return template.substitute(**all_values)
 
 
-def render_html_template(color: str, now_utc: datetime.datetime, force_refresh: bool = False):
-    html_content = generate_html_content(color=color, now_utc=now_utc, force_refresh=force_refresh)
-    render_html_template_single_color(color=color, html_content=html_content)
+def _frame_cache_key(
+    html_content: str, color: str, now_utc: datetime.datetime, profile: DeviceProfile = DEFAULT_PROFILE
+) -> str:
+    """
+    The render timestamp in the footer changes every second, so it's left out of
+    the key. On a cache hit, the footer shows when the frame was first rendered.
+    """
+    html_without_timestamp = html_content.replace(_render_timestamp(now_utc), "")
+    return frame_cache_key(html_content=html_without_timestamp, color=color, profile=profile.cache_profile)
+
+
+def _write_output_file(path: Path, data: bytes) -> None:
+    """Write the file next to its destination, then rename, so readers never see half a file."""
+    write_atomically(path, data)
+
+
+def render_html_template(
+    color: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    dest_dir: Path = out_dir,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+    all_values: Optional[Dict[str, Any]] = None,
+):
+    """
+    Args:
+        all_values: The values of `profile.source_color(color)`, if they were already generated
+    """
+    html_content = generate_html_content(
+        color=profile.source_color(color), now_utc=now_utc, force_refresh=force_refresh, profile=profile, all_values=all_values
+    )
+    cache_key = _frame_cache_key(html_content=html_content, color=color, now_utc=now_utc, profile=profile)
+    cached_png = frame_cache.get(cache_key)
+    if cached_png is not None:
+        _logger.debug(f"Frame cache hit for {color} ({cache_key[:12]})")
+        _write_output_file(dest_dir / f"{color}.png", cached_png)
+        return
+    png_bytes = render_html_template_single_color(color=color, html_content=html_content, dest_dir=dest_dir, profile=profile)
+    frame_cache.put(cache_key, png_bytes)
+
+
+def render_native_png(
+    color: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+    cache_result: bool = True,
+    latest_data: bool = False,
+) -> bytes:
+    """
+    Render with the Pillow engine: each plane is drawn directly from the template
+    values, and `joined` is composed from the red and black planes. On a panel
+    without a red plane, the red elements are drawn on the black plane.
+
+    Args:
+        cache_result: Whether to keep a newly rendered frame in the frame cache
+        latest_data: See `get_cached_data_or_error()`
+
+    Returns:
+        The PNG
+    """
+    layout_path = pillow_layout.native_layout_path(profile.template_path(template_path_by_time(now_utc=now_utc)))
+    both_planes = profile.source_color(color) == ColorName.JOINED.value
+    plane_colors = [ColorName.RED.value, ColorName.BLACK.value] if both_planes else [color]
+    values_by_color = {
+        c: generate_all_values(color=c, now_utc=now_utc, force_refresh=force_refresh, latest_data=latest_data)
+        for c in plane_colors
+    }
+
+    values_json = json.dumps({"layout": str(layout_path), "values": values_by_color}, sort_keys=True, default=str)
+    cache_key = _frame_cache_key(html_content=values_json, color=f"{color}-pillow", now_utc=now_utc, profile=profile)
+    cached_png = frame_cache.get(cache_key)
+    if cached_png is not None:
+        _logger.debug(f"Frame cache hit for {color} ({cache_key[:12]})")
+        return cached_png
+
+    planes = {
+        c: pillow_layout.render_plane(layout_path=layout_path, values=values, color=c)
+        for c, values in values_by_color.items()
+    }
+    if color == ColorName.JOINED.value:
+        image = pillow_layout.compose_joined(planes)
+    elif both_planes:
+        # 0 is ink, so this inks every pixel that's ink on either plane
+        image = ImageChops.logical_and(planes[ColorName.BLACK.value], planes[ColorName.RED.value])
+    else:
+        image = planes[color]
+    png_bytes = _encode_png(_fit_image_to_profile(image, color=color, profile=profile))
+    if cache_result:
+        frame_cache.put(cache_key, png_bytes)
+    return png_bytes
+
+
+def render_native(
+    color: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    dest_dir: Path = out_dir,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+) -> Path:
+    """Render with the Pillow engine (see `render_native_png()`) into `dest_dir / {color}.png`."""
+    out_path = dest_dir / f"{color}.png"
+    _write_output_file(out_path, render_native_png(color=color, now_utc=now_utc, force_refresh=force_refresh, profile=profile))
+    return out_path
 
 
-def get_filename(color: str) -> Path:
-    if not _is_valid_color(color):
+def get_filename(color: str, profile: DeviceProfile = DEFAULT_PROFILE) -> Path:
+    if not _is_valid_color(color) or color not in profile.output_colors:
         raise HTTPException(
             status_code=404,
-            detail=f"Invalid image name. Acceptable names: {_VALID_COLOR_NAMES}",
+            detail=f"Invalid image name. Acceptable names: {list(profile.output_colors)}",
         )
-    return out_dir / (color + ".png")
+    return profile.output_dir(out_dir) / (color + ".png")
+
+
+def get_profile(name: str) -> DeviceProfile:
+    if name not in device_profiles:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown device profile. Known profiles: {list(device_profiles)}",
+        )
+    return device_profiles[name]
 
 
 @dataclass
@@ -620,54 +1216,95 @@ class PageData:
     calendar_content: str
     chores_content: chores.ChoreData
     seating_content: seating.SeatingData
+    stale: Dict[str, datetime.datetime] = field(default_factory=dict)
+    """The data types whose data is stale, and when it was fetched"""
 
 
-def get_cached_data_or_error(data_type: str, now_utc: datetime.datetime, force_refresh: bool = False) -> Any:
+def fetch_fresh_data(data_type: str, now_utc: datetime.datetime) -> Any:
+    """
+    Fetch the data from its source, bypassing the cache. If a fetch of the same
+    data type is already in flight, wait for its result instead of fetching again.
+    """
+    fetchers: Dict[str, Callable[[], Any]] = {
+        "zmanim": lambda: efrat_zmanim.collect_data(now_utc=now_utc),
+        "weather": lambda: weather.collect_data(now_utc=now_utc),
+        "calendar": lambda: my_calendar.collect_data(),
+        "chores": lambda: chores.collect_data(now_utc=now_utc),
+        "seating": lambda: seating.collect_data(now_utc=now_utc),
+    }
+    if data_type not in fetchers:
+        return None
+    return fetch_flights.do(data_type, fetchers[data_type])
+
+
+def get_cached_data_or_error(
+    data_type: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    stale: Optional[Dict[str, datetime.datetime]] = None,
+    latest_data: bool = False,
+) -> Any:
     """
     Retrieve data from cache, or fetch fresh if force_refresh is True.
 
+    Data that has expired is still served, up to `data_cache.MAX_STALE_HOURS`
+    after its expiration, and refreshed in the background, so the display doesn't
+    wait for the refresh, or fail, between the expiration and the next
+    `collect_all_data_task()`.
+
     Args:
         data_type: The type of data to retrieve
         now_utc: Current time for reference
         force_refresh: If True, bypass cache and fetch fresh data
+        stale: If the data is stale, its data type is added to this, with when it was fetched
+        latest_data: Use the latest cached data, however long ago it expired, and
+            never refresh it: for renders of other times than now (`/preview`,
+            `/timeline`), which the expiration has nothing to do with
 
     Returns:
         The cached or freshly-fetched data
 
     Raises:
-        CacheMissError: If data is missing from cache and force_refresh is False
+        CacheMissError: If data is missing from cache (or has been stale for too long) and force_refresh is False
     """
     if force_refresh:
         # Bypass cache and fetch fresh data
         _logger.info(f"force_refresh=True, fetching fresh {data_type} data")
-        if data_type == "zmanim":
-            return efrat_zmanim.collect_data(now_utc=now_utc)
-        elif data_type == "weather":
-            return weather.collect_data(now_utc=now_utc)
-        elif data_type == "calendar":
-            return my_calendar.collect_data()
-        elif data_type == "chores":
-            return chores.collect_data(now_utc=now_utc)
-        elif data_type == "seating":
-            return seating.collect_data(now_utc=now_utc)
+        return fetch_fresh_data(data_type, now_utc=now_utc)
+
+    if latest_data:
+        latest = data_cache.get_latest_data(data_type)
+        if latest:
+            return latest[0]
+        raise CacheMissError(f"No cached data available for {data_type}.")
     
     # Try to get from cache
-    cached_result = data_cache.get_cached_data(data_type, now_utc=now_utc)
-    if cached_result:
-        data, timestamp = cached_result
-        return data
-    
+    cached = data_cache.get_servable_data(data_type, now_utc=now_utc)
+    if cached and not cached.stale:
+        return cached.data
+
+    # Expired (or missing): fetch it for the next render. Past or future times
+    # (previews, pre-rendering) can be expired without the data being expired
+    # now, in which case the refresh does nothing.
+    request_data_refresh(data_type)
+    if cached:
+        _logger.info(f"Serving stale {data_type} data from {cached.timestamp.isoformat()}, expired at {cached.expiration.isoformat()}")
+        if stale is not None:
+            stale[data_type] = cached.timestamp
+        return cached.data
+
     # Data not in cache
     raise CacheMissError(f"No cached data available for {data_type}. Try again with \"force_refresh=true\".")
 
 
-def collect_data(now_utc: datetime.datetime, force_refresh: bool = False):
+def collect_data(now_utc: datetime.datetime, force_refresh: bool = False, latest_data: bool = False):
     """
     Collect all page data from cache.
 
     Args:
         now_utc: Current time for reference
         force_refresh: If True, bypass cache and fetch fresh data for all sources
+        latest_data: See `get_cached_data_or_error()`
 
     Returns:
         PageData with all current data
@@ -675,23 +1312,137 @@ def collect_data(now_utc: datetime.datetime, force_refresh: bool = False):
     Raises:
         CacheMissError: If any required data is not in cache (unless force_refresh=True)
     """
+    stale = {}
     return PageData(
         zmanim=efrat_zmanim.collect_data(now_utc=now_utc), # zmanim doesn't need cache, it's 100% local
-        weather_forecast=get_cached_data_or_error("weather", now_utc=now_utc, force_refresh=force_refresh),
-        calendar_content=get_cached_data_or_error("calendar", now_utc=now_utc, force_refresh=force_refresh),
-        chores_content=get_cached_data_or_error("chores", now_utc=now_utc, force_refresh=force_refresh),
-        seating_content=get_cached_data_or_error("seating", now_utc=now_utc, force_refresh=force_refresh),
+        weather_forecast=get_cached_data_or_error("weather", now_utc=now_utc, force_refresh=force_refresh, stale=stale, latest_data=latest_data),
+        calendar_content=get_cached_data_or_error("calendar", now_utc=now_utc, force_refresh=force_refresh, stale=stale, latest_data=latest_data),
+        chores_content=get_cached_data_or_error("chores", now_utc=now_utc, force_refresh=force_refresh, stale=stale, latest_data=latest_data),
+        seating_content=get_cached_data_or_error("seating", now_utc=now_utc, force_refresh=force_refresh, stale=stale, latest_data=latest_data),
+        stale=stale,
     )
 
 
-def render_one_color(color: str, now_utc: datetime.datetime, force_refresh: bool = False):
+def render_all_colors(
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    dest_dir: Path = out_dir,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+    all_values: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Path]:
+    """
+    Args:
+        all_values: The values of the joined color, if they were already generated
+    """
+    html_content = generate_html_content(
+        color=ColorName.JOINED.value, now_utc=now_utc, force_refresh=force_refresh, profile=profile, all_values=all_values
+    )
+    # Each color is keyed separately, since in this mode they all come from the joined HTML
+    cache_keys = {
+        color: _frame_cache_key(html_content=html_content, color=f"{color}-from-joined", now_utc=now_utc, profile=profile)
+        for color in profile.output_colors
+    }
+    cached_pngs = {color: frame_cache.get(key) for color, key in cache_keys.items()}
+    if all(png is not None for png in cached_pngs.values()):
+        _logger.debug(f"Frame cache hit for all colors ({cache_keys[ColorName.JOINED.value][:12]})")
+        out_paths = {color: dest_dir / f"{color}.png" for color in cached_pngs}
+        for color, png in cached_pngs.items():
+            _write_output_file(out_paths[color], png)
+        return out_paths
+
+    pngs = render_html_template_all_colors(html_content=html_content, dest_dir=dest_dir, profile=profile)
+    for color, png in pngs.items():
+        frame_cache.put(cache_keys[color], png)
+    return {color: dest_dir / f"{color}.png" for color in pngs}
+
+
+def render_one_color(
+    color: str,
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+):
     color = untaint_filename(color)
-    render_html_template(color=color, now_utc=now_utc, force_refresh=force_refresh)
-    filename = get_filename(color=color)
+    filename = get_filename(color=color, profile=profile)
+    dest_dir = filename.parent
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    if engine == RenderEngine.PILLOW:
+        render_native(color=color, now_utc=now_utc, force_refresh=force_refresh, dest_dir=dest_dir, profile=profile)
+    elif _SINGLE_CAPTURE_RENDER:
+        # Every color comes from the same capture, so render them all at once
+        render_all_colors(now_utc=now_utc, force_refresh=force_refresh, dest_dir=dest_dir, profile=profile)
+    else:
+        render_html_template(color=color, now_utc=now_utc, force_refresh=force_refresh, dest_dir=dest_dir, profile=profile)
+
+
+def render_frame_set(now_utc: datetime.datetime, dest_dir: Path = out_dir) -> None:
+    """
+    Render every color of the frame shown at `now_utc`, for every device profile,
+    into the profiles' directories under `dest_dir`. The template values are
+    generated once per color and shared by all the profiles.
+    """
+    values_by_color: Dict[str, Dict[str, Any]] = {}
+
+    def values_of(color: str) -> Dict[str, Any]:
+        if color not in values_by_color:
+            values_by_color[color] = generate_all_values(color=color, now_utc=now_utc)
+        return values_by_color[color]
+
+    for profile in device_profiles.values():
+        profile_dir = profile.output_dir(dest_dir)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        if _SINGLE_CAPTURE_RENDER:
+            render_all_colors(
+                now_utc=now_utc, dest_dir=profile_dir, profile=profile, all_values=values_of(ColorName.JOINED.value)
+            )
+        else:
+            for color in profile.output_colors:
+                render_html_template(
+                    color=color,
+                    now_utc=now_utc,
+                    dest_dir=profile_dir,
+                    profile=profile,
+                    all_values=values_of(profile.source_color(color)),
+                )
 
 _DATETIME_FORMAT_IN_URL = "%Y%m%d-%H%M%S"
 _DATETIME_FORMAT_WITH_TZ = "%Y%m%d-%H%M%S%z"
 
+
+async def run_on_render_worker(fn: Callable[..., Any], flight_key: Tuple, **kwargs: Any) -> Any:
+    """
+    Run a render on the worker threads and await it, turning its errors into
+    HTTP errors: 503 with Retry-After when the queue is full, 504 when it takes
+    too long, and 503 when data is missing from the cache.
+
+    Args:
+        fn: The render to run
+        flight_key: Identifies what `fn` renders. A request for a render with the
+                    same key that is still in flight waits for its result.
+        kwargs: Arguments for `fn`
+    """
+    try:
+        return await render_flights.do_async(
+            (fn.__name__, *flight_key), lambda: render_workers.run(fn, **kwargs)
+        )
+    except RenderQueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except RenderTimeoutError as e:
+        raise HTTPException(
+            status_code=504,
+            detail=str(e)
+        )
+    except CacheMissError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+
 @app.get("/html-dev/{color}", response_class=HTMLResponse)
 async def html_dev(color: ColorName, at: Optional[str] = None, force_refresh: bool = False):
     """
@@ -705,86 +1456,841 @@ async def html_dev(color: ColorName, at: Optional[str] = None, force_refresh: bo
     now_utc = datetime.datetime.now(datetime.timezone.utc)
     if at:
         now_utc = datetime.datetime.strptime(at, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
-    try:
-        html = generate_html_content(color=color.value, now_utc=now_utc, force_refresh=force_refresh)
-    except CacheMissError as e:
-        raise HTTPException(
-            status_code=503,
-            detail=str(e)
-        )
+    html = await run_on_render_worker(
+        generate_html_content,
+        flight_key=(color.value, at, force_refresh),
+        color=color.value,
+        now_utc=now_utc,
+        force_refresh=force_refresh,
+    )
     now_as_string = f'<!-- at={now_utc.strftime(_DATETIME_FORMAT_WITH_TZ)} -->\n'
     return now_as_string + html
 
 
+def render_preview(
+    colors: List[str],
+    now_utc: datetime.datetime,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+) -> Dict[str, bytes]:
+    """
+    Render the PNGs of `colors` at `now_utc`, in memory. Nothing is written to the
+    output directories, and the frame cache is only read, so previews don't touch
+    the frames the devices get, or push them out of the cache. The latest cached
+    data is used, whatever `now_utc` is, and it's not refreshed.
+    """
+    pngs = {}
+    for color in colors:
+        if engine == RenderEngine.PILLOW:
+            pngs[color] = render_native_png(
+                color=color, now_utc=now_utc, force_refresh=force_refresh, profile=profile, cache_result=False, latest_data=True
+            )
+            continue
+        html_content = generate_html_content(
+            color=profile.source_color(color), now_utc=now_utc, force_refresh=force_refresh, profile=profile, latest_data=True
+        )
+        cached_png = frame_cache.get(_frame_cache_key(html_content=html_content, color=color, now_utc=now_utc, profile=profile))
+        if cached_png is not None:
+            pngs[color] = cached_png
+        else:
+            pngs[color] = _screenshot_to_device_png(screenshot_html(html_content, profile=profile), color=color, profile=profile)
+    return pngs
+
+
+class PreviewFormat(str, Enum):
+    PNG = "png"
+    BITS = "bits"
+    """Packed 1-bit planes, as in `/eink-bits`"""
+
+
+@app.get("/preview/{color}", response_class=Response)
+async def preview(
+    color: ColorName,
+    at: Optional[str] = None,
+    profile: str = DEFAULT_PROFILE_NAME,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    format: PreviewFormat = PreviewFormat.PNG,
+    rle: bool = False,
+    force_refresh: bool = False,
+):
+    """
+    Renders the frame at any time, for any profile, and returns it directly. It's
+    rendered in memory (see `render_preview()`), so previews and automated checks
+    don't disturb the frames the devices get.
+
+    Args:
+        color: The color variant (red, black, joined)
+        at: Optional datetime to render (format: "%Y%m%d-%H%M%S", must be UTC timezone). Defaults to current UTC time.
+        profile: The device profile (see `/profiles`)
+        engine: Render with the browser, or draw natively with Pillow
+        format: `png`, or `bits` for the packed 1-bit plane (`joined` gives the
+            combined planes, as in `/eink-bits/combined`)
+        rle: If True, the packed planes are PackBits run-length encoded
+        force_refresh: If True, bypass cache and fetch fresh data
+    """
+    device_profile = get_profile(profile)
+    # 404 if the profile doesn't have this color
+    get_filename(color=color.value, profile=device_profile)
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    if at:
+        try:
+            now_utc = datetime.datetime.strptime(at, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if format == PreviewFormat.BITS and color == ColorName.JOINED:
+        colors = list(device_profile.colors)
+    else:
+        colors = [color.value]
+    pngs = await run_on_render_worker(
+        render_preview,
+        flight_key=(tuple(colors), now_utc, force_refresh, engine.value, device_profile.name),
+        colors=colors,
+        now_utc=now_utc,
+        force_refresh=force_refresh,
+        engine=engine,
+        profile=device_profile,
+    )
+    headers = {"X-Frame-Time": now_utc.strftime(_DATETIME_FORMAT_IN_URL), "Cache-Control": "no-store"}
+    if format == PreviewFormat.PNG:
+        return Response(content=pngs[color.value], media_type="image/png", headers=headers)
+    planes = [pack_plane(Image.open(io.BytesIO(pngs[c]))) for c in colors]
+    return Response(
+        content=b"".join(packbits_encode(plane) if rle else plane for plane in planes),
+        media_type="application/octet-stream",
+        headers={
+            **headers,
+            "X-Frame-Width": str(device_profile.width),
+            "X-Frame-Height": str(device_profile.height),
+            "X-Planes": ",".join(colors),
+            "X-Plane-Encoding": "packbits" if rle else "raw",
+        },
+    )
+
+
 @app.get("/render/{color}")
-async def render_endpoint(color: ColorName, force_refresh: bool = False):
+async def render_endpoint(
+    color: ColorName,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: str = DEFAULT_PROFILE_NAME,
+):
+    """
+    Renders the image for the specified color, so it's ready for download.
+
+    Args:
+        color: The color variant (red, black, joined)
+        force_refresh: If True, bypass cache and fetch fresh data
+        engine: Render with the browser, or draw natively with Pillow. The time
+                each one took is in the response, to compare them.
+        profile: The device profile to render for
+    """
+    device_profile = get_profile(profile)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    started = time.perf_counter()
+    await run_on_render_worker(
+        render_one_color,
+        flight_key=(color.value, engine.value, force_refresh, device_profile.name),
+        color=color.value,
+        now_utc=now,
+        force_refresh=force_refresh,
+        engine=engine,
+        profile=device_profile,
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return f"Rendered {color.value} with {engine.value} in {elapsed_ms:.0f} ms. Waiting for download."
+
+
+@app.get("/render-all")
+async def render_all_endpoint(force_refresh: bool = False, profile: str = DEFAULT_PROFILE_NAME):
+    """
+    Renders the red, black and joined images from a single screenshot.
+
+    Args:
+        force_refresh: If True, bypass cache and fetch fresh data
+        profile: The device profile to render for
+    """
+    device_profile = get_profile(profile)
     now = datetime.datetime.now(datetime.timezone.utc)
+    dest_dir = device_profile.output_dir(out_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    out_paths = await run_on_render_worker(
+        render_all_colors,
+        flight_key=(force_refresh, device_profile.name),
+        now_utc=now,
+        force_refresh=force_refresh,
+        dest_dir=dest_dir,
+        profile=device_profile,
+    )
+    return f"Rendered {', '.join(out_paths.keys())}. Waiting for download."
+
+
+def timeline_frame_keys(
+    color: str, times: List[datetime.datetime], profile: DeviceProfile = DEFAULT_PROFILE
+) -> Tuple[List[Optional[str]], Dict[str, Tuple[datetime.datetime, str]], Dict[datetime.datetime, str]]:
+    """
+    The frame cache key of each time's frame, without rendering it. The frames are
+    filled in with the latest cached data, however far `times` are from its
+    expiration, and nothing is refreshed.
+
+    Returns:
+        The key of each time (None if its frame can't be rendered), the first time
+        and the HTML of each key, and why each time whose key is None can't be rendered
+    """
+    keys: List[Optional[str]] = []
+    first_of_key: Dict[str, Tuple[datetime.datetime, str]] = {}
+    errors: Dict[datetime.datetime, str] = {}
+    for at in times:
+        try:
+            html_content = generate_html_content(
+                color=profile.source_color(color), now_utc=at, profile=profile, latest_data=True
+            )
+        except CacheMissError as e:
+            keys.append(None)
+            errors[at] = str(e)
+            continue
+        cache_key = _frame_cache_key(html_content=html_content, color=color, now_utc=at, profile=profile)
+        keys.append(cache_key)
+        first_of_key.setdefault(cache_key, (at, html_content))
+    return (keys, first_of_key, errors)
+
+
+def render_timeline_frame(
+    color: str, now_utc: datetime.datetime, html_content: str, profile: DeviceProfile = DEFAULT_PROFILE
+) -> bytes:
+    """
+    Render the HTML of a frame of `/timeline` to a PNG, without touching the
+    published frames. The frame cache is only read, so a week of frames doesn't
+    push out the ones the devices get.
+    """
+    cache_key = _frame_cache_key(html_content=html_content, color=color, now_utc=now_utc, profile=profile)
+    png_bytes = frame_cache.get(cache_key)
+    if png_bytes is None:
+        with tempfile.TemporaryDirectory(prefix="eink-timeline-") as scratch_dir:
+            png_bytes = render_html_template_single_color(
+                color=color, html_content=html_content, dest_dir=Path(scratch_dir), profile=profile
+            )
+    return png_bytes
+
+
+class TimelineFormat(str, Enum):
+    JSON = "json"
+    CONTACT_SHEET = "contact-sheet"
+
+
+@app.get("/timeline")
+async def timeline_endpoint(
+    start: str,
+    end: str,
+    step_minutes: float = 60,
+    color: ColorName = ColorName.JOINED,
+    profile: str = DEFAULT_PROFILE_NAME,
+    format: TimelineFormat = TimelineFormat.JSON,
+    columns: int = 4,
+):
+    """
+    Render the frames from `start` to `end`, every `step_minutes`, and return
+    the distinct ones with the times they're shown. See `timeline.py`.
+
+    The frame cache key of every sample is worked out first, so each distinct
+    frame is only rendered once, and those renders run in parallel on the render
+    workers. The frames are kept as artifacts, at `/frames/{hash}.png`, for at
+    least `_TIMELINE_FRAMES_KEEP_FOR`.
+
+    The samples are filled in with the latest cached data, whatever their time,
+    and the data isn't refreshed. Samples that can't be rendered (no data of a
+    type at all, a failed render) are listed under `failed`, rather than failing
+    the whole timeline.
+
+    Args:
+        start: The first time (format: "%Y%m%d-%H%M%S", UTC)
+        end: The end of the range, not included (same format)
+        step_minutes: Minutes between the samples
+        color: The color variant (red, black, joined)
+        profile: The device profile
+        format: `json` for the list of frames, `contact-sheet` for a PNG of them side by side
+        columns: Frames per row of the contact sheet
+    """
+    device_profile = get_profile(profile)
+    # 404 if the profile doesn't have this color
+    get_filename(color=color.value, profile=device_profile)
+    color_str = color.value
     try:
-        render_one_color(color=color.value, now_utc=now, force_refresh=force_refresh)
-    except CacheMissError as e:
-        raise HTTPException(
-            status_code=503,
-            detail=str(e)
+        start_utc = datetime.datetime.strptime(start, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
+        end_utc = datetime.datetime.strptime(end, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
+        times = timeline.sample_times(
+            start=start_utc,
+            end=end_utc,
+            step=datetime.timedelta(minutes=step_minutes),
+            max_samples=_TIMELINE_MAX_SAMPLES,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    started = time.perf_counter()
+
+    async def on_render_worker(fn: Callable[..., Any], flight_key: Tuple, **kwargs: Any) -> Any:
+        async with timeline_slots:
+            return await run_on_render_worker(fn, flight_key=flight_key, **kwargs)
+
+    batches = [times[i:i + _TIMELINE_SAMPLES_PER_JOB] for i in range(0, len(times), _TIMELINE_SAMPLES_PER_JOB)]
+    keyed = await asyncio.gather(*(
+        on_render_worker(
+            timeline_frame_keys,
+            flight_key=(color_str, device_profile.name, tuple(batch)),
+            color=color_str,
+            times=batch,
+            profile=device_profile,
         )
-    return f"Rendered {color.value}. Waiting for download."
+        for batch in batches
+    ))
+    keys = [key for (batch_keys, _, _) in keyed for key in batch_keys]
+    first_of_key: Dict[str, Tuple[datetime.datetime, str]] = {}
+    errors: Dict[datetime.datetime, str] = {}
+    for (_, batch_first_of_key, batch_errors) in keyed:
+        for (key, first) in batch_first_of_key.items():
+            first_of_key.setdefault(key, first)
+        errors.update(batch_errors)
+
+    pngs = await asyncio.gather(*(
+        on_render_worker(
+            render_timeline_frame,
+            flight_key=(key,),
+            color=color_str,
+            now_utc=at,
+            html_content=html_content,
+            profile=device_profile,
+        )
+        for (key, (at, html_content)) in first_of_key.items()
+    ), return_exceptions=True)
+    png_of_hash = {}
+    hash_of_key = {}
+    for (key, png) in zip(first_of_key, pngs):
+        if isinstance(png, BaseException):
+            if not isinstance(png, Exception):
+                raise png
+            _logger.warning(f"Couldn't render the timeline frame of {first_of_key[key][0]}: {png}")
+            message = png.detail if isinstance(png, HTTPException) else str(png)
+            for (at, sample_key) in zip(times, keys):
+                if sample_key == key:
+                    errors[at] = message
+            continue
+        hash_of_key[key] = frame_artifacts.store(png, keep_for=_TIMELINE_FRAMES_KEEP_FOR)
+        png_of_hash[hash_of_key[key]] = png
+    all_frames = timeline.collapse(times, [hash_of_key.get(key) for key in keys], end=end_utc)
+    frames = [frame for frame in all_frames if frame.content_hash is not None]
+    failed = [frame for frame in all_frames if frame.content_hash is None]
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _logger.info(
+        f"Timeline of {len(times)} samples: rendered {len(hash_of_key)}, {len(frames)} distinct, "
+        f"{len(errors)} failed, in {elapsed_ms:.0f} ms"
+    )
+
+    if format == TimelineFormat.CONTACT_SHEET:
+        sheet = await on_render_worker(
+            timeline.contact_sheet,
+            flight_key=(tuple(frame.content_hash for frame in frames), columns),
+            frames=[(frame.label(tz=LOCAL_TZ), png_of_hash[frame.content_hash]) for frame in frames],
+            columns=columns,
+        )
+        return Response(content=sheet, media_type="image/png")
+    return {
+        "start": start_utc.isoformat(),
+        "end": end_utc.isoformat(),
+        "step_minutes": step_minutes,
+        "color": color_str,
+        "profile": device_profile.name,
+        "samples": len(times),
+        "rendered": len(hash_of_key),
+        "distinct": len(frames),
+        "elapsed_ms": round(elapsed_ms),
+        "frames": [
+            {
+                "content_hash": frame.content_hash,
+                "url": f"/frames/{frame.content_hash}.png",
+                "spans": [{"from": since.isoformat(), "until": until.isoformat()} for (since, until) in frame.spans],
+            }
+            for frame in frames
+        ],
+        "failed": {
+            "samples": len(errors),
+            "spans": [
+                {"from": since.isoformat(), "until": until.isoformat()}
+                for frame in failed
+                for (since, until) in frame.spans
+            ],
+            "errors": sorted(set(errors.values())),
+        },
+    }
+
+
+async def ensure_rendered(
+    colors: List[str],
+    at: Optional[str],
+    force_refresh: bool,
+    engine: RenderEngine,
+    profile: DeviceProfile = DEFAULT_PROFILE,
+) -> None:
+    """
+    Make sure the profile's output directory holds the current images of `colors`:
+    use the pre-rendered frame if it's the right one for now, and render otherwise.
+    """
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    if at:
+        datetime.datetime.strptime(at, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
+    # Serve the pre-rendered frame, if it's the right one for now
+    if frame_schedule and not at and not force_refresh and engine == RenderEngine.BROWSER:
+        frame_schedule.promote_due(now_utc)
+        if frame_schedule.is_current(now_utc):
+            return
+    for color in colors:
+        await run_on_render_worker(
+            render_one_color,
+            flight_key=(color, engine.value, force_refresh, profile.name),
+            color=color,
+            now_utc=now_utc,
+            force_refresh=force_refresh,
+            engine=engine,
+            profile=profile,
+        )
+    if colors and not at and profile.name == DEFAULT_PROFILE_NAME:
+        # It reads and hashes the files, so not on the event loop. Not single-flight
+        # either: a publish already in flight may have read the files before this render.
+        await asyncio.to_thread(publish_current_frame)
+
+
+def current_frame(profile: DeviceProfile = DEFAULT_PROFILE) -> Tuple[str, Dict[str, str]]:
+    """
+    The hash of the profile's current frame (its black and red images), and the
+    `ETag` of each color.
+
+    Raises:
+        FileNotFoundError: If the frame hasn't been rendered
+    """
+    colors = list(profile.colors)
+    etags = {color: content_tags.validators(get_filename(color=color, profile=profile)).etag for color in colors}
+    frame_hash = hashlib.sha256(",".join(etags[color] for color in colors).encode()).hexdigest()[:32]
+    return (frame_hash, etags)
+
+
+def publish_current_frame() -> None:
+    """
+    Publish the current images of every profile to `frame_artifacts`, and tell the
+    displays waiting on `change_feed` about the current frame, if it changed.
+    """
+    for device_profile in device_profiles.values():
+        for color in device_profile.output_colors:
+            try:
+                frame_artifacts.publish(device_profile.name, color, get_filename(color=color, profile=device_profile))
+            except FileNotFoundError:
+                pass
+    try:
+        (frame_hash, etags) = current_frame()
+    except FileNotFoundError:
+        return
+    if change_feed.publish_frame(frame_hash=frame_hash, etags=etags):
+        _logger.info(f"Published frame {frame_hash}")
 
 
 @app.get("/eink/{color}", response_class=FileResponse)
-async def eink(color: ColorName, at: Optional[str] = None, force_refresh: bool = False):
+async def eink(
+    color: ColorName,
+    at: Optional[str] = None,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: str = DEFAULT_PROFILE_NAME,
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+):
     """
     Returns the rendered image file for the specified color.
+
+    The image is served from its hash-named artifact (see `artifacts.py`), which
+    `Content-Location` points to. The response has a strong `ETag` of the image's
+    content. A request whose `If-None-Match` matches it (or, without one, whose
+    `If-Modified-Since` isn't older than the image) gets a 304 with no body. See
+    `conditional.py`.
     
     Args:
         color: The color variant (red, black, joined)
         at: Optional datetime to render (format: "%Y%m%d-%H%M%S", must be UTC timezone). Defaults to current UTC time.
         force_refresh: If True, bypass cache and fetch fresh data
+        engine: Render with the browser, or draw natively with Pillow
+        profile: The device profile (see `/profiles`)
     """
+    device_profile = get_profile(profile)
     color_str = color.value
     color_str = untaint_filename(color_str)
-    now_utc = datetime.datetime.now(datetime.timezone.utc)
-    if at:
-        datetime.datetime.strptime(at, _DATETIME_FORMAT_IN_URL).replace(tzinfo=datetime.timezone.utc)
+    image_path = get_filename(color=color_str, profile=device_profile)
+    # always render "joined", since it's for dev work
+    colors_to_render = [color_str] if color_str in ("joined", "black") else []
+    await ensure_rendered(
+        colors=colors_to_render, at=at, force_refresh=force_refresh, engine=engine, profile=device_profile
+    )
     try:
-        # always render "joined", since it's for dev work
-        if color_str == "joined" or color_str == "black":
-            render_one_color(color=color_str, now_utc=now_utc, force_refresh=force_refresh)
-    except CacheMissError as e:
+        # It may read and hash the image, so not on the event loop
+        (content_hash, artifact) = await asyncio.to_thread(
+            frame_artifacts.publish, device_profile.name, color_str, image_path
+        )
+    except FileNotFoundError:
         raise HTTPException(
-            status_code=503,
-            detail=str(e)
+            status_code=404,
+            detail="The requested image could not be found. "
+            "Did you render it first?",
         )
-    image_path = get_filename(color=color_str)
-    if not image_path.exists():
+    # The artifact is never written again, so this can't read a half-rendered frame
+    served = served_bytes.get(artifact, immutable=True)
+    validators = Validators.from_hash(content_hash, mtime=served.mtime)
+    headers = {**validators.headers(), "Content-Location": f"/frames/{content_hash}.png"}
+    if is_not_modified(validators, if_none_match=if_none_match, if_modified_since=if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return Response(content=served.body, media_type="image/png", headers=headers)
+
+
+class BitplaneName(str, Enum):
+    """The packed 1-bit buffers served by `/eink-bits/{plane}`."""
+    RED = "red"
+    BLACK = "black"
+    COMBINED = "combined"
+    """The black plane, followed by the red plane"""
+
+
+@app.get("/eink-bits/{plane}", response_class=Response)
+async def eink_bits(
+    plane: BitplaneName,
+    rle: bool = False,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: str = DEFAULT_PROFILE_NAME,
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+):
+    """
+    Returns the frame as raw packed 1-bit planes, for devices that don't want to
+    decode PNGs. See `bitplanes.py` for the layout.
+
+    Supports conditional requests, like `/eink/{color}`.
+
+    Args:
+        plane: red, black, or combined (black followed by red, or just black on a
+            panel without red)
+        rle: If True, the buffer is PackBits run-length encoded
+        force_refresh: If True, bypass cache and fetch fresh data
+        engine: Render with the browser, or draw natively with Pillow
+        profile: The device profile (see `/profiles`)
+    """
+    device_profile = get_profile(profile)
+    colors = list(device_profile.colors) if plane == BitplaneName.COMBINED else [plane.value]
+    paths = [get_filename(color=color, profile=device_profile) for color in colors]
+    await ensure_rendered(
+        colors=colors, at=None, force_refresh=force_refresh, engine=engine, profile=device_profile
+    )
+    try:
+        color_validators = [content_tags.cached(path) for path in paths]
+        if None in color_validators:
+            # Hashing the files is for a thread, not the event loop
+            color_validators = await asyncio.to_thread(lambda: [content_tags.validators(path) for path in paths])
+        newest = max(color_validators, key=lambda v: v.mtime)
+        validators = newest.derive(",".join([plane.value, f"rle={rle}"] + [v.etag for v in color_validators]))
+        if is_not_modified(validators, if_none_match=if_none_match, if_modified_since=if_modified_since):
+            return Response(status_code=304, headers=validators.headers())
+        planes = [bitplane_cache.cached(path, rle=rle) for path in paths]
+        if None in planes:
+            # So is decoding the PNGs and packing (and encoding) their planes
+            planes = await asyncio.to_thread(lambda: [bitplane_cache.plane(path, rle=rle) for path in paths])
+        data = b"".join(planes)
+    except FileNotFoundError:
         raise HTTPException(
             status_code=404,
             detail="The requested image could not be found. "
             "Did you render it first?",
         )
-    return str(image_path)
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={
+            **validators.headers(),
+            "X-Frame-Width": str(device_profile.width),
+            "X-Frame-Height": str(device_profile.height),
+            "X-Planes": ",".join(colors),
+            "X-Plane-Encoding": "packbits" if rle else "raw",
+        },
+    )
+
+
+@app.get("/eink-diff/{device}")
+async def eink_diff(
+    device: str,
+    have: Optional[str] = None,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: str = DEFAULT_PROFILE_NAME,
+):
+    """
+    Returns only the regions of the black and red planes that changed since the
+    last frame this device got, for a partial refresh. See `frame_diff.py`.
+
+    Args:
+        device: Some stable id of the device
+        have: The `frame_id` of the frame the device is showing, from its last response
+        force_refresh: If True, bypass cache and fetch fresh data
+        engine: Render with the browser, or draw natively with Pillow
+        profile: The device profile (see `/profiles`)
+
+    Returns:
+        The new `frame_id`, whether a full refresh is recommended (and why), and per
+        plane a list of rectangles, each with its packed pixel data in base64
+    """
+    device_profile = get_profile(profile)
+    colors = list(device_profile.colors)
+    await ensure_rendered(
+        colors=colors, at=None, force_refresh=force_refresh, engine=engine, profile=device_profile
+    )
+    paths = {color: get_filename(color=color, profile=device_profile) for color in colors}
+    try:
+        planes = {color: bitplane_cache.cached(path) for (color, path) in paths.items()}
+        if None in planes.values():
+            # Decoding the PNGs and packing their planes is for a thread, not the event loop
+            planes = await asyncio.to_thread(lambda: {color: bitplane_cache.plane(path) for (color, path) in paths.items()})
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail="The requested image could not be found. "
+            "Did you render it first?",
+        )
+    update = device_frames[device_profile.name].update(device=untaint_filename(device), planes=planes, have=have)
+    return {
+        "frame_id": update.frame_id,
+        "base_frame_id": update.base_frame_id,
+        "full_refresh": update.full_refresh,
+        "reason": update.reason,
+        "width": device_profile.width,
+        "height": device_profile.height,
+        "planes": {
+            name: [
+                {**asdict(rect), "data": base64.b64encode(data).decode("ascii")}
+                for (rect, data) in zip(rects, update.data[name])
+            ]
+            for (name, rects) in update.rects.items()
+        },
+    }
+
+
+@app.get("/poll")
+async def poll(
+    have: Optional[str] = None,
+    force_refresh: bool = False,
+    engine: RenderEngine = RenderEngine.BROWSER,
+    profile: str = DEFAULT_PROFILE_NAME,
+):
+    """
+    Everything a device needs to know in one round trip: whether the frame changed
+    since the version it has, and when it should wake up and poll again.
+
+    `next_wake_at` is the first of: the next change point of the frame (template
+    switch, weather hour, date, tset, starlight; see `prerender.change_points()`),
+    and the next time fresh data is expected for a data type that's on the
+    display. The device can deep-sleep until then.
+
+    Args:
+        have: The `frame_hash` from the device's last poll
+        force_refresh: If True, bypass cache and fetch fresh data
+        engine: Render with the browser, or draw natively with Pillow
+        profile: The device profile (see `/profiles`)
+
+    Returns:
+        Whether the frame `changed`, its `frame_hash`, the `ETag` of each color (for
+        conditional requests to `/eink/{color}`), and `next_wake_at` with its reasons
+    """
+    device_profile = get_profile(profile)
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    await ensure_rendered(
+        colors=list(device_profile.colors), at=None, force_refresh=force_refresh, engine=engine, profile=device_profile
+    )
+    try:
+        (frame_hash, etags) = current_frame(profile=device_profile)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail="The requested image could not be found. "
+            "Did you render it first?",
+        )
+    wake = prerender.next_wake(now_utc, data_refreshes=_expected_data_refreshes(now_utc), **_zmanim_change_times(now_utc))
+    return {
+        "now": now_utc.isoformat(),
+        "changed": have != frame_hash,
+        "frame_hash": frame_hash,
+        "etags": etags,
+        "next_wake_at": wake.at.isoformat(),
+        "next_wake_reasons": list(wake.reasons),
+        "sleep_seconds": max(0, int((wake.at - now_utc).total_seconds())),
+    }
+
+
+@app.get("/changes/wait")
+async def changes_wait(since: Optional[int] = None, have: Optional[str] = None, timeout: float = 60):
+    """
+    Long-poll: blocks until the frame changes, or fresh data that's on the display
+    is cached (as `/what-has-changed` reports), and then returns right away.
+
+    Args:
+        since: The `sequence` of the last change the client saw. Without it, or
+            with one from before the backend restarted (newer than the current
+            one), this returns the current snapshot right away.
+        have: The `frame_hash` the client is showing. If the current frame is a
+            different one, this returns right away.
+        timeout: Seconds to wait, at most `_LONG_POLL_MAX_TIMEOUT`
+
+    Returns:
+        The change feed snapshot (`sequence`, `frame_hash`, `etags`, what `changed`
+        and when), with `timed_out` set if nothing changed
+    """
+    snapshot = change_feed.snapshot()
+    if since is None or (have and snapshot["frame_hash"] and have != snapshot["frame_hash"]):
+        return {**snapshot, "timed_out": False}
+    timeout = min(max(0.0, timeout), _LONG_POLL_MAX_TIMEOUT.total_seconds())
+    changed = await change_feed.wait(since=since, timeout=timeout)
+    if changed is None:
+        return {**change_feed.snapshot(), "timed_out": True}
+    return {**changed, "timed_out": False}
+
+
+@app.get("/changes/stream")
+async def changes_stream(request: Request, last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-Sent Events: a `change` event with the change feed snapshot (as in
+    `/changes/wait`) every time it changes, starting with the current one. The
+    event id is the snapshot's `sequence`, so a client that reconnects with
+    `Last-Event-ID` only gets what it missed. A `Last-Event-ID` from before the
+    backend restarted gets the current snapshot right away.
+    """
+    since = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+
+    async def events():
+        sequence = since
+        yield "retry: 10000\n\n"
+        while not await request.is_disconnected():
+            snapshot = await change_feed.wait(since=sequence, timeout=_CHANGE_STREAM_KEEPALIVE.total_seconds())
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            sequence = snapshot["sequence"]
+            yield f"id: {sequence}\nevent: change\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/profiles")
+async def list_profiles():
+    """The device profiles this backend renders for. See `device_profiles.py`."""
+    return {
+        name: {
+            **asdict(profile),
+            "layout_width": profile.layout_width,
+            "layout_height": profile.layout_height,
+            "output_dir": str(profile.output_dir(out_dir)),
+        }
+        for name, profile in device_profiles.items()
+    }
+
+
+@app.get("/frames/manifest")
+async def frames_manifest():
+    """
+    The hash of the current image of each profile and color. A display can check
+    this (or the `ETag` of `/eink`) for changes, and download only new hashes from
+    `/frames/{hash}.png`.
+    """
+    return {"profiles": frame_artifacts.manifest()}
+
+
+@app.get("/frames/{content_hash}.png", response_class=FileResponse)
+async def frame_artifact(content_hash: str, if_none_match: Optional[str] = Header(default=None)):
+    """A rendered image, by its content hash. Its content never changes, so it may be cached for good."""
+    try:
+        served = served_bytes.get(frame_artifacts.path(content_hash), immutable=True)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="No such frame. It may have been pruned.")
+    validators = Validators.from_hash(content_hash, mtime=served.mtime)
+    headers = {**validators.headers(), "Cache-Control": "public, max-age=31536000, immutable"}
+    if is_not_modified(validators, if_none_match=if_none_match, if_modified_since=None):
+        return Response(status_code=304, headers=headers)
+    return Response(content=served.body, media_type="image/png", headers=headers)
+
+
+def served_file_response(
+    served: ServedFile,
+    accept_encoding: Optional[str],
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+    media_type: Optional[str] = None,
+) -> Response:
+    """
+    Respond with a file from `served_bytes`, compressed if the client accepts
+    it, or with a 304 if the client has it. Each encoding has its own `ETag`.
+    """
+    (encoding, body) = served.negotiate(accept_encoding)
+    content_hash = f"{served.content_hash}-{encoding}" if encoding else served.content_hash
+    validators = Validators.from_hash(content_hash, mtime=served.mtime)
+    headers = validators.headers()
+    if served.encoded:
+        headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if is_not_modified(validators, if_none_match=if_none_match, if_modified_since=if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type or served.media_type, headers=headers)
 
 
 @app.get("/image-cache/{filename}", response_class=FileResponse)
-async def read_image_from_cache(filename: str):
-    file = Path(f"/image-cache/{filename}")
-    if file.exists():
-        return str(file)
-    else:
+async def read_image_from_cache(
+    filename: str,
+    accept_encoding: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+):
+    try:
+        served = served_bytes.get(render.EXTRACTED_CACHE / filename)
+    except (FileNotFoundError, IsADirectoryError):
         raise HTTPException(
             status_code=404,
             detail="The requested image could not be found.",
         )
+    return served_file_response(served, accept_encoding, if_none_match, if_modified_since)
 
 @app.get("/css/{filename}")
-async def read_css_file(filename: str):
-    file = Path(f"/app/assets/{filename}")
-    if file.exists():
-        return FileResponse(str(file), media_type="text/css")
-    else:
+async def read_css_file(
+    filename: str,
+    accept_encoding: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+):
+    try:
+        served = served_bytes.get(Path(f"/app/assets/{filename}"))
+    except (FileNotFoundError, IsADirectoryError):
         raise HTTPException(
             status_code=404,
             detail="The requested CSS file could not be found.",
         )
+    return served_file_response(served, accept_encoding, if_none_match, if_modified_since, media_type="text/css")
+
+
 
+@app.get("/frame-cache-status")
+async def frame_cache_status():
+    """Debug endpoint: returns the hit/miss counters and size of the rendered-frame cache."""
+    return frame_cache.status()
+
+
+@app.get("/prerender-status")
+async def prerender_status():
+    """Debug endpoint: returns the published and staged pre-rendered frames."""
+    if not frame_schedule:
+        return {"enabled": False}
+    return {"enabled": True, **frame_schedule.status()}
 
 
 @app.get("/cache-status")
@@ -796,8 +2302,6 @@ async def cache_status(client_last_updated_at: Optional[str] = Query(None, examp
         client_last_updated_at: Optional datetime when client last updated (format: "%Y%m%d-%H%M%S", must be UTC timezone).
                                 Used to determine if client needs to refresh.
     """
-    import sqlite3
-    
     now = datetime.datetime.now(datetime.timezone.utc)
     client_last_updated_at_dt = None
     if client_last_updated_at:
@@ -808,31 +2312,28 @@ async def cache_status(client_last_updated_at: Optional[str] = Query(None, examp
     cache_info = {}
     
     try:
-        conn = sqlite3.connect(str(data_cache.DB_PATH))
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT data_type, timestamp, expiration FROM data_cache")
-        rows = cursor.fetchall()
-        conn.close()
-        
-        for data_type, timestamp_str, expiration_str in rows:
-            timestamp = datetime.datetime.fromisoformat(timestamp_str)
-            # Ensure timezone-aware
-            if timestamp.tzinfo is None:
-                timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
-            expiration = datetime.datetime.fromisoformat(expiration_str)
-            # Ensure timezone-aware
-            if expiration.tzinfo is None:
-                expiration = expiration.replace(tzinfo=datetime.timezone.utc)
+        for entry in data_cache.get_entries():
+            (data_type, expiration, changed_at) = (entry.data_type, entry.expiration, entry.changed_at)
             is_expired = expiration <= now
-            client_should_update = is_expired or (client_last_updated_at_dt and timestamp > client_last_updated_at_dt)
+            servable_until = expiration + datetime.timedelta(hours=data_cache.MAX_STALE_HOURS.get(data_type, 0))
+            # Expired data is still shown while it's refreshed, usually to the same
+            # data, and data that was fetched again but is the same doesn't count.
+            # Only data that's been stale for too long can't be shown anymore.
+            client_should_update = servable_until <= now or bool(
+                client_last_updated_at_dt and changed_at > client_last_updated_at_dt
+            )
             
             cache_info[data_type] = {
-                "updated_at": timestamp.isoformat(),
+                "updated_at": changed_at.isoformat(),
+                "fetched_at": entry.timestamp.isoformat(),
+                "content_hash": entry.content_hash,
                 "client_should_update": client_should_update,
                 "expiration": expiration.isoformat(),
                 "expired": is_expired,
                 "ttl_hours": data_cache.EXPIRATION_HOURS.get(data_type, "unknown"),
+                # Expired data is still shown until then, while it's refreshed
+                "servable_until": servable_until.isoformat(),
+                "refreshing": data_type in _refreshing,
             }
     except Exception as e:
         cache_info["error"] = str(e)
@@ -841,6 +2342,16 @@ async def cache_status(client_last_updated_at: Optional[str] = Query(None, examp
     return {
         "now": now.isoformat(),
         "scheduler_running": scheduler.running if scheduler else False,
+        "browser_pool": browser_pool.status() if browser_pool else None,
+        "render_workers": render_workers.status(),
+        "single_flight": {"render": render_flights.status(), "fetch": fetch_flights.status()},
+        "content_tags": content_tags.status(),
+        "frame_artifacts": frame_artifacts.status(),
+        "served_bytes": served_bytes.status(),
+        "data_cache": data_cache.status(),
+        "bitplanes": bitplane_cache.status(),
+        "device_frames": {name: frames.status() for name, frames in device_frames.items()},
+        "change_feed": change_feed.status(),
         "cache_data": cache_info
     }
 
@@ -881,24 +2392,15 @@ async def what_has_changed(client_last_updated_at: Optional[str] = Query(None, e
     changes_report = {}
     
     try:
-        conn = sqlite3.connect(str(data_cache.DB_PATH))
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT data_type, timestamp FROM data_cache")
-        rows = cursor.fetchall()
-        conn.close()
-        
-        for data_type, timestamp_str in rows:
-            timestamp = datetime.datetime.fromisoformat(timestamp_str)
-            # Ensure timezone-aware
-            if timestamp.tzinfo is None:
-                timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
-            
-            # Determine if data has changed since client_last_updated_at
+        for entry in data_cache.get_entries():
+            (data_type, changed_at) = (entry.data_type, entry.changed_at)
+
+            # Determine if data has changed since client_last_updated_at. Data
+            # that was fetched again but is the same doesn't count.
             has_changed = False
             if client_last_updated_at_dt:
-                _logger.debug(f"Comparing timestamp for {data_type}: {timestamp} with client_last_updated_at: {client_last_updated_at_dt}")
-                has_changed = timestamp > client_last_updated_at_dt
+                _logger.debug(f"Comparing changed_at for {data_type}: {changed_at} with client_last_updated_at: {client_last_updated_at_dt}")
+                has_changed = changed_at > client_last_updated_at_dt
             else:
                 _logger.warning("client_last_updated_at is not provided, cannot determine if data has changed. Defaulting to False.")
             
@@ -906,7 +2408,8 @@ async def what_has_changed(client_last_updated_at: Optional[str] = Query(None, e
             is_relevant = _is_data_type_relevant_at_time(data_type, now_utc)
             
             changes_report[data_type] = {
-                "updated_at": timestamp.isoformat(),
+                "updated_at": changed_at.isoformat(),
+                "fetched_at": entry.timestamp.isoformat(),
                 "has_changed": has_changed,
                 "is_relevant_to_display": is_relevant
             }
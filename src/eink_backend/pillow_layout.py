@@ -0,0 +1,438 @@
+"""
+Native render engine: draws the e-ink boards with Pillow, without a browser.
+
+Each HTML layout in `assets/` has a matching `*.native.json` file that describes
+the same board declaratively, as a list of elements with pixel boxes. The
+elements are filled in from the same dictionary that fills the HTML template
+(see `main.collect_all_values_of_data`), including the HTML fragments that the
+weather, calendar and chores modules produce, which are picked apart with CSS
+selectors.
+
+Every element has a color ("black" or "red"), just like the `.black` and `.red`
+classes in the HTML. A plane is drawn directly as a 1-bit image, and only the
+elements of its own color are drawn on it. Elements picked out of an HTML
+fragment take their color from the nearest `red`/`black` class in the fragment.
+
+Supported element types:
+- `text`: a `$template` string drawn in a box
+- `table`: rows of `$template` cells, with fixed column widths
+- `fragment_line`: parts of an HTML fragment, drawn one after the other on a line
+- `fragment_list`: items of an HTML fragment laid out as columns or rows, each
+  made of cells picked out of the item
+- `rect` and `ellipse`: shapes, outlined or filled
+
+An element can be made conditional with `when` (all listed values must match),
+or with `unless_hidden` (skipped if `$additional_css` hides that selector).
+Hebrew text is drawn right-to-left: with libraqm when Pillow has it, and with a
+small built-in bidi reordering otherwise.
+"""
+
+import functools
+import json
+import logging
+import re
+from pathlib import Path
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+from PIL import Image, ImageDraw, ImageFont, features
+
+_logger: logging.Logger = logging.getLogger()
+
+FONT_PATH = Path(__file__).parent.parent.parent / "assets/fonts/arial.ttf"
+
+INK = 0
+PAPER = 1
+
+_HAS_RAQM = features.check("raqm")
+
+Box = Tuple[int, int, int, int]
+"""x, y, width, height"""
+
+
+def native_layout_path(html_layout_path: Path) -> Path:
+    """`layout-shabbat.html` is described natively by `layout-shabbat.native.json`"""
+    return html_layout_path.with_name(html_layout_path.stem + ".native.json")
+
+
+@functools.lru_cache(maxsize=16)
+def _load_layout_cached(path: Path, mtime: float) -> Dict[str, Any]:
+    layout = json.loads(path.read_text(encoding="utf-8"))
+    elements: List[Dict[str, Any]] = []
+    for include in layout.get("include", []):
+        elements += load_layout(path.parent / include)["elements"]
+    elements += layout.get("elements", [])
+    return {**layout, "elements": elements}
+
+
+def load_layout(path: Path) -> Dict[str, Any]:
+    """Load a layout description, with its includes resolved. Cached until the file changes."""
+    return _load_layout_cached(path, path.stat().st_mtime)
+
+
+# ---------------------------------------------------------------------------
+# Text: fonts, bidi and the glyph cache
+# ---------------------------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=32)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(str(FONT_PATH), size)
+
+
+def _char_direction(c: str) -> str:
+    o = ord(c)
+    if 0x0590 <= o <= 0x05FF or 0xFB1D <= o <= 0xFB4F:
+        return "R"
+    if c.isalnum():
+        return "L"
+    return "N"
+
+
+_MIRRORED = {"(": ")", ")": "(", "[": "]", "]": "[", "{": "}", "}": "{", "<": ">", ">": "<"}
+
+
+def visual_order(text: str, direction: str = "rtl") -> str:
+    """
+    Reorder logical text into the left-to-right order it should be drawn in.
+
+    This is a small subset of the Unicode bidi algorithm, which is enough for
+    Hebrew mixed with numbers and Latin text: neutral characters between two
+    runs of the same direction join them, and otherwise take the direction of
+    the paragraph. Right-to-left runs are reversed and their brackets mirrored.
+    """
+    if not any(_char_direction(c) == "R" for c in text):
+        return text
+    base = "R" if direction == "rtl" else "L"
+    strong = [_char_direction(c) for c in text]
+
+    resolved = list(strong)
+    i = 0
+    while i < len(text):
+        if strong[i] != "N":
+            i += 1
+            continue
+        j = i
+        while j < len(text) and strong[j] == "N":
+            j += 1
+        before = strong[i - 1] if i > 0 else base
+        after = strong[j] if j < len(text) else base
+        for k in range(i, j):
+            resolved[k] = before if before == after else base
+        i = j
+
+    runs: List[Tuple[str, str]] = []
+    for c, d in zip(text, resolved):
+        if runs and runs[-1][0] == d:
+            runs[-1] = (d, runs[-1][1] + c)
+        else:
+            runs.append((d, c))
+    if base == "R":
+        runs.reverse()
+    return "".join(
+        "".join(_MIRRORED.get(c, c) for c in reversed(s)) if d == "R" else s
+        for d, s in runs
+    )
+
+
+@functools.lru_cache(maxsize=2048)
+def _text_mask(text: str, size: int, bold: bool, direction: str) -> Image.Image:
+    """
+    Render a line of text into a 1-bit mask (1 where there's ink).
+    This is the glyph cache: the same strings are drawn on every frame.
+    """
+    font = _font(size)
+    if _HAS_RAQM:
+        draw_text, kwargs = text, {"direction": direction}
+    else:
+        draw_text, kwargs = visual_order(text, direction=direction), {}
+    stroke = 1 if bold else 0
+    ascent, descent = font.getmetrics()
+    width = int(font.getlength(draw_text, **kwargs)) + 2 * stroke + 1
+    mask = Image.new("1", (max(width, 1), ascent + descent + 2 * stroke), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.fontmode = "1"  # no anti-aliasing, the panel can't show it anyway
+    draw.text((stroke, stroke), draw_text, font=font, fill=1, stroke_width=stroke, stroke_fill=1, **kwargs)
+    return mask
+
+
+def _draw_text(
+    plane: Image.Image,
+    text: str,
+    box: Box,
+    size: int,
+    align: str = "left",
+    bold: bool = False,
+    direction: str = "ltr",
+    ink: int = INK,
+) -> int:
+    """Draw one line of text, clipped to the box. Returns the drawn width."""
+    text = " ".join(text.split())
+    if not text:
+        return 0
+    x, y, w, h = box
+    mask = _text_mask(text, size, bold, direction)
+    if mask.width > w:
+        # Overflow is hidden. For right-to-left text, it's the end of the text
+        # (on the left) that gets cut off.
+        left = mask.width - w if direction == "rtl" else 0
+        mask = mask.crop((left, 0, left + w, mask.height))
+    if mask.height > h:
+        mask = mask.crop((0, 0, mask.width, h))
+    if align == "center":
+        x += (w - mask.width) // 2
+    elif align == "right":
+        x += w - mask.width
+    plane.paste(ink, (x, y), mask)
+    return mask.width
+
+
+# ---------------------------------------------------------------------------
+# Images
+# ---------------------------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=128)
+def _image_mask_cached(path: str, mtime: float, width: Optional[int], height: int) -> Image.Image:
+    src = Image.open(path).convert("LA")
+    if width is None:
+        width = max(1, round(src.width * height / src.height))
+    src = src.resize((width, height), Image.Resampling.NEAREST)
+    luminance, alpha = src.split()
+    dark = luminance.point(lambda v: 255 if v < 128 else 0, mode="1")
+    opaque = alpha.point(lambda v: 255 if v >= 128 else 0, mode="1")
+    mask = Image.new("1", src.size, 0)
+    mask.paste(dark, (0, 0), opaque)
+    return mask
+
+
+def _image_mask(src: str, width: Optional[int], height: int) -> Optional[Image.Image]:
+    """Load an icon as a 1-bit ink mask, or None if it isn't a local file."""
+    path = Path(src.replace("file://", ""))
+    if not path.is_file():
+        return None
+    return _image_mask_cached(str(path), path.stat().st_mtime, width, height)
+
+
+def _draw_image(plane: Image.Image, src: str, box: Box, align: str = "left", width: Optional[int] = None) -> int:
+    x, y, w, h = box
+    mask = _image_mask(src, width=width, height=h)
+    if mask is None:
+        return 0
+    if align == "center":
+        x += (w - mask.width) // 2
+    elif align == "right":
+        x += w - mask.width
+    plane.paste(INK, (x, y), mask.crop((0, 0, min(mask.width, w), mask.height)))
+    return mask.width
+
+
+# ---------------------------------------------------------------------------
+# Elements
+# ---------------------------------------------------------------------------
+
+
+def _fill(template: str, values: Dict[str, Any]) -> str:
+    return Template(template).safe_substitute(**{k: str(v) for k, v in values.items()})
+
+
+def _node_color(node: Any) -> Optional[str]:
+    """The color of a fragment node is its nearest `red` or `black` class."""
+    while node is not None and getattr(node, "get", None):
+        classes = node.get("class") or []
+        for color in ("red", "black"):
+            if color in classes:
+                return color
+        node = node.parent
+    return None
+
+
+def _is_visible(element: Dict[str, Any], values: Dict[str, Any]) -> bool:
+    for key, expected in element.get("when", {}).items():
+        if str(values.get(key, "")) != str(expected):
+            return False
+    hidden_selector = element.get("unless_hidden")
+    if hidden_selector:
+        pattern = re.escape(hidden_selector) + r"\s*\{\s*display:\s*none"
+        if re.search(pattern, str(values.get("additional_css", ""))):
+            return False
+    return True
+
+
+def _draw_cell(plane: Image.Image, color: str, node: Any, cell: Dict[str, Any], box: Box) -> None:
+    if node is None:
+        return
+    if cell.get("type") == "list":
+        # A nested list, e.g. the events of a calendar day
+        _draw_fragment_list(plane, color, {**cell, "box": box}, node)
+        return
+    cell_color = cell.get("color") or _node_color(node) or "black"
+    if cell_color != color:
+        return
+    if cell.get("type") == "image":
+        x, y, w, h = box
+        _draw_image(
+            plane,
+            node.get("src", ""),
+            (x, y, w, cell.get("height", h)),
+            align=cell.get("align", "left"),
+            width=cell.get("width"),
+        )
+        return
+    _draw_text(
+        plane,
+        node.get_text(" "),
+        box,
+        size=cell.get("font_size", 24),
+        align=cell.get("align", "left"),
+        bold=cell.get("bold", False),
+        direction=cell.get("dir", "ltr"),
+    )
+
+
+def _measure_cell(node: Any, cell: Dict[str, Any], height: int) -> int:
+    """The width a cell takes, whether or not it's drawn on this plane."""
+    if node is None:
+        return 0
+    if cell.get("type") == "image":
+        mask = _image_mask(node.get("src", ""), width=cell.get("width"), height=cell.get("height", height))
+        return mask.width if mask else 0
+    text = " ".join(node.get_text(" ").split())
+    if not text:
+        return 0
+    return _text_mask(text, cell.get("font_size", 24), cell.get("bold", False), cell.get("dir", "ltr")).width
+
+
+def _draw_fragment_line(plane: Image.Image, color: str, element: Dict[str, Any], soup: BeautifulSoup) -> None:
+    x0, y, w, h = element["box"]
+    x = x0
+    for part in element["parts"]:
+        node = soup.select_one(part["select"])
+        part_width = _measure_cell(node, part, height=h)
+        if not part_width:
+            continue
+        part_box = (x, y + part.get("y_offset", 0), x0 + w - x, h - part.get("y_offset", 0))
+        _draw_cell(plane, color, node, part, part_box)
+        x += part_width + element.get("gap", 6)
+        if x >= x0 + w:
+            break
+
+
+def _draw_fragment_list(plane: Image.Image, color: str, element: Dict[str, Any], soup: Any) -> None:
+    x0, y0, w, h = element["box"]
+    horizontal = element.get("flow", "vertical") == "horizontal"
+    item_sizes = element["item_size"]
+    items = soup.select(element["items"])[: element.get("max_items", None)]
+    offset = 0
+    draw = ImageDraw.Draw(plane)
+    for index, item in enumerate(items):
+        size = item_sizes[min(index, len(item_sizes) - 1)] if isinstance(item_sizes, list) else item_sizes
+        if offset + size > (w if horizontal else h):
+            break  # overflow is hidden
+        item_box = (x0 + offset, y0, size, h) if horizontal else (x0, y0 + offset, w, size)
+        cell_offset = 0
+        for cell in element["cells"]:
+            cell_size = cell.get("size", size)
+            if horizontal:
+                cell_box = (item_box[0], item_box[1] + cell_offset, size, cell_size)
+            else:
+                cell_box = (item_box[0] + cell_offset, item_box[1], cell_size, size)
+            _draw_cell(plane, color, item.select_one(cell["select"]), cell, cell_box)
+            cell_offset += cell_size
+        separator = element.get("separator")
+        if separator and separator.get("color", "black") == color and index > 0:
+            if horizontal:
+                draw.line((item_box[0], y0, item_box[0], y0 + h - 1), fill=INK)
+            else:
+                draw.line((x0, item_box[1], x0 + w - 1, item_box[1]), fill=INK)
+        offset += size
+
+
+def _draw_element(plane: Image.Image, color: str, element: Dict[str, Any], values: Dict[str, Any]) -> None:
+    kind = element["type"]
+    element_color = element.get("color", "black")
+    if kind in ("fragment_line", "fragment_list"):
+        soup = BeautifulSoup(str(values.get(element["key"], "")), "html.parser")
+        if kind == "fragment_line":
+            _draw_fragment_line(plane, color, element, soup)
+        else:
+            _draw_fragment_list(plane, color, element, soup)
+        return
+    if element_color != color:
+        return
+
+    x, y, w, h = element["box"]
+    if kind == "text":
+        _draw_text(
+            plane,
+            _fill(element["text"], values),
+            (x, y, w, h),
+            size=element.get("font_size", 24),
+            align=element.get("align", "left"),
+            bold=element.get("bold", False),
+            direction=element.get("dir", "ltr"),
+            ink=PAPER if element.get("ink") == "paper" else INK,
+        )
+    elif kind == "table":
+        row_height = element.get("row_height", h // max(1, len(element["rows"])))
+        direction = element.get("dir", "ltr")
+        for row_index, row in enumerate(element["rows"]):
+            cell_x = x + w if direction == "rtl" else x
+            for cell_text, cell_width in zip(row, element["col_widths"]):
+                if direction == "rtl":
+                    cell_x -= cell_width
+                _draw_text(
+                    plane,
+                    _fill(cell_text, values),
+                    (cell_x, y + row_index * row_height, cell_width, row_height),
+                    size=element.get("font_size", 24),
+                    align="right" if direction == "rtl" else "left",
+                    bold=element.get("bold", False),
+                    direction=direction,
+                )
+                if direction != "rtl":
+                    cell_x += cell_width
+    elif kind in ("rect", "ellipse"):
+        draw = ImageDraw.Draw(plane)
+        shape = draw.rectangle if kind == "rect" else draw.ellipse
+        if element.get("fill", False):
+            shape((x, y, x + w - 1, y + h - 1), fill=INK)
+        else:
+            shape((x, y, x + w - 1, y + h - 1), outline=INK, width=element.get("width", 1))
+    else:
+        raise ValueError(f"Unknown layout element type: {kind}")
+
+
+def render_plane(layout_path: Path, values: Dict[str, Any], color: str) -> Image.Image:
+    """
+    Draw one color plane of a board.
+
+    Args:
+        layout_path: The `*.native.json` layout description
+        values: The template values, as built for this color
+        color: "red" or "black"
+
+    Returns:
+        A 1-bit image of the layout's size, where 0 is ink and 1 is paper
+    """
+    layout = load_layout(layout_path)
+    width, height = layout["size"]
+    plane = Image.new("1", (width, height), PAPER)
+    for element in layout["elements"]:
+        if not _is_visible(element, values):
+            continue
+        try:
+            _draw_element(plane, color, element, values)
+        except Exception as ex:
+            _logger.error(f"Could not draw {element.get('type')} element {element.get('name', '')}: {ex}")
+    return plane
+
+
+def compose_joined(planes: Dict[str, Image.Image]) -> Image.Image:
+    """Combine the black and red planes into one full-color preview image."""
+    black, red = planes["black"], planes["red"]
+    joined = Image.new("RGB", black.size, (255, 255, 255))
+    joined.paste((255, 0, 0), (0, 0), red.point(lambda v: 255 if v == INK else 0, mode="1"))
+    joined.paste((0, 0, 0), (0, 0), black.point(lambda v: 255 if v == INK else 0, mode="1"))
+    return joined
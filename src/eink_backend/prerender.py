@@ -0,0 +1,341 @@
+"""
+Render frames ahead of time, shortly before they are needed.
+
+What's on the display only changes at predictable moments:
+- the template switches (`template_path_by_time()` in `main.py`): Friday 00:00
+  and 16:00, Saturday 00:00 (the Friday evening seating layout ends), 10:00 and
+  14:00
+- the weather report moves on to the next hourly forecast, at the top of every hour
+- the dates change at midnight (local and UTC)
+- `is_tset_soon()` flips two hours before tzet Shabbat, and again at tzet Shabbat
+- the omer count switches to the next day's count once the stars are out
+
+`change_points()` lists those moments. Between two change points the frame is the
+same, so it can be rendered once, a few minutes before its change point, and
+staged on disk. At the change point the staged files are renamed into the output
+directory, and the device just downloads a file that is already there.
+
+When cached data is refreshed, the frames that use that data are invalidated and
+rendered again (see `FrameSchedule.invalidate()`).
+"""
+
+import datetime
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import LOCAL_TZ
+
+_logger: logging.Logger = logging.getLogger()
+
+FRIDAY = 4
+SATURDAY = 5
+
+# (weekday, hour) in local time, when `template_path_by_time()` picks a different layout
+_TEMPLATE_SWITCHES = {
+    (FRIDAY, 0),
+    (FRIDAY, 16),
+    (SATURDAY, 0),
+    (SATURDAY, 10),
+    (SATURDAY, 14),
+}
+
+# `is_tset_soon()` is true this long before tzet Shabbat
+_TSET_IS_SOON = datetime.timedelta(hours=2)
+
+
+@dataclass(frozen=True)
+class ChangePoint:
+    at: datetime.datetime
+    """When the frame changes, in UTC"""
+    reasons: Tuple[str, ...]
+    """Why the frame changes at this moment, for logging and the status endpoint"""
+
+
+def change_points(
+    start_utc: datetime.datetime,
+    end_utc: datetime.datetime,
+    tset_shabat: Optional[datetime.datetime] = None,
+    tzet_shabat: Optional[str] = None,
+) -> List[ChangePoint]:
+    """
+    List the moments in `(start_utc, end_utc]` when the frame content may change.
+
+    Args:
+        start_utc: Start of the range (exclusive), timezone-aware
+        end_utc: End of the range (inclusive), timezone-aware
+        tset_shabat: When Shabbat ends, as in `zmanim.times["tset_shabat_as_datetime"]`
+        tzet_shabat: The "HH:MM" starlight time, as in `zmanim.times["tzet_shabat"]`
+
+    Returns:
+        The change points, in chronological order
+    """
+    reasons: Dict[datetime.datetime, List[str]] = {}
+
+    def add(at: datetime.datetime, reason: str) -> None:
+        at = at.astimezone(datetime.timezone.utc)
+        if start_utc < at <= end_utc:
+            reasons.setdefault(at, []).append(reason)
+
+    # Every top of the hour (this also covers local and UTC midnight, since the
+    # local offset is a whole number of hours)
+    hour = start_utc.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    while hour <= end_utc:
+        hour += datetime.timedelta(hours=1)
+        local = hour.astimezone(LOCAL_TZ)
+        if (local.weekday(), local.hour) in _TEMPLATE_SWITCHES:
+            add(hour, "template")
+        if local.hour == 0 or hour.hour == 0:
+            add(hour, "date")
+        add(hour, "weather")
+
+    if tset_shabat:
+        add(tset_shabat - _TSET_IS_SOON, "tset-soon")
+        add(tset_shabat, "tset")
+
+    # `_is_now_after_starlight()` compares the "HH:MM" string with the time of
+    # `now_utc`, every day, and the omer count changes when it becomes true
+    if tzet_shabat:
+        starlight = datetime.time(hour=int(tzet_shabat[0:2]), minute=int(tzet_shabat[3:5]), second=1)
+        day = start_utc.astimezone(datetime.timezone.utc).date()
+        while day <= end_utc.astimezone(datetime.timezone.utc).date():
+            add(datetime.datetime.combine(day, starlight, tzinfo=datetime.timezone.utc), "starlight")
+            day += datetime.timedelta(days=1)
+
+    return [ChangePoint(at=at, reasons=tuple(r)) for at, r in sorted(reasons.items())]
+
+
+def next_change_point(
+    now_utc: datetime.datetime,
+    tset_shabat: Optional[datetime.datetime] = None,
+    tzet_shabat: Optional[str] = None,
+) -> ChangePoint:
+    """Return the first change point after `now_utc`. There is always one within the hour."""
+    return change_points(
+        start_utc=now_utc,
+        end_utc=now_utc + datetime.timedelta(hours=1),
+        tset_shabat=tset_shabat,
+        tzet_shabat=tzet_shabat,
+    )[0]
+
+
+def next_wake(
+    now_utc: datetime.datetime,
+    data_refreshes: Dict[str, datetime.datetime],
+    tset_shabat: Optional[datetime.datetime] = None,
+    tzet_shabat: Optional[str] = None,
+    min_sleep: datetime.timedelta = datetime.timedelta(minutes=1),
+) -> ChangePoint:
+    """
+    When a device that is showing the frame of `now_utc` should wake up and check
+    again: the next change point, or the next time relevant cached data is
+    expected to be refreshed, whichever comes first.
+
+    Args:
+        now_utc: Now, timezone-aware
+        data_refreshes: data type -> when fresh data is expected, for the data
+            types that are on the display
+        tset_shabat: As for `change_points()`
+        tzet_shabat: As for `change_points()`
+        min_sleep: Never wake sooner than this, even if a refresh is overdue
+
+    Returns:
+        The wake-up time, with the reasons for it
+    """
+    wake = next_change_point(now_utc, tset_shabat=tset_shabat, tzet_shabat=tzet_shabat)
+    earliest = now_utc + min_sleep
+    candidates = [(max(wake.at, earliest), reason) for reason in wake.reasons]
+    candidates += [(max(at, earliest), f"{data_type}-refresh") for (data_type, at) in data_refreshes.items()]
+    at = min(at for (at, _) in candidates)
+    return ChangePoint(at=at, reasons=tuple(reason for (when, reason) in candidates if when == at))
+
+
+@dataclass
+class _Frames:
+    valid_from: datetime.datetime
+    valid_until: datetime.datetime
+    generation: int
+    directory: Path
+    reasons: Tuple[str, ...] = field(default_factory=tuple)
+
+
+class FrameSchedule:
+    """
+    Keeps track of which frames are published, and which are staged for later.
+
+    Frames are rendered outside the lock; each render is tagged with the
+    `generation` it started in, and thrown away if data was refreshed meanwhile.
+
+    Args:
+        out_dir: Where the published `{color}.png` files are served from
+        staging_dir: Where frames for upcoming change points wait. Must be on the
+                     same filesystem as `out_dir`, so promoting them is a rename.
+        is_data_relevant: `(data_type, now_utc) -> bool`, tells whether a frame
+                          shown at `now_utc` uses that data type
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        staging_dir: Path,
+        is_data_relevant: Callable[[str, datetime.datetime], bool] = lambda data_type, now_utc: True,
+    ):
+        self.out_dir = out_dir
+        self.staging_dir = staging_dir
+        self.is_data_relevant = is_data_relevant
+        self.generation = 0
+        self._published: Optional[_Frames] = None
+        self._staged: Dict[datetime.datetime, _Frames] = {}
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "staged": 0, "promoted": 0, "invalidated": 0, "discarded": 0}
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def staging_dir_for(self, change_point: ChangePoint) -> Path:
+        """An empty directory to render the frames of `change_point` into."""
+        directory = self.staging_dir / change_point.at.strftime("%Y%m%d-%H%M%S")
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        return directory
+
+    def is_current(self, now_utc: datetime.datetime) -> bool:
+        """True if the published frames are the right ones to show at `now_utc`."""
+        with self._lock:
+            published = self._published
+            return (
+                published is not None
+                and published.generation == self.generation
+                and published.valid_from <= now_utc < published.valid_until
+            )
+
+    def is_staged(self, change_point: ChangePoint) -> bool:
+        with self._lock:
+            staged = self._staged.get(change_point.at)
+            return staged is not None and staged.generation == self.generation
+
+    def mark_published(
+        self, valid_from: datetime.datetime, valid_until: datetime.datetime, generation: int
+    ) -> bool:
+        """
+        Record that the files in `out_dir` were rendered for `valid_from`.
+
+        Returns:
+            False if data was refreshed since the render started, so it's already stale
+        """
+        with self._lock:
+            if generation != self.generation:
+                self._stats["discarded"] += 1
+                return False
+            self._published = _Frames(
+                valid_from=valid_from, valid_until=valid_until, generation=generation, directory=self.out_dir
+            )
+            self._stats["published"] += 1
+            return True
+
+    def stage(self, change_point: ChangePoint, valid_until: datetime.datetime, directory: Path, generation: int) -> bool:
+        """
+        Record that `directory` holds the frames to show from `change_point` on.
+
+        Returns:
+            False if data was refreshed since the render started, and the frames were dropped
+        """
+        with self._lock:
+            if generation != self.generation:
+                self._stats["discarded"] += 1
+                shutil.rmtree(directory, ignore_errors=True)
+                return False
+            self._staged[change_point.at] = _Frames(
+                valid_from=change_point.at,
+                valid_until=valid_until,
+                generation=generation,
+                directory=directory,
+                reasons=change_point.reasons,
+            )
+            self._stats["staged"] += 1
+            return True
+
+    def promote_due(self, now_utc: datetime.datetime) -> bool:
+        """
+        Move the latest staged frames whose change point has come into `out_dir`.
+        Frames that were skipped over or invalidated are deleted.
+
+        Returns:
+            True if frames were promoted
+        """
+        with self._lock:
+            due = sorted(at for at in self._staged if at <= now_utc)
+            if not due:
+                return False
+            frames = self._staged.pop(due[-1])
+            for at in due[:-1]:
+                shutil.rmtree(self._staged.pop(at).directory, ignore_errors=True)
+            if frames.generation != self.generation or now_utc >= frames.valid_until:
+                shutil.rmtree(frames.directory, ignore_errors=True)
+                return False
+            # Other device profiles' frames are in subdirectories
+            for path in sorted(frames.directory.rglob("*")):
+                if path.is_dir():
+                    continue
+                target = self.out_dir / path.relative_to(frames.directory)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+            shutil.rmtree(frames.directory, ignore_errors=True)
+            frames.directory = self.out_dir
+            self._published = frames
+            self._stats["promoted"] += 1
+        _logger.info(f"Promoted frames pre-rendered for {frames.valid_from.isoformat()} ({', '.join(frames.reasons)})")
+        return True
+
+    def invalidate(self, data_type: str) -> bool:
+        """
+        Mark the frames that show `data_type` as stale, after that data was refreshed.
+
+        Returns:
+            True if any published or staged frames were affected, and need re-rendering
+        """
+        with self._lock:
+            frames = list(self._staged.values())
+            if self._published:
+                frames.append(self._published)
+            affected = [
+                f for f in frames
+                if f.generation == self.generation and self.is_data_relevant(data_type, f.valid_from)
+            ]
+            if not affected:
+                return False
+            affected_ids = {id(f) for f in affected}
+            # Frames that don't show this data are carried over to the new generation
+            for f in frames:
+                if id(f) not in affected_ids and f.generation == self.generation:
+                    f.generation += 1
+            self.generation += 1
+            for at in [at for at, f in self._staged.items() if id(f) in affected_ids]:
+                shutil.rmtree(self._staged.pop(at).directory, ignore_errors=True)
+            self._stats["invalidated"] += len(affected)
+        _logger.info(f"Refreshed {data_type} data invalidated {len(affected)} frame(s)")
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            published = self._published
+            return {
+                "generation": self.generation,
+                "published": {
+                    "valid_from": published.valid_from.isoformat(),
+                    "valid_until": published.valid_until.isoformat(),
+                    "stale": published.generation != self.generation,
+                } if published else None,
+                "staged": [
+                    {
+                        "at": at.isoformat(),
+                        "valid_until": f.valid_until.isoformat(),
+                        "reasons": list(f.reasons),
+                        "stale": f.generation != self.generation,
+                    }
+                    for at, f in sorted(self._staged.items())
+                ],
+                **self._stats,
+            }
@@ -1,8 +1,11 @@
 import colorsys
 from dataclasses import dataclass
 import datetime
+import functools
+import io
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
 from PIL import Image
 import textwrap
 import traceback
@@ -15,6 +18,14 @@ INDENT = "    "
 
 EXTRACTED_CACHE = Path("/image-cache")
 
+"""Called with the path of each file written to `EXTRACTED_CACHE`, e.g. to drop it from a cache of served files."""
+on_extracted_write: List[Callable[[Path], None]] = []
+
+
+def _extracted_written(filepath: Path) -> None:
+    for callback in on_extracted_write:
+        callback(filepath)
+
 
 def image_single_color_channel_filename(img_url: str, color: str) -> str:
     url = urllib.parse.urlparse(img_url)
@@ -37,38 +48,52 @@ def rgb_to_hsv(src):
     return (h, s, v)
 
 
+def rgb_to_hsv_arrays(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized `colorsys.rgb_to_hsv()`, for a whole image at once.
+
+    The arithmetic is done in the same order as `colorsys`, in float64, so the
+    results are the same as calling `rgb_to_hsv()` on each pixel.
+
+    Args:
+        rgb: An array of shape (..., 3) with 0-255 values
+
+    Returns:
+        The h, s and v arrays, each in the 0.0-1.0 range
+    """
+    # One contiguous array per channel, reductions over a last axis of 3 are slow
+    r, g, b = (rgb[..., i].astype(np.float64) / 255 for i in range(3))
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    v = maxc
+    # Gray pixels (and black ones) would divide by zero. Dividing by 1 instead
+    # gives them h = 0 and s = 0, like `colorsys` does.
+    s = rangec / np.where(maxc == 0, 1.0, maxc)
+    rangec[rangec == 0] = 1.0
+    rc = (maxc - r) / rangec
+    gc = (maxc - g) / rangec
+    bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc)) / 6.0
+    # Same as `% 1.0`, since h is in [-1/6, 5/6]
+    h[h < 0] += 1.0
+    return (h, s, v)
+
+
 def extract_red(src: Image.Image) -> Image.Image:
-    color_channels = src.split()
-    red_img: Image.Image = None
-    green_img: Image.Image = None
-    blue_img: Image.Image = None
-    if len(color_channels) == 4:
-        red_img, green_img, blue_img, alpha_img = color_channels
-    elif len(color_channels) == 3:
-        red_img, green_img, blue_img = color_channels
-        alpha_img = None
-    else:
-        print(f"Found {len(color_channels)} color channels in image, expected 3 or 4.")
-    red_data = red_img.getdata()
-    green_data = green_img.getdata()
-    blue_data = blue_img.getdata()
-    if alpha_img:
-        alpha_data = alpha_img.getdata()
-    else:
-        alpha_data = None
-    grayscale = Image.new("LA", (src.width, src.height), 0)
-    assert (alpha_data is None) or (len(red_data) == len(alpha_data))
-    grayscale_data = []
-    for i in range(0, len(red_data)):
-        (h, s, v) = rgb_to_hsv((red_data[i], green_data[i], blue_data[i]))
-        if (h <= 0.1 or h >= 0.9) and (v >= 0.8) and (s >= 0.3):
-            grayscale_data.append(0)
-        else:
-            grayscale_data.append(255)
-    grayscale.putdata(grayscale_data)
-    if alpha_img:
-        grayscale.putalpha(alpha_img)
-    return grayscale
+    """
+    Return an "LA" image where the red pixels of `src` are 0 and the rest are 255.
+    The alpha channel is copied from `src`, or is 0 if it has none.
+    """
+    bands = len(src.getbands())
+    if bands not in (3, 4):
+        raise ValueError(f"Cannot extract red from an image with {bands} color channels, expected 3 or 4")
+    pixels = np.asarray(src)
+    (h, s, v) = rgb_to_hsv_arrays(pixels[..., :3])
+    is_red = ((h <= 0.1) | (h >= 0.9)) & (v >= 0.8) & (s >= 0.3)
+    luminance = np.where(is_red, 0, 255).astype(np.uint8)
+    alpha = pixels[..., 3] if bands == 4 else np.zeros_like(luminance)
+    return Image.fromarray(np.dstack((luminance, alpha)), mode="LA")
 
 
 @dataclass
@@ -169,34 +194,72 @@ def gray_to_black_or_white(
     return WHITE
 
 
-def extract_black_and_gray(src: Image.Image) -> Image.Image:
-    red_img = src.getchannel("R")
-    green_img = src.getchannel("G")
-    blue_img = src.getchannel("B")
-    red_data = red_img.getdata()
-    green_data = green_img.getdata()
-    blue_data = blue_img.getdata()
-    grayscale = Image.new("L", (src.width, src.height), 0)
+@functools.lru_cache(maxsize=16)
+def _tiled_dither_pattern(gray_level: int, width: int, height: int) -> np.ndarray:
+    """
+    The 4x4 pattern of `gray_level`, repeated over a `width` x `height` image.
+    True where `_check_if_dithering_pattern_would_give_black()` is true (which
+    means the pixel ends up white).
+    """
+    pattern = np.array(
+        [
+            [_check_if_dithering_pattern_would_give_black(x=x, y=y, gray_level=gray_level) for x in range(4)]
+            for y in range(4)
+        ]
+    )
+    tiled = np.tile(pattern, ((height + 3) // 4, (width + 3) // 4))[:height, :width]
+    tiled.flags.writeable = False
+    return tiled
 
-    from collections import Counter
 
-    alpha_data = None
+def extract_black_and_gray(src: Image.Image) -> Image.Image:
+    """
+    Return an "L" image of the black and gray pixels of `src`, with grays
+    dithered to black and white. Works on the whole image at once, and gives
+    the same pixels as calling `gray_to_black_or_white()` on each pixel.
+    """
+    pixels = np.asarray(src)
     if src.has_transparency_data:
         print("Image has transparency channel")
-        alpha_data = src.getchannel("A").getdata()
-
-    grayscale_data: List[int] = []
-    for i in range(0, len(red_data)):
-        x = i % src.width
-        y = int(i / src.width)
-        alpha = alpha_data[i] if alpha_data else 100
-        (h, s, v) = rgb_to_hsv((red_data[i], green_data[i], blue_data[i]))
-        bw_value = gray_to_black_or_white(h=h, s=s, v=v, x=x, y=y, alpha=alpha)
-        grayscale_data.append(bw_value)
-    grayscale.putdata(grayscale_data)
-    # alpha_data: List[int] = [0 for i in range(len(grayscale_data))]
-    # grayscale.putalpha(alpha_data)
-    return grayscale
+        alpha = np.asarray(src.getchannel("A"))
+    else:
+        alpha = np.full(pixels.shape[:2], 100, dtype=np.uint8)
+    (_, s, v) = rgb_to_hsv_arrays(pixels[..., :3])
+
+    # Same as `apply_alpha()` (the hue isn't needed)
+    alpha_ratio = alpha.astype(np.float64) / 255.0
+    s = s * alpha_ratio + 0.0 * (1 - alpha_ratio)
+    v = v * alpha_ratio + 1.0 * (1 - alpha_ratio)
+
+    # The bands of `gray_to_black_or_white()`
+    not_black = v > 0.20
+    gray = not_black & (s < 0.30)
+    white = (not_black & ~gray) | (gray & (v > 0.95))
+    gray_bands = (
+        (4, gray & (v > 0.75) & (v <= 0.95)),
+        (8, gray & (v > 0.50) & (v <= 0.75)),
+        (14, gray & (v <= 0.50)),
+    )
+    for gray_level, in_band in gray_bands:
+        white |= in_band & _tiled_dither_pattern(gray_level, width=src.width, height=src.height)
+    return Image.fromarray(np.where(white, WHITE, BLACK).astype(np.uint8), mode="L")
+
+
+def split_joined_into_planes(src: Image.Image) -> Dict[str, Image.Image]:
+    """
+    Split a full-color ("joined") screenshot into the red and black planes.
+
+    This gives the same planes as rendering the page with `show-only-red` and
+    `show-only-black`, without having to screenshot the page once per color.
+    Both planes are "L" images, where 0 is ink and 255 is paper.
+    """
+    # A screenshot is fully opaque. Give it an explicit alpha channel, since
+    # `extract_black_and_gray` treats images without one as partly transparent.
+    if src.mode != "RGBA":
+        src = src.convert("RGBA")
+    red_plane = extract_red(src=src).convert("L")
+    black_plane = extract_black_and_gray(src=src)
+    return {"red": red_plane, "black": black_plane}
 
 
 def image_extract_color_channel(
@@ -212,14 +275,15 @@ def image_extract_color_channel(
         srcpath = Path(img_url.replace("file://", ""))
         x = srcpath.read_bytes()
         filepath.write_bytes(x)
+        _extracted_written(filepath)
         return str(filepath)
 
     if should_download_to_cache(filepath):
         try:
-            url = urllib.parse.urlparse(img_url)
-            src_filename = f"/tmp/src.{Path(url.path).suffix}"
-            urllib.request.urlretrieve(img_url, src_filename)
-            src_image = Image.open(src_filename)
+            # Read it into memory, rather than a shared temporary file that
+            # concurrent renders would overwrite
+            with urllib.request.urlopen(img_url) as response:
+                src_image = Image.open(io.BytesIO(response.read()))
             if crop_area:
                 src_image = src_image.crop(crop_area)
 
@@ -233,6 +297,7 @@ def image_extract_color_channel(
                 black_image = extract_black_and_gray(src=src_image)
                 print(f"Writing black file {str(filepath)}...")
                 black_image.save(str(filepath))
+            _extracted_written(filepath)
         except Exception as ex:
             print(f"Warning: Could not extract color channel from {img_url}")
             print(textwrap.indent(traceback.format_exc(), prefix=INDENT))
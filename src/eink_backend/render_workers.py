@@ -0,0 +1,144 @@
+"""
+A bounded pool of worker threads that the HTTP endpoints hand their renders to.
+
+Rendering calls Firefox, Pillow and SQLite synchronously. Running that inside an
+`async def` endpoint blocks the event loop, so every other request (the chores
+API, `/cache-status`, ...) waits for the render to finish. Instead, endpoints
+`await RenderWorkers.run(...)`, which runs the job on a worker thread.
+
+Threads are used rather than processes, since renders share the browser pool
+and the frame cache, and spend most of their time waiting on Firefox anyway.
+
+- At most `workers` jobs run at once, and at most `max_queued` more wait for a
+  worker. Past that, `run()` raises `RenderQueueFullError` right away, so the
+  endpoint can answer 503 with a `Retry-After` instead of piling up work.
+- A job that takes longer than `job_timeout` raises `RenderTimeoutError` to the
+  caller. A thread can't be killed, so the job keeps its slot until it actually
+  finishes, which keeps the backpressure honest.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict
+
+_logger: logging.Logger = logging.getLogger()
+
+
+class RenderQueueFullError(Exception):
+    """Raised when there are already too many renders running and waiting."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderTimeoutError(Exception):
+    """Raised when a render didn't finish within the job timeout."""
+    pass
+
+
+class RenderWorkers:
+    """
+    Args:
+        workers: How many renders run at once
+        max_queued: How many more renders may wait for a free worker
+        job_timeout: Seconds a caller waits for its render before giving up
+    """
+
+    def __init__(self, workers: int = 1, max_queued: int = 8, job_timeout: float = 90):
+        if workers < 1:
+            raise ValueError("There must be at least 1 render worker")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.job_timeout = job_timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._average_job_seconds = 5.0
+        self._stats = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+
+    def retry_after(self) -> int:
+        """A guess of how many seconds until there is room for another render."""
+        with self._lock:
+            waves = max(1, self._pending - self.max_queued) / self.workers
+            return max(1, math.ceil(waves * self._average_job_seconds))
+
+    def _run_job(self, fn: Callable[..., Any], args: Any, kwargs: Any) -> Any:
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+            succeeded = True
+            return result
+        except BaseException:
+            succeeded = False
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                # Exponential moving average, for the Retry-After estimate
+                self._average_job_seconds = 0.8 * self._average_job_seconds + 0.2 * elapsed
+                self._stats["completed" if succeeded else "failed"] += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on a worker thread and wait for its result,
+        without blocking the event loop.
+
+        Raises:
+            RenderQueueFullError: If all workers are busy and the queue is full
+            RenderTimeoutError: If the job didn't finish within `job_timeout`
+            Exception: Whatever `fn` raised
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queued:
+                self._stats["rejected"] += 1
+                full = True
+            else:
+                self._pending += 1
+                full = False
+        if full:
+            raise RenderQueueFullError(
+                f"Too many renders in progress ({self.workers} running, {self.max_queued} queued)",
+                retry_after=self.retry_after(),
+            )
+
+        try:
+            future = self._executor.submit(self._run_job, fn, args, kwargs)
+        except RuntimeError:
+            # Shut down
+            with self._lock:
+                self._pending -= 1
+            raise
+        # Not in `_run_job()`: a job that's cancelled by `shutdown()` never runs,
+        # but its future is still done
+        future.add_done_callback(self._job_done)
+        try:
+            # shield(), so that timing out doesn't try to cancel the (uncancellable) job
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=self.job_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["timed_out"] += 1
+            _logger.error(f"Render {getattr(fn, '__name__', fn)} did not finish within {self.job_timeout} seconds")
+            raise RenderTimeoutError(f"Render did not finish within {self.job_timeout} seconds")
+
+    def _job_done(self, future: "concurrent.futures.Future[Any]") -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "pending": self._pending,
+                "average_job_seconds": round(self._average_job_seconds, 3),
+                **self._stats,
+            }
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs. Jobs already running are left to finish, the queued ones are cancelled."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
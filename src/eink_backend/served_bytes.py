@@ -0,0 +1,194 @@
+"""
+The bytes of the files the HTTP endpoints serve, kept in memory.
+
+The displays and the layouts' pages ask for the same few files over and over:
+the current frame, the CSS and the extracted icons. `ServedBytes` keeps their
+bytes, with their `ETag`, so a response goes out straight from memory, without
+opening the file.
+
+Text files (CSS, SVG, JSON) also get their gzip variant, and their brotli one
+when the `brotli` package is installed, compressed once when the file is loaded.
+
+An entry is dropped when its file is written:
+
+- immutable files (the hash-named frame artifacts) are never checked again
+- the processes that write a file call `invalidate()` (see `render.on_extracted_write`)
+- other files are checked with a `stat()` at most every `revalidate_after`
+  seconds, to catch edits from outside the process (e.g. a deployment of the
+  assets)
+
+The cache is bounded by the total size of the bodies, least recently used out.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_logger: logging.Logger = logging.getLogger()
+
+_COMPRESSIBLE_TYPES = ("text/", "image/svg+xml", "application/json", "application/javascript")
+
+# Don't bother compressing smaller files
+_MIN_COMPRESS_SIZE = 256
+
+
+@dataclass(frozen=True)
+class ServedFile:
+    body: bytes
+    media_type: str
+    content_hash: str
+    """The hash of `body`, as in `conditional.Validators.from_hash()`"""
+    mtime: float
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+    """Compressed variants of `body`, by `Content-Encoding`"""
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], bytes]:
+        """
+        The body to send for a request's `Accept-Encoding`: brotli if it accepts it,
+        then gzip, then the file as it is.
+
+        Returns:
+            The `Content-Encoding` (None for the file as it is), and the body
+        """
+        if accept_encoding and self.encoded:
+            accepted = set()
+            for part in accept_encoding.split(","):
+                (encoding, _, params) = part.partition(";")
+                try:
+                    quality = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+                except ValueError:
+                    quality = 1.0
+                if quality > 0:
+                    accepted.add(encoding.strip().lower())
+            for encoding in ("br", "gzip"):
+                if encoding in self.encoded and encoding in accepted:
+                    return (encoding, self.encoded[encoding])
+        return (None, self.body)
+
+
+def _compress(body: bytes) -> Dict[str, bytes]:
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body)
+    # Only keep the variants that are worth it
+    return {encoding: data for encoding, data in encoded.items() if len(data) < len(body)}
+
+
+class ServedBytes:
+    """
+    Args:
+        max_bytes: The most bytes of bodies (and their compressed variants) to keep
+        revalidate_after: Seconds before a file that isn't immutable is checked for changes again
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, revalidate_after: float = 2.0):
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        # path -> (file, (size, mtime), when it was last checked)
+        self._entries: "OrderedDict[str, Tuple[ServedFile, Tuple[int, int], float]]" = OrderedDict()
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "revalidations": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, path: Path, immutable: bool = False) -> ServedFile:
+        """
+        The file at `path`, from memory if it's there.
+
+        Args:
+            immutable: The file is never written again, so it's never checked for changes
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+        """
+        key = str(path)
+        now = time.monotonic()
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None and (immutable or now - found[2] < self.revalidate_after):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return found[0]
+
+        if found is not None:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                self.invalidate(path)
+                raise
+            if (stat.st_size, stat.st_mtime_ns) == found[1]:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries[key] = (found[0], found[1], now)
+                        self._entries.move_to_end(key)
+                    self._stats["revalidations"] += 1
+                    self._stats["hits"] += 1
+                return found[0]
+
+        served, version = self._load(path)
+        with self._lock:
+            self._stats["misses"] += 1
+            self._remove(key)
+            if served.size <= self.max_bytes // 4:
+                self._entries[key] = (served, version, now)
+                self._size += served.size
+                while self._size > self.max_bytes:
+                    (_, (evicted, _, _)) = self._entries.popitem(last=False)
+                    self._size -= evicted.size
+                    self._stats["evictions"] += 1
+        return served
+
+    def _load(self, path: Path) -> Tuple[ServedFile, Tuple[int, int]]:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            body = file.read()
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        compressible = media_type.startswith(_COMPRESSIBLE_TYPES) and len(body) >= _MIN_COMPRESS_SIZE
+        served = ServedFile(
+            body=body,
+            media_type=media_type,
+            content_hash=hashlib.sha256(body).hexdigest()[:32],
+            mtime=stat.st_mtime,
+            encoded=_compress(body) if compressible else {},
+        )
+        _logger.debug(f"Loaded {path} to serve from memory ({len(body)} bytes, {', '.join(served.encoded) or 'not compressed'})")
+        return (served, (stat.st_size, stat.st_mtime_ns))
+
+    def _remove(self, key: str) -> None:
+        """Call with the lock held."""
+        found = self._entries.pop(key, None)
+        if found is not None:
+            self._size -= found[0].size
+
+    def invalidate(self, path: Path) -> None:
+        """Drop the file at `path`, which was just written."""
+        with self._lock:
+            if str(path) in self._entries:
+                self._remove(str(path))
+                self._stats["invalidations"] += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "brotli": brotli is not None,
+                **self._stats,
+            }
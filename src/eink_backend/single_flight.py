@@ -0,0 +1,79 @@
+"""
+Coalesce identical calls that are in flight at the same time.
+
+If two requests ask for the same render, or the same live fetch from an upstream
+service, while the first one is still running, the second one just waits for the
+first one's result (or exception) instead of doing the work again.
+
+Only calls that overlap are coalesced; nothing is cached once a call finishes.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+_logger: logging.Logger = logging.getLogger()
+
+
+class SingleFlight:
+    """A group of calls, keyed by what they compute. Safe to use from threads and from the event loop."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, concurrent.futures.Future] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    def _join(self, key: Hashable) -> Tuple[concurrent.futures.Future, bool]:
+        """Returns the future of the call for `key`, and whether the caller has to run it."""
+        with self._lock:
+            self._stats["calls"] += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                _logger.debug(f"{self.name}: joining the call in flight for {key}")
+                return (future, False)
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            return (future, True)
+
+    def _finish(self, key: Hashable) -> None:
+        with self._lock:
+            del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Return `fn()`, or the result of the call for `key` that is already running."""
+        (future, leader) = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as ex:
+            self._finish(key)
+            future.set_exception(ex)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Like `do()`, for coroutines. Waiting doesn't block the event loop."""
+        (future, leader) = self._join(key)
+        if not leader:
+            # shield(), so a waiter that gives up doesn't cancel the call for everyone
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            result = await fn()
+        except BaseException as ex:
+            self._finish(key)
+            future.set_exception(ex)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._calls), **self._stats}
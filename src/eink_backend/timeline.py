@@ -0,0 +1,119 @@
+"""
+A timeline of the frames over a range of time, to check the layout transitions
+(Shabbat, the omer count, the weather rollover, ...) without waiting for them.
+
+The range is sampled every `step`. Samples whose frames have the same content
+hash are the same frame, so the timeline is the list of distinct frames, each
+with the spans of time it's shown for, and `contact_sheet()` lays them out side
+by side in one image.
+
+The rendering itself is in `main.py` (`/timeline`): it works out the frame
+cache key of every sample first, and only renders the distinct ones, in parallel
+on the render workers.
+"""
+
+import datetime
+import io
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+_logger: logging.Logger = logging.getLogger()
+
+_LABEL_HEIGHT = 28
+_MARGIN = 8
+
+
+@dataclass
+class TimelineFrame:
+    content_hash: Optional[str]
+    """None for the samples that couldn't be rendered"""
+    spans: List[Tuple[datetime.datetime, datetime.datetime]] = field(default_factory=list)
+    """The [from, until) spans of time in which this is the frame"""
+
+    def label(self, tz: Optional[datetime.tzinfo] = None, time_format: str = "%a %d/%m %H:%M") -> str:
+        """The first span, in `tz`, and how many more spans there are."""
+        (start, until) = (at.astimezone(tz) for at in self.spans[0])
+        more = f" (+{len(self.spans) - 1})" if len(self.spans) > 1 else ""
+        return f"{start.strftime(time_format)} - {until.strftime(time_format)}{more}"
+
+
+def sample_times(
+    start: datetime.datetime, end: datetime.datetime, step: datetime.timedelta, max_samples: int
+) -> List[datetime.datetime]:
+    """
+    The times from `start` up to (not including) `end`, every `step`.
+
+    Raises:
+        ValueError: If the range is empty, the step isn't positive, or there would
+            be more than `max_samples` samples
+    """
+    if step <= datetime.timedelta(0):
+        raise ValueError("The step must be positive")
+    if end <= start:
+        raise ValueError("The end must be after the start")
+    count = -(-(end - start) // step)
+    if count > max_samples:
+        raise ValueError(f"{count} samples is too many; use a step of at least {(end - start) / max_samples}")
+    return [start + step * index for index in range(count)]
+
+
+def collapse(
+    times: Sequence[datetime.datetime], hashes: Sequence[Optional[str]], end: datetime.datetime
+) -> List[TimelineFrame]:
+    """
+    The distinct frames of the samples, in the order they first show up. Each
+    sample's frame is shown until the next sample, and consecutive samples of the
+    same frame make up a single span. The samples whose hash is None (they
+    couldn't be rendered) make up a frame of their own.
+    """
+    frames = {}
+    previous = None
+    for (index, (at, content_hash)) in enumerate(zip(times, hashes)):
+        until = times[index + 1] if index + 1 < len(times) else end
+        frame = frames.setdefault(content_hash, TimelineFrame(content_hash=content_hash))
+        if content_hash == previous:
+            frame.spans[-1] = (frame.spans[-1][0], until)
+        else:
+            frame.spans.append((at, until))
+        previous = content_hash
+    return list(frames.values())
+
+
+def contact_sheet(frames: Sequence[Tuple[str, bytes]], columns: int = 4, thumbnail_width: int = 264) -> bytes:
+    """
+    Lay out PNG frames in a grid, each with its label under it.
+
+    Args:
+        frames: The label and the PNG of each frame
+        columns: Frames per row
+        thumbnail_width: The width each frame is scaled to
+
+    Returns:
+        The PNG of the sheet
+    """
+    thumbnails = []
+    for (label, png) in frames:
+        image = Image.open(io.BytesIO(png)).convert("RGB")
+        height = round(image.height * thumbnail_width / image.width)
+        thumbnails.append((label, image.resize((thumbnail_width, height), Image.LANCZOS)))
+    columns = max(1, min(columns, len(thumbnails)))
+    rows = -(-len(thumbnails) // columns)
+    cell_height = max((image.height for (_, image) in thumbnails), default=0) + _LABEL_HEIGHT
+    sheet = Image.new(
+        "RGB",
+        (columns * (thumbnail_width + _MARGIN) + _MARGIN, rows * (cell_height + _MARGIN) + _MARGIN),
+        "lightgray",
+    )
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    for (index, (label, image)) in enumerate(thumbnails):
+        x = _MARGIN + (index % columns) * (thumbnail_width + _MARGIN)
+        y = _MARGIN + (index // columns) * (cell_height + _MARGIN)
+        sheet.paste(image, (x, y))
+        draw.text((x, y + image.height + 6), label, fill="black", font=font)
+    buffer = io.BytesIO()
+    sheet.save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Tests for the hash-named frame artifacts and their manifest."""
+
+import datetime
+import json
+import os
+
+import pytest
+
+from eink_backend.artifacts import ArtifactStore
+
+
+def _render(path, content):
+    # Like the renders: write a new file, then rename it into place
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def test_publish_is_immutable_and_deduplicated(tmp_path):
+    store = ArtifactStore(root=tmp_path / "frames")
+    frame = tmp_path / "black.png"
+    _render(frame, b"frame 1")
+    (first_hash, first) = store.publish("default", "black", frame)
+    assert first.read_bytes() == b"frame 1"
+    assert store.current("default", "black") == first_hash
+    assert store.publish("default", "black", frame) == (first_hash, first)
+
+    _render(frame, b"frame 2")
+    (second_hash, second) = store.publish("default", "black", frame)
+    assert second_hash != first_hash
+    assert first.read_bytes() == b"frame 1"
+    assert second.read_bytes() == b"frame 2"
+
+    # The same pixels again get the same artifact
+    _render(frame, b"frame 1")
+    assert store.publish("default", "black", frame)[0] == first_hash
+    assert store.status()["artifacts"] == 2
+    assert store.status()["published"] == 3
+    assert store.status()["unchanged"] == 1
+
+    manifest = json.loads((tmp_path / "frames" / "manifest.json").read_text())
+    assert manifest["profiles"]["default"]["black"]["hash"] == first_hash
+    assert ArtifactStore(root=tmp_path / "frames").current("default", "black") == first_hash
+
+    with pytest.raises(ValueError):
+        store.path("../black")
+    with pytest.raises(FileNotFoundError):
+        store.publish("default", "red", tmp_path / "red.png")
+
+
+def test_prune_keeps_current_and_newest(tmp_path):
+    store = ArtifactStore(root=tmp_path / "frames", keep_count=2, max_age=datetime.timedelta(hours=1))
+    frame = tmp_path / "black.png"
+    now = datetime.datetime(2026, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    hashes = []
+    for index in range(5):
+        _render(frame, f"frame {index}".encode())
+        (content_hash, artifact) = store.publish("default", "black", frame)
+        # One artifact an hour, the last one a minute ago
+        rendered_at = (now - datetime.timedelta(hours=4 - index, minutes=1)).timestamp()
+        os.utime(artifact, (rendered_at, rendered_at))
+        hashes.append(content_hash)
+    # An old frame that's current for another profile
+    os.utime(store.path(hashes[0]), (now.timestamp() - 86400, now.timestamp() - 86400))
+    _render(tmp_path / "joined.png", b"frame 0")
+    store.publish("default", "joined", tmp_path / "joined.png")
+
+    assert store.prune(now_utc=now) == 2
+    remaining = {path.stem for path in (tmp_path / "frames" / "by-hash").glob("*.png")}
+    assert remaining == {hashes[0], hashes[3], hashes[4]}
+
+
+def test_prune_keeps_stored_artifacts_for_a_while(tmp_path):
+    store = ArtifactStore(root=tmp_path / "frames", keep_count=0, max_age=datetime.timedelta(hours=1))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    old = (now - datetime.timedelta(days=3)).timestamp()
+    kept = store.store(b"timeline frame", keep_for=datetime.timedelta(minutes=30))
+    os.utime(store.path(kept), (old, old))
+    unkept = store.store(b"another frame")
+    os.utime(store.path(unkept), (old, old))
+
+    assert store.prune(now_utc=now) == 1
+    assert store.path(kept).exists()
+    assert not store.path(unkept).exists()
+    # Storing it again keeps it longer, and once it's no longer kept, it's pruned by age
+    assert store.store(b"timeline frame", keep_for=datetime.timedelta(hours=1)) == kept
+    assert store.prune(now_utc=now + datetime.timedelta(minutes=45)) == 0
+    assert store.prune(now_utc=now + datetime.timedelta(hours=2)) == 1
+    assert store.status()["kept"] == 0
+
+
+def test_storing_a_published_frame_leaves_its_file_alone(tmp_path):
+    store = ArtifactStore(root=tmp_path / "frames")
+    frame = tmp_path / "black.png"
+    _render(frame, b"frame")
+    before = frame.stat()
+    (content_hash, _) = store.publish("default", "black", frame)
+    assert store.store(b"frame", keep_for=datetime.timedelta(hours=1)) == content_hash
+    assert frame.stat().st_mtime_ns == before.st_mtime_ns
+
+
+def test_failed_publish_leaves_no_temporary_file(tmp_path, monkeypatch):
+    store = ArtifactStore(root=tmp_path / "frames")
+    frame = tmp_path / "black.png"
+    _render(frame, b"frame")
+
+    def unreadable(self):
+        raise OSError("I/O error")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(type(frame), "read_bytes", unreadable)
+        with pytest.raises(OSError):
+            store.publish("default", "black", frame)
+    assert list((tmp_path / "frames" / "by-hash").iterdir()) == []
+
+    # Nor does one that was cut short, once the store is opened again
+    (tmp_path / "frames" / "by-hash" / ".abc.tmp").write_bytes(b"fra")
+    store = ArtifactStore(root=tmp_path / "frames")
+    assert list((tmp_path / "frames" / "by-hash").iterdir()) == []
+    assert store.publish("default", "black", frame)[1].read_bytes() == b"frame"
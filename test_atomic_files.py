@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Tests for writing files that are read while they're replaced."""
+
+import threading
+from pathlib import Path
+
+from eink_backend.atomic_files import write_atomically
+from eink_backend.frame_cache import FrameCache
+
+
+def _write_concurrently(write, contents):
+    """Call `write(data)` for each of `contents`, many times, from a thread each."""
+    errors = []
+    barrier = threading.Barrier(len(contents))
+
+    def writer(data):
+        barrier.wait()
+        try:
+            for _ in range(200):
+                write(data)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=writer, args=(data,)) for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_concurrent_writes_of_the_same_file(tmp_path: Path):
+    path = tmp_path / "black.png"
+    contents = [b"a" * 300_000, b"b" * 200_000]
+    seen = set()
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            if path.exists():
+                seen.add(path.read_bytes())
+
+    reading = threading.Thread(target=reader)
+    reading.start()
+    try:
+        errors = _write_concurrently(lambda data: write_atomically(path, data), contents)
+    finally:
+        stop.set()
+        reading.join()
+
+    assert errors == []
+    assert path.read_bytes() in contents
+    # Readers only ever saw whole files
+    assert seen <= set(contents)
+    assert [child.name for child in tmp_path.iterdir()] == ["black.png"]
+
+
+def test_concurrent_puts_of_the_same_frame(tmp_path: Path):
+    cache = FrameCache(cache_dir=tmp_path)
+    contents = [b"frame 1" * 10_000, b"frame 2" * 5_000]
+    assert _write_concurrently(lambda data: cache.put("abc", data), contents) == []
+    assert cache.get("abc") in contents
+    assert [child.name for child in tmp_path.iterdir()] == ["abc.png"]
+
+
+def test_leftover_temporary_files_are_removed(tmp_path: Path):
+    (tmp_path / ".abc.png.x1y2.tmp").write_bytes(b"half a fr")
+    FrameCache(cache_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Tests for the packed 1-bit plane output format."""
+
+import os
+
+from PIL import Image
+
+from eink_backend.bitplanes import BitplaneCache, pack_plane, packbits_decode, packbits_encode
+
+WIDTH = 528
+HEIGHT = 880
+
+
+def test_plane_size_and_polarity():
+    image = Image.new("L", (WIDTH, HEIGHT), 255)
+    # The first 8 pixels of the top row are ink, alternating
+    for x in range(0, 8, 2):
+        image.putpixel((x, 0), 0)
+    data = pack_plane(image)
+    assert len(data) == WIDTH // 8 * HEIGHT == 58080
+    # MSB first, 0 is ink
+    assert data[0] == 0b01010101
+    assert data[1:] == b"\xff" * (len(data) - 1)
+
+
+def test_packbits_roundtrip():
+    samples = [
+        b"",
+        b"\x00",
+        b"\xff" * 1000,
+        bytes(range(256)) * 3,
+        b"\x01\x02\x02\x03\x03\x03\x04\x04\x04\x04" * 50,
+        os.urandom(4096),
+    ]
+    for data in samples:
+        assert packbits_decode(packbits_encode(data)) == data
+    # A blank plane shrinks to almost nothing
+    assert len(packbits_encode(b"\xff" * 58080)) < 1000
+
+
+def test_cache_repacks_when_the_frame_changes(tmp_path):
+    png = tmp_path / "black.png"
+    Image.new("1", (WIDTH, HEIGHT), 1).save(png)
+    cache = BitplaneCache()
+    # Only looks it up
+    assert cache.cached(png) is None
+    assert cache.status()["misses"] == 0
+    blank = cache.plane(png)
+    assert cache.cached(png) == blank
+    assert cache.status()["hits"] == 1
+    assert cache.plane(png) == blank
+    assert packbits_decode(cache.plane(png, rle=True)) == blank
+    assert cache.status()["hits"] == 3
+
+    Image.new("1", (WIDTH, HEIGHT), 0).save(png)
+    os.utime(png, ns=(0, 1))
+    assert cache.plane(png) == b"\x00" * 58080
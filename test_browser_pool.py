@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Tests for the pool of headless browsers, against a fake Firefox that speaks Marionette."""
+
+import sys
+import threading
+import time
+
+import pytest
+
+from eink_backend.browser_pool import BrowserPool, BrowserPoolError
+
+# Started by the pool instead of Firefox: it writes the port it listens on to
+# the profile's MarionetteActivePort, like Firefox does, and answers commands.
+# A screenshot is the URL of the page it navigated to.
+FAKE_FIREFOX = '''
+import base64
+import json
+import socket
+import sys
+from pathlib import Path
+
+profile = Path(sys.argv[sys.argv.index("--profile") + 1])
+server = socket.socket()
+server.bind(("127.0.0.1", 0))
+server.listen(1)
+(profile / "MarionetteActivePort").write_text(str(server.getsockname()[1]))
+(conn, _) = server.accept()
+reader = conn.makefile("rb")
+
+
+def send(message):
+    data = json.dumps(message).encode("utf-8")
+    frame = str(len(data)).encode("ascii") + b":" + data
+    # In two parts, the way TCP may deliver it
+    conn.sendall(frame[:3])
+    conn.sendall(frame[3:])
+
+
+def receive():
+    digits = b""
+    while (c := reader.read(1)) != b":":
+        if not c:
+            sys.exit(0)
+        digits += c
+    return json.loads(reader.read(int(digits)).decode("utf-8"))
+
+
+send({"applicationType": "gecko", "marionetteProtocol": 3})
+url = ""
+while True:
+    (_, message_id, name, params) = receive()
+    (error, result) = (None, {})
+    if name == "WebDriver:Navigate":
+        url = params["url"]
+        # Not the response to this command, which the client must skip
+        send([1, message_id + 1000, None, {}])
+    elif name == "WebDriver:TakeScreenshot":
+        result = {"value": base64.b64encode(url.encode("utf-8")).decode("ascii")}
+    elif name == "WebDriver:GetWindowHandle" and (profile / "unhealthy").exists():
+        error = {"error": "unknown error", "message": "not answering"}
+    send([1, message_id, error, result])
+    if name == "Marionette:Quit":
+        sys.exit(0)
+'''
+
+
+@pytest.fixture
+def fake_firefox(tmp_path):
+    path = tmp_path / "firefox"
+    path.write_text(f"#!{sys.executable}\n{FAKE_FIREFOX}")
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def make_pool(fake_firefox):
+    pools = []
+
+    def make_pool(**kwargs):
+        pool = BrowserPool(firefox_binary=fake_firefox, startup_timeout=10, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make_pool
+    for pool in pools:
+        pool.shutdown()
+
+
+def test_framing_and_recycling(make_pool):
+    pool = make_pool(size=1, max_renders_per_browser=2)
+    # Non-ASCII, so the frame length is in bytes, not characters
+    urls = [f"file:///tmp/שבת-{index}.html" for index in range(3)]
+    assert [pool.screenshot(url) for url in urls] == [url.encode("utf-8") for url in urls]
+    status = pool.status()
+    assert (status["renders"], status["launched"], status["recycled"]) == (3, 2, 1)
+    assert (status["alive"], status["idle"]) == (1, 1)
+
+
+def test_health_check_discards_unhealthy_browsers(make_pool):
+    pool = make_pool(size=2)
+    pool.warm_up()
+    first = pool._idle.get_nowait()
+    (first.profile_dir / "unhealthy").touch()
+    pool._idle.put(first)
+
+    pool.health_check()
+    status = pool.status()
+    assert (status["discarded"], status["alive"], status["idle"]) == (1, 1, 1)
+    assert not first.is_alive()
+    assert pool.screenshot("file:///tmp/page.html") == b"file:///tmp/page.html"
+
+
+def test_size_bound(make_pool):
+    pool = make_pool(size=1, render_timeout=0.5)
+    busy = pool._acquire()
+    with pytest.raises(BrowserPoolError, match="No browser became available"):
+        pool.screenshot("file:///tmp/page.html")
+    assert pool.status()["launched"] == 1
+
+    pool._release(busy)
+    assert pool.screenshot("file:///tmp/page.html") == b"file:///tmp/page.html"
+    assert pool.status()["launched"] == 1
+
+
+def test_a_closed_browser_makes_room_for_a_waiter(make_pool):
+    pool = make_pool(size=1, render_timeout=30)
+    busy = pool._acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(pool.screenshot("file:///tmp/page.html")))
+    started = time.monotonic()
+    waiter.start()
+    time.sleep(0.2)
+    assert results == []
+
+    # Like a failed screenshot: discarded, not put back
+    pool._close_browser(busy)
+    waiter.join(timeout=15)
+    assert results == [b"file:///tmp/page.html"]
+    assert time.monotonic() - started < pool.render_timeout / 2
+    assert pool.status()["launched"] == 2
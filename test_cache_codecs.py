@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Tests for how each data type is stored in the data cache."""
+
+import datetime
+import json
+import pickle
+
+import pytest
+
+from eink_backend import data_cache
+from eink_backend.cache_codecs import CODECS
+from eink_backend.chores import Chore, ChoreData
+from eink_backend.efrat_zmanim import ShabbatZmanim
+from eink_backend.seating import Seat, SeatingData
+from eink_backend.weather import WeatherDaily, WeatherForecast, WeatherHourly
+
+TZ = datetime.timezone(datetime.timedelta(hours=2))
+NOW = datetime.datetime(2026, 3, 6, 12, tzinfo=TZ)
+
+
+def _hourly(hours: int) -> WeatherHourly:
+    return WeatherHourly(
+        timestamp=NOW + datetime.timedelta(hours=hours),
+        temperature_2m=14.5,
+        apparent_temperature=13.0,
+        rain_mm=0.0,
+        wind_speed_10m=12.3,
+        wind_direction_10m=270,
+        uv_index=3.5,
+        weather_code="02d",
+    )
+
+
+@pytest.fixture(autouse=True)
+def codecs(monkeypatch):
+    monkeypatch.setattr(data_cache, "_codecs", dict(CODECS))
+
+
+@pytest.mark.parametrize("data_type,data", [
+    ("weather", WeatherForecast(
+        current=_hourly(0),
+        hourlies=[_hourly(hours) for hours in range(48)],
+        tomorrow=WeatherDaily(timestamp=NOW, apparent_temperature_min=8.0, apparent_temperature_max=17.5, weather_code="10d"),
+    )),
+    ("chores", ChoreData(chores=[
+        Chore(due=datetime.date(2026, 3, 6), name="Dishes", assignee="Dana", assignee_avatar="dana.png", assignee_ordinal=1, frequency_in_weeks=1),
+        Chore(due=datetime.date(2026, 3, 9), name="Laundry", assignee="", assignee_avatar="", assignee_ordinal=99, frequency_in_weeks=2),
+    ])),
+    ("chores", ChoreData(chores=[], error="Can't connect")),
+    ("seating", SeatingData(seats=[Seat(name="Dana", rotate=True, number=1), Seat(name="Noa", rotate=False, number=2)])),
+    ("zmanim", ShabbatZmanim(name="Vayakhel", times={"candle_lighting": NOW, "parasha": "ויקהל"})),
+    ("calendar", "<table><tr><td>Dentist</td></tr></table>"),
+])
+def test_round_trip(data_type, data):
+    (blob, version) = data_cache.encode(data_type, data)
+    assert version == CODECS[data_type].version
+    json.loads(blob)
+    assert data_cache.decode(data_type, blob, version) == data
+
+
+def test_weather_hourlies_are_columns():
+    forecast = WeatherForecast(
+        current=_hourly(0),
+        hourlies=[_hourly(hours) for hours in range(48)],
+        tomorrow=WeatherDaily(timestamp=NOW, apparent_temperature_min=8.0, apparent_temperature_max=17.5, weather_code="10d"),
+    )
+    (blob, _) = data_cache.encode("weather", forecast)
+    hourlies = json.loads(blob)["hourlies"]
+    assert hourlies["weather_code"] == ["02d"] * 48
+    assert len(blob) < len(pickle.dumps(forecast))
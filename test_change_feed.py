@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Tests for pushing frame and data changes to the waiting displays."""
+
+import asyncio
+import threading
+
+from eink_backend.change_feed import ChangeFeed
+
+
+def test_waiters_wake_up_on_a_change_from_another_thread():
+    feed = ChangeFeed()
+
+    async def scenario():
+        feed.attach(asyncio.get_running_loop())
+        waiters = [asyncio.ensure_future(feed.wait(since=0, timeout=5)) for _ in range(50)]
+        await asyncio.sleep(0.01)
+        assert feed.status()["listeners"] == 50
+        publisher = threading.Thread(target=feed.publish_frame, args=("abc", {"black": '"1"', "red": '"2"'}))
+        publisher.start()
+        results = await asyncio.gather(*waiters)
+        publisher.join()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(r["sequence"] == 1 and r["frame_hash"] == "abc" and r["changed"] == ["frame"] for r in results)
+    assert feed.status()["listeners"] == 0
+
+
+def test_same_frame_is_not_a_change():
+    feed = ChangeFeed()
+    assert feed.publish_frame("abc", {})
+    assert not feed.publish_frame("abc", {})
+    feed.publish_data([])
+    assert feed.snapshot()["sequence"] == 1
+    feed.publish_data(["weather"])
+    assert feed.snapshot()["sequence"] == 2
+    assert feed.snapshot()["changed"] == ["weather"]
+    assert feed.snapshot()["frame_hash"] == "abc"
+
+
+def test_wait_returns_missed_changes_and_times_out():
+    feed = ChangeFeed()
+
+    async def scenario():
+        feed.attach(asyncio.get_running_loop())
+        feed.publish_data(["calendar"])
+        missed = await feed.wait(since=0, timeout=1)
+        nothing = await feed.wait(since=1, timeout=0.05)
+        return (missed, nothing)
+
+    (missed, nothing) = asyncio.run(scenario())
+    assert missed["changed"] == ["calendar"]
+    assert nothing is None
+
+
+def test_a_sequence_from_before_a_restart_is_answered_right_away():
+    before_restart = ChangeFeed()
+    for _ in range(57):
+        before_restart.publish_data(["weather"])
+    last_seen = before_restart.snapshot()["sequence"]
+    feed = ChangeFeed()
+
+    async def scenario():
+        feed.attach(asyncio.get_running_loop())
+        feed.publish_data(["calendar"])
+        return await asyncio.wait_for(feed.wait(since=last_seen, timeout=5), timeout=1)
+
+    snapshot = asyncio.run(scenario())
+    assert (snapshot["sequence"], snapshot["changed"]) == (1, ["calendar"])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Tests for the ETag / Last-Modified validators of the rendered frames."""
+
+import email.utils
+import os
+
+from eink_backend.conditional import ContentTags, etag_matches, is_not_modified
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_same_content_keeps_its_etag(tmp_path):
+    frame = tmp_path / "black.png"
+    frame.write_bytes(b"frame 1")
+    tags = ContentTags()
+    first = tags.validators(frame)
+    assert tags.validators(frame) == first
+    assert tags.status() == {"entries": 1, "hits": 1, "misses": 1}
+
+    # Rendered again, with the same pixels
+    frame.write_bytes(b"frame 1")
+    os.utime(frame, (first.mtime + 60, first.mtime + 60))
+    again = tags.validators(frame)
+    assert again.etag == first.etag
+    assert again.last_modified != first.last_modified
+
+    frame.write_bytes(b"frame 2")
+    os.utime(frame, (first.mtime + 120, first.mtime + 120))
+    assert tags.validators(frame).etag != first.etag
+
+
+def test_is_not_modified(tmp_path):
+    frame = tmp_path / "black.png"
+    frame.write_bytes(b"frame")
+    validators = ContentTags().validators(frame)
+    assert is_not_modified(validators, if_none_match=validators.etag, if_modified_since=None)
+    assert not is_not_modified(validators, if_none_match='"other"', if_modified_since=validators.last_modified)
+    assert is_not_modified(validators, if_none_match=None, if_modified_since=validators.last_modified)
+    earlier = email.utils.formatdate(validators.mtime - 10, usegmt=True)
+    assert not is_not_modified(validators, if_none_match=None, if_modified_since=earlier)
+    assert not is_not_modified(validators, if_none_match=None, if_modified_since="yesterday")
+    assert validators.derive("bits").etag != validators.etag
+
+
+def test_replaced_while_hashed(tmp_path, monkeypatch):
+    frame = tmp_path / "black.png"
+    frame.write_bytes(b"frame 1")
+    os.utime(frame, (1_000_000, 1_000_000))
+    stat = type(frame).stat
+
+    def stat_then_render(path, **kwargs):
+        # A render replaces the file right after it's stat()ed
+        result = stat(path, **kwargs)
+        new = tmp_path / "new.png"
+        new.write_bytes(b"frame 2, longer")
+        os.replace(new, frame)
+        return result
+
+    monkeypatch.setattr(type(frame), "stat", stat_then_render)
+    tags = ContentTags()
+    raced = tags.validators(frame)
+    monkeypatch.undo()
+
+    # The hash and the modification time are of the same version of the file
+    assert raced == tags.validators(frame)
+    assert raced.mtime == frame.stat().st_mtime
+    assert tags.status()["hits"] == 1
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Tests for the SQLite data cache."""
+
+import datetime
+import logging
+import pickle
+import threading
+
+import pytest
+
+from eink_backend import data_cache
+
+NOW = datetime.datetime(2026, 3, 6, 12, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def cache_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, "DB_PATH", tmp_path / "data_cache.sqlite")
+    data_cache.invalidate_memory()
+    data_cache.init_db(logging.getLogger())
+    yield
+    data_cache.close_connections()
+    data_cache.invalidate_memory()
+
+
+def test_round_trip_and_expiration():
+    assert data_cache.get_cached_data("weather", now_utc=NOW) is None
+    data_cache.save_cached_data("weather", {"temperature": 21}, now_utc=NOW)
+    assert data_cache.get_cached_data("weather", now_utc=NOW) == ({"temperature": 21}, NOW)
+    assert not data_cache.is_data_expired("weather", now_utc=NOW)
+    expiration = NOW + datetime.timedelta(hours=data_cache.EXPIRATION_HOURS["weather"])
+    assert data_cache.get_cached_data("weather", now_utc=expiration - datetime.timedelta(seconds=1)) is not None
+    assert data_cache.get_cached_data("weather", now_utc=expiration) is None
+    assert data_cache.is_data_expired("weather", now_utc=expiration)
+    assert data_cache.get_expirations() == {"weather": expiration}
+
+    # The same, from SQLite
+    data_cache.invalidate_memory()
+    assert data_cache.get_cached_data("weather", now_utc=expiration) is None
+    assert data_cache.get_cached_data("weather", now_utc=NOW) == ({"temperature": 21}, NOW)
+
+
+def test_memory_tier():
+    data_cache.save_cached_data("seating", ["a", "b"], now_utc=NOW)
+    first = data_cache.get_cached_data("seating", now_utc=NOW)[0]
+
+    # Warm reads don't touch SQLite, or decode
+    def no_decode(*_):
+        raise AssertionError("decoded")
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(data_cache, "decode", no_decode)
+        patch.setattr(data_cache, "_connection", lambda: None)
+        assert data_cache.get_cached_data("seating", now_utc=NOW)[0] is first
+
+    # A save goes through to memory
+    later = NOW + datetime.timedelta(minutes=15)
+    data_cache.save_cached_data("seating", ["b", "a"], now_utc=later)
+    assert data_cache.get_cached_data("seating", now_utc=later) == (["b", "a"], later)
+
+    data_cache.invalidate_memory("seating")
+    assert data_cache.get_cached_data("seating", now_utc=later) == (["b", "a"], later)
+    assert data_cache.status()["memory_tier"]["data_types"] == ["seating"]
+
+
+def test_one_wal_connection_per_thread():
+    assert data_cache.status()["journal_mode"] == "wal"
+    connection = data_cache._connection()
+    assert data_cache._connection() is connection
+
+    others = []
+    errors = []
+
+    def use_cache(index):
+        try:
+            data_cache.save_cached_data("chores", [index], now_utc=NOW)
+            data_cache.get_cached_data("chores", now_utc=NOW)
+            others.append(data_cache._connection())
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=use_cache, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len({id(other) for other in others} | {id(connection)}) == 5
+
+    data_cache.close_connections()
+    assert data_cache._connection() is not connection
+    assert data_cache.get_cached_data("chores", now_utc=NOW)[0] in ([0], [1], [2], [3])
+
+
+def test_schema_versions(monkeypatch):
+    monkeypatch.setitem(data_cache._codecs, "seating", data_cache.Codec(version=1, encode=list, decode=tuple))
+    data_cache.save_cached_data("seating", ["a", "b"], now_utc=NOW)
+    assert data_cache.status()["codecs"]["seating"]["bytes"] == len(b'["a","b"]')
+
+    # Version 2 stores the seats reversed: version 1 rows are migrated, and written again
+    monkeypatch.setitem(data_cache._codecs, "seating", data_cache.Codec(
+        version=2,
+        encode=lambda seats: list(reversed(seats)),
+        decode=lambda encoded: tuple(reversed(encoded)),
+        migrations={1: lambda encoded: list(reversed(encoded))},
+    ))
+    data_cache.invalidate_memory()
+    assert data_cache.get_cached_data("seating", now_utc=NOW) == (("a", "b"), NOW)
+    (blob, version) = data_cache._connection().execute("SELECT data, schema_version FROM data_cache").fetchone()
+    assert (blob, version) == (b'["b","a"]', 2)
+
+    # With no migration from version 2, the row is discarded
+    monkeypatch.setitem(data_cache._codecs, "seating", data_cache.Codec(version=3, encode=list, decode=tuple))
+    data_cache.invalidate_memory()
+    assert data_cache.get_cached_data("seating", now_utc=NOW) is None
+    assert data_cache.get_entries() == []
+    assert data_cache.status()["codecs"]["seating"]["discarded"] == 1
+
+
+def test_pickles_from_before_the_codecs():
+    with data_cache._transaction() as conn:
+        conn.execute(
+            "INSERT INTO data_cache (data_type, data, timestamp, expiration) VALUES (?, ?, ?, ?)",
+            ("weather", pickle.dumps({"temperature": 21}), NOW.isoformat(), (NOW + datetime.timedelta(hours=1)).isoformat()),
+        )
+        conn.execute(
+            "INSERT INTO data_cache (data_type, data, timestamp, expiration) VALUES (?, ?, ?, ?)",
+            ("calendar", b"not a pickle", NOW.isoformat(), (NOW + datetime.timedelta(hours=1)).isoformat()),
+        )
+    assert data_cache.get_cached_data("weather", now_utc=NOW) == ({"temperature": 21}, NOW)
+    assert data_cache._connection().execute("SELECT data, schema_version FROM data_cache WHERE data_type = 'weather'").fetchone() == (b'{"temperature":21}', 1)
+    assert data_cache.get_cached_data("calendar", now_utc=NOW) is None
+    assert [entry.data_type for entry in data_cache.get_entries()] == ["weather"]
+
+
+def test_stale_data_is_served_until_max_stale():
+    data_cache.save_cached_data("weather", {"temperature": 21}, now_utc=NOW)
+    expiration = NOW + datetime.timedelta(hours=data_cache.EXPIRATION_HOURS["weather"])
+    max_stale = datetime.timedelta(hours=data_cache.MAX_STALE_HOURS["weather"])
+
+    assert data_cache.get_servable_data("weather", now_utc=NOW) == data_cache.CachedData(
+        data={"temperature": 21}, timestamp=NOW, expiration=expiration, stale=False
+    )
+    assert data_cache.get_cached_data("weather", now_utc=expiration) is None
+    assert data_cache.get_servable_data("weather", now_utc=expiration).stale
+    assert data_cache.get_servable_data("weather", now_utc=expiration + max_stale - datetime.timedelta(seconds=1)).stale
+    assert data_cache.get_servable_data("weather", now_utc=expiration + max_stale) is None
+    assert data_cache.get_servable_data("calendar", now_utc=NOW) is None
+
+
+def test_latest_data_regardless_of_expiration():
+    assert data_cache.get_latest_data("weather") is None
+    data_cache.save_cached_data("weather", {"temperature": 21}, now_utc=NOW)
+    assert data_cache.is_data_expired("weather", now_utc=NOW + datetime.timedelta(days=7))
+    assert data_cache.get_latest_data("weather") == ({"temperature": 21}, NOW)
+    data_cache.invalidate_memory()
+    assert data_cache.get_latest_data("weather") == ({"temperature": 21}, NOW)
+
+
+def test_changed_at_only_moves_when_the_data_changes():
+    assert data_cache.save_cached_data("calendar", "<p>Dentist</p>", now_utc=NOW)
+    later = NOW + datetime.timedelta(hours=4)
+    assert not data_cache.save_cached_data("calendar", "<p>Dentist</p>", now_utc=later)
+    (entry,) = data_cache.get_entries()
+    assert (entry.timestamp, entry.changed_at) == (later, NOW)
+    assert entry.content_hash == data_cache.content_hash(b'"<p>Dentist</p>"')
+
+    # The same data, in another order, is the same
+    data_cache.save_cached_data("weather", {"temperature": 21, "rain_mm": 0}, now_utc=NOW)
+    assert not data_cache.save_cached_data("weather", {"rain_mm": 0, "temperature": 21}, now_utc=later)
+
+    even_later = later + datetime.timedelta(hours=4)
+    assert data_cache.save_cached_data("calendar", "<p>Dentist</p><p>Haircut</p>", now_utc=even_later)
+    assert {entry.data_type: entry.changed_at for entry in data_cache.get_entries()} == {"calendar": even_later, "weather": NOW}
+
+
+def test_rows_from_before_content_hashes():
+    with data_cache._transaction() as conn:
+        conn.execute("DROP TABLE data_cache")
+        conn.execute("""
+            CREATE TABLE data_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data_type TEXT NOT NULL UNIQUE,
+                data BLOB NOT NULL,
+                timestamp DATETIME NOT NULL,
+                expiration DATETIME NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute(
+            "INSERT INTO data_cache (data_type, data, timestamp, expiration) VALUES (?, ?, ?, ?)",
+            ("calendar", pickle.dumps("<p>Dentist</p>"), NOW.isoformat(), (NOW + datetime.timedelta(hours=4)).isoformat()),
+        )
+    data_cache.init_db(logging.getLogger())
+    (entry,) = data_cache.get_entries()
+    assert (entry.changed_at, entry.content_hash) == (NOW, None)
+
+    # Migrating the pickle doesn't change it
+    assert data_cache.get_cached_data("calendar", now_utc=NOW) == ("<p>Dentist</p>", NOW)
+    (entry,) = data_cache.get_entries()
+    assert entry.changed_at == NOW
+    later = NOW + datetime.timedelta(hours=4)
+    assert not data_cache.save_cached_data("calendar", "<p>Dentist</p>", now_utc=later)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Tests for loading the device profiles."""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from eink_backend.device_profiles import DEFAULT_PROFILE, DeviceProfile, load_profiles
+
+
+def test_default_profile_keeps_the_original_output():
+    profiles = load_profiles()
+    assert list(profiles) == ["default"]
+    assert DEFAULT_PROFILE.output_dir(Path("/tmp/eink-display")) == Path("/tmp/eink-display")
+    assert DEFAULT_PROFILE.cache_profile == "528x880"
+    layout = Path("/app/assets/layout-shabbat.html")
+    assert DEFAULT_PROFILE.template_path(layout) == layout
+
+
+def test_load_profiles(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({"profiles": [
+        {"name": "kitchen", "width": 800, "height": 480, "rotate": 90, "colors": ["black"], "template_set": "small"},
+    ]}))
+    profiles = load_profiles(path)
+    assert list(profiles) == ["default", "kitchen"]
+    kitchen = profiles["kitchen"]
+    assert (kitchen.layout_width, kitchen.layout_height) == (480, 800)
+    assert kitchen.output_colors == ("black", "joined")
+    assert kitchen.source_color("black") == "joined"
+    assert kitchen.output_dir(Path("/out")) == Path("/out/profiles/kitchen")
+    assert kitchen.template_path(Path("/app/assets/layout-shabbat.html")) == Path("/app/assets/small/layout-shabbat.html")
+    assert kitchen.cache_profile != DEFAULT_PROFILE.cache_profile
+
+
+@pytest.mark.parametrize("bad", [
+    {"name": "../etc", "width": 100, "height": 100},
+    {"name": "small", "width": 0, "height": 100},
+    {"name": "small", "width": 100, "height": 100, "rotate": 45},
+    {"name": "small", "width": 100, "height": 100, "colors": ["red"]},
+    {"name": "small", "width": 100},
+])
+def test_bad_profiles_are_rejected(tmp_path, bad):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps([bad]))
+    with pytest.raises(ValueError):
+        load_profiles(path)
+
+
+def test_profile_names_are_unique(tmp_path):
+    path = tmp_path / "profiles.json"
+    profile = {"name": "hall", "width": 100, "height": 100}
+    path.write_text(json.dumps([profile, profile]))
+    with pytest.raises(ValueError):
+        load_profiles(path)
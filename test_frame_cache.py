@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Tests for the content-addressed rendered-frame cache."""
+
+import os
+from pathlib import Path
+
+from eink_backend.frame_cache import FrameCache, frame_cache_key
+
+
+def test_key_depends_on_html_color_and_profile():
+    key = frame_cache_key(html_content="<html>", color="black", profile="528x880")
+    assert key == frame_cache_key(html_content="<html>", color="black", profile="528x880")
+    assert key != frame_cache_key(html_content="<html> ", color="black", profile="528x880")
+    assert key != frame_cache_key(html_content="<html>", color="red", profile="528x880")
+    assert key != frame_cache_key(html_content="<html>", color="black", profile="800x480")
+
+
+def test_get_counts_hits_and_misses(tmp_path: Path):
+    cache = FrameCache(cache_dir=tmp_path)
+    assert cache.get("abc") is None
+    cache.put("abc", b"png-bytes")
+    assert cache.get("abc") == b"png-bytes"
+    assert cache.get("abc", fmt="bits") is None
+
+    status = cache.status()
+    assert status["hits"] == 1
+    assert status["misses"] == 2
+    assert status["entries"] == 1
+    assert status["bytes"] == len(b"png-bytes")
+
+
+def test_evicts_least_recently_used_when_over_size(tmp_path: Path):
+    cache = FrameCache(cache_dir=tmp_path, max_bytes=20)
+    cache.put("a", b"x" * 8)
+    cache.put("b", b"x" * 8)
+    # Touch "a", so "b" is now the least recently used
+    assert cache.get("a") is not None
+    cache.put("c", b"x" * 8)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert not (tmp_path / "b.png").exists()
+    assert cache.status()["evictions"] == 1
+
+
+def test_evicts_when_over_entry_count(tmp_path: Path):
+    cache = FrameCache(cache_dir=tmp_path, max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    cache.put("c", b"3")
+    assert cache.get("a") is None
+    assert cache.status()["entries"] == 2
+
+
+def test_index_is_rebuilt_from_disk(tmp_path: Path):
+    cache = FrameCache(cache_dir=tmp_path)
+    cache.put("old", b"1")
+    cache.put("new", b"2", fmt="bits")
+    os.utime(tmp_path / "old.png", (1, 1))
+
+    reloaded = FrameCache(cache_dir=tmp_path, max_entries=1)
+    assert reloaded.get("old") is None
+    assert reloaded.get("new", fmt="bits") == b"2"
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Tests for the partial-refresh diffs between consecutive frames."""
+
+from PIL import Image, ImageDraw
+
+from eink_backend.bitplanes import pack_plane
+from eink_backend.frame_diff import DeviceFrames, Rect, crop_plane, dirty_rects
+
+WIDTH = 528
+HEIGHT = 880
+
+
+def plane(*boxes):
+    image = Image.new("1", (WIDTH, HEIGHT), 1)
+    draw = ImageDraw.Draw(image)
+    for box in boxes:
+        draw.rectangle(box, fill=0)
+    return pack_plane(image)
+
+
+def test_separate_changes_get_separate_byte_aligned_rects():
+    old = plane()
+    # A "clock" near the top and a "weather block" near the bottom
+    new = plane((10, 20, 50, 40), (300, 700, 420, 760))
+    assert dirty_rects(old, new, WIDTH, HEIGHT) == [
+        Rect(x=8, y=20, width=48, height=21),
+        Rect(x=296, y=700, width=128, height=61),
+    ]
+    assert dirty_rects(new, new, WIDTH, HEIGHT) == []
+
+
+def test_crop_plane_returns_the_rect_pixels():
+    new = plane((16, 2, 23, 3))
+    data = crop_plane(new, WIDTH, Rect(x=16, y=2, width=8, height=2))
+    assert data == b"\x00\x00"
+
+
+def test_device_updates():
+    frames = DeviceFrames(width=WIDTH, height=HEIGHT, max_partial_refreshes=2)
+    blank = {"black": plane(), "red": plane()}
+    first = frames.update("hall", blank)
+    assert first.full_refresh
+    assert first.rects["black"] == [Rect(0, 0, WIDTH, HEIGHT)]
+
+    unchanged = frames.update("hall", blank, have=first.frame_id)
+    assert not unchanged.full_refresh
+    assert unchanged.rects == {}
+
+    clock = {"black": plane((10, 20, 50, 40)), "red": plane()}
+    partial = frames.update("hall", clock, have=first.frame_id)
+    assert not partial.full_refresh
+    assert partial.base_frame_id == first.frame_id
+    assert partial.rects == {"black": [Rect(x=8, y=20, width=48, height=21)], "red": []}
+    assert len(partial.data["black"][0]) == 6 * 21
+
+    # The device didn't get the last update, so diffing against it would be wrong
+    assert frames.update("hall", blank, have=first.frame_id).full_refresh
+
+    # Most of the frame changed
+    assert frames.update("hall", {"black": plane((0, 0, WIDTH, HEIGHT)), "red": plane()}).full_refresh
+
+
+def test_full_refresh_after_too_many_partial_ones():
+    frames = DeviceFrames(width=WIDTH, height=HEIGHT, max_partial_refreshes=2)
+    frames.update("hall", {"black": plane()})
+    assert not frames.update("hall", {"black": plane((0, 0, 8, 8))}).full_refresh
+    assert not frames.update("hall", {"black": plane((0, 0, 16, 8))}).full_refresh
+    assert frames.update("hall", {"black": plane((0, 0, 24, 8))}).full_refresh
+    assert frames.status()["devices"]["hall"]["partial_refreshes"] == 0
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Tests for the native (Pillow) render engine."""
+
+import json
+from pathlib import Path
+
+from eink_backend.pillow_layout import (
+    INK,
+    compose_joined,
+    native_layout_path,
+    render_plane,
+    visual_order,
+)
+
+ASSETS = Path(__file__).parent / "assets"
+
+
+def test_visual_order_keeps_numbers_left_to_right():
+    assert visual_order("שבת 18:40") == "18:40 תבש"
+    assert visual_order("(אתמול) 17 בעומר") == "רמועב 17 (לומתא)"
+    assert visual_order("10:00 Lunch") == "10:00 Lunch"
+
+
+def test_native_layout_path_matches_html_layout():
+    assert native_layout_path(Path("/app/assets/layout-shabbat.html")) == Path("/app/assets/layout-shabbat.native.json")
+    for name in ("layout-shabbat", "layout-choreday", "layout-shabbat-seating"):
+        assert native_layout_path(ASSETS / f"{name}.html").exists()
+
+
+def _ink_count(image) -> int:
+    return image.histogram()[INK]
+
+
+def test_render_plane_draws_only_its_own_color(tmp_path: Path):
+    layout = {
+        "size": [100, 50],
+        "elements": [
+            {"type": "rect", "box": [0, 0, 10, 10], "fill": True},
+            {"type": "rect", "box": [50, 0, 10, 10], "fill": True, "color": "red"},
+            {"type": "text", "text": "$value", "box": [0, 20, 100, 30], "when": {"show": "yes"}},
+        ],
+    }
+    layout_path = tmp_path / "test.native.json"
+    layout_path.write_text(json.dumps(layout), encoding="utf-8")
+
+    black = render_plane(layout_path, values={"value": "Hi", "show": "no"}, color="black")
+    red = render_plane(layout_path, values={"value": "Hi", "show": "no"}, color="red")
+    assert black.mode == "1"
+    assert black.size == (100, 50)
+    assert _ink_count(black) == 100
+    assert _ink_count(red) == 100
+    assert black.getpixel((5, 5)) == 0 and black.getpixel((55, 5)) != 0
+    assert red.getpixel((55, 5)) == 0 and red.getpixel((5, 5)) != 0
+
+    with_text = render_plane(layout_path, values={"value": "Hi", "show": "yes"}, color="black")
+    assert _ink_count(with_text) > 100
+
+    joined = compose_joined({"black": black, "red": red})
+    assert joined.getpixel((5, 5)) == (0, 0, 0)
+    assert joined.getpixel((55, 5)) == (255, 0, 0)
+    assert joined.getpixel((95, 45)) == (255, 255, 255)
+
+
+def test_fragment_colors_come_from_html_classes(tmp_path: Path):
+    layout = {
+        "size": [200, 40],
+        "elements": [
+            {
+                "type": "fragment_line",
+                "key": "fragment",
+                "box": [0, 0, 200, 40],
+                "parts": [{"select": "span.black"}, {"select": "span.red"}],
+            },
+        ],
+    }
+    layout_path = tmp_path / "test.native.json"
+    layout_path.write_text(json.dumps(layout), encoding="utf-8")
+    values = {"fragment": '<span class="black">AAA</span><span class="red">BBB</span>'}
+
+    black = render_plane(layout_path, values=values, color="black")
+    red = render_plane(layout_path, values=values, color="red")
+    black_columns = [x for x in range(200) if any(black.getpixel((x, y)) == 0 for y in range(40))]
+    red_columns = [x for x in range(200) if any(red.getpixel((x, y)) == 0 for y in range(40))]
+    assert black_columns and red_columns
+    assert max(black_columns) < min(red_columns)
+
+
+def test_shipped_layouts_render():
+    values = {
+        "day_of_week": "Friday",
+        "date": "3 of October 2025",
+        "parasha": "האזינו",
+        "candle_lighting": "17:30",
+        "omer_display": "none",
+        "additional_css": "#tset-big { display: none; }",
+        "weather_report": "",
+        "calendar_content": "",
+        "chores_content": "",
+        "render_timestamp": "2025-03-10 10:00:00",
+    }
+    for name in ("layout-shabbat", "layout-choreday", "layout-shabbat-seating"):
+        for color in ("black", "red"):
+            plane = render_plane(ASSETS / f"{name}.native.json", values=values, color=color)
+            assert plane.size == (528, 880)
+            assert _ink_count(plane) > 0
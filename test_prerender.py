@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Tests for the change points and the staging of pre-rendered frames."""
+
+import datetime
+from pathlib import Path
+
+from eink_backend.config import LOCAL_TZ
+from eink_backend.prerender import ChangePoint, FrameSchedule, change_points, next_change_point, next_wake
+
+UTC = datetime.timezone.utc
+
+
+def _local(*args) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=LOCAL_TZ).astimezone(UTC)
+
+
+def test_change_points_include_template_switches_and_hours():
+    # Friday 2025-10-03, 15:30 local
+    start = _local(2025, 10, 3, 15, 30)
+    points = change_points(start_utc=start, end_utc=start + datetime.timedelta(hours=2))
+    assert [p.at for p in points] == [_local(2025, 10, 3, 16), _local(2025, 10, 3, 17)]
+    assert points[0].reasons == ("template", "weather")
+    assert points[1].reasons == ("weather",)
+
+
+def test_change_points_include_tset_and_starlight():
+    start = _local(2025, 10, 4, 15, 30)
+    tset = datetime.datetime(2025, 10, 4, 18, 40, tzinfo=LOCAL_TZ)
+    points = change_points(
+        start_utc=start,
+        end_utc=start + datetime.timedelta(hours=7),
+        tset_shabat=tset,
+        tzet_shabat="18:40",
+    )
+    by_time = {p.at: p.reasons for p in points}
+    assert by_time[(tset - datetime.timedelta(hours=2)).astimezone(UTC)] == ("tset-soon",)
+    assert by_time[tset.astimezone(UTC)] == ("tset",)
+    # The starlight check compares the "HH:MM" string with the UTC time
+    assert by_time[datetime.datetime(2025, 10, 4, 18, 40, 1, tzinfo=UTC)] == ("starlight",)
+
+
+def test_next_change_point_is_never_more_than_an_hour_away():
+    now = _local(2025, 10, 1, 9, 59, 59)
+    assert next_change_point(now).at == _local(2025, 10, 1, 10)
+    now = _local(2025, 10, 1, 10)
+    assert next_change_point(now).at == _local(2025, 10, 1, 11)
+
+
+def _stage(schedule: FrameSchedule, at: datetime.datetime, valid_until: datetime.datetime, content: bytes) -> ChangePoint:
+    change_point = ChangePoint(at=at, reasons=("weather",))
+    generation = schedule.generation
+    directory = schedule.staging_dir_for(change_point)
+    (directory / "black.png").write_bytes(content)
+    schedule.stage(change_point, valid_until=valid_until, directory=directory, generation=generation)
+    return change_point
+
+
+def test_staged_frames_are_promoted_at_their_change_point(tmp_path: Path):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    schedule = FrameSchedule(out_dir=out_dir, staging_dir=out_dir / ".prerender")
+    t0 = datetime.datetime(2025, 10, 1, 10, tzinfo=UTC)
+    hour = datetime.timedelta(hours=1)
+    assert schedule.mark_published(valid_from=t0, valid_until=t0 + hour, generation=schedule.generation)
+    change_point = _stage(schedule, at=t0 + hour, valid_until=t0 + 2 * hour, content=b"11:00")
+    assert schedule.is_staged(change_point)
+    # Another device profile's frame
+    kitchen = schedule.staging_dir / change_point.at.strftime("%Y%m%d-%H%M%S") / "profiles" / "kitchen"
+    kitchen.mkdir(parents=True)
+    (kitchen / "black.png").write_bytes(b"kitchen 11:00")
+
+    # Not yet
+    assert not schedule.promote_due(t0 + hour - datetime.timedelta(seconds=1))
+    assert schedule.is_current(t0 + hour - datetime.timedelta(seconds=1))
+    assert not schedule.is_current(t0 + hour)
+
+    assert schedule.promote_due(t0 + hour)
+    assert (out_dir / "black.png").read_bytes() == b"11:00"
+    assert (out_dir / "profiles" / "kitchen" / "black.png").read_bytes() == b"kitchen 11:00"
+    assert schedule.is_current(t0 + hour)
+    assert not (out_dir / ".prerender" / (t0 + hour).strftime("%Y%m%d-%H%M%S")).exists()
+
+
+def test_refreshed_data_invalidates_only_frames_that_show_it(tmp_path: Path):
+    friday_noon = datetime.datetime(2025, 10, 3, 12, tzinfo=UTC)
+    hour = datetime.timedelta(hours=1)
+    schedule = FrameSchedule(
+        out_dir=tmp_path,
+        staging_dir=tmp_path / ".prerender",
+        is_data_relevant=lambda data_type, at: data_type != "chores" or at < friday_noon + hour,
+    )
+    schedule.mark_published(valid_from=friday_noon, valid_until=friday_noon + hour, generation=schedule.generation)
+    later = _stage(schedule, at=friday_noon + hour, valid_until=friday_noon + 2 * hour, content=b"x")
+
+    assert schedule.invalidate("chores")
+    assert not schedule.is_current(friday_noon)
+    assert schedule.is_staged(later)
+
+    assert schedule.invalidate("weather")
+    assert not schedule.is_staged(later)
+    assert not schedule.invalidate("weather")
+
+
+def test_render_started_before_a_refresh_is_discarded(tmp_path: Path):
+    schedule = FrameSchedule(out_dir=tmp_path, staging_dir=tmp_path / ".prerender")
+    t0 = datetime.datetime(2025, 10, 1, 10, tzinfo=UTC)
+    schedule.mark_published(valid_from=t0, valid_until=t0 + datetime.timedelta(hours=1), generation=0)
+    generation = schedule.generation
+    schedule.invalidate("weather")
+    assert not schedule.mark_published(valid_from=t0, valid_until=t0 + datetime.timedelta(hours=1), generation=generation)
+    assert not schedule.is_current(t0)
+
+
+def test_next_wake_is_the_first_change_point_or_data_refresh():
+    now = _local(2025, 10, 3, 15, 30)
+    # Nothing expected before the next change point
+    wake = next_wake(now, data_refreshes={"calendar": _local(2025, 10, 3, 18)})
+    assert wake == ChangePoint(at=_local(2025, 10, 3, 16), reasons=("template", "weather"))
+
+    wake = next_wake(now, data_refreshes={"calendar": _local(2025, 10, 3, 15, 46), "chores": _local(2025, 10, 3, 15, 46)})
+    assert wake == ChangePoint(at=_local(2025, 10, 3, 15, 46), reasons=("calendar-refresh", "chores-refresh"))
+
+    # An overdue refresh doesn't make the device poll in a busy loop
+    wake = next_wake(now, data_refreshes={"weather": now - datetime.timedelta(minutes=5)})
+    assert wake.at == now + datetime.timedelta(minutes=1)
+
+
+def test_friday_evening_seating_ends_at_midnight():
+    # Friday 2025-10-03, 23:30 local
+    start = _local(2025, 10, 3, 23, 30)
+    points = change_points(start_utc=start, end_utc=start + datetime.timedelta(hours=1))
+    assert [p.at for p in points] == [_local(2025, 10, 4, 0)]
+    assert "template" in points[0].reasons
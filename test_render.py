@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Tests for the color-plane extraction in render.py."""
+
+import colorsys
+
+import numpy as np
+from PIL import Image
+
+from eink_backend import render
+
+
+def _sample_image(mode: str, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(40, 36, len(mode)), dtype=np.uint8)
+    # Some grays and some pure reds, which hit the edge cases of the HSV conversion
+    pixels[:8, :, 1] = pixels[:8, :, 0]
+    pixels[:8, :, 2] = pixels[:8, :, 0]
+    pixels[8:16, :, 1:3] = 0
+    return Image.fromarray(pixels, mode=mode)
+
+
+def test_rgb_to_hsv_arrays_matches_colorsys():
+    pixels = np.asarray(_sample_image("RGB")).reshape(-1, 3)
+    (h, s, v) = render.rgb_to_hsv_arrays(pixels)
+    for i, (r, g, b) in enumerate(pixels.tolist()):
+        assert (h[i], s[i], v[i]) == colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
+
+
+def test_extract_red_matches_per_pixel_thresholds():
+    for mode in ("RGB", "RGBA"):
+        src = _sample_image(mode)
+        red = render.extract_red(src)
+        assert red.mode == "LA"
+        assert red.size == src.size
+        for (x, y) in ((x, y) for y in range(src.height) for x in range(src.width)):
+            pixel = src.getpixel((x, y))
+            (h, s, v) = render.rgb_to_hsv(pixel[:3])
+            is_red = (h <= 0.1 or h >= 0.9) and (v >= 0.8) and (s >= 0.3)
+            expected_alpha = pixel[3] if mode == "RGBA" else 0
+            assert red.getpixel((x, y)) == (0 if is_red else 255, expected_alpha)
+
+
+def test_extract_black_and_gray_matches_per_pixel_dithering():
+    for mode in ("RGB", "RGBA"):
+        src = _sample_image(mode, seed=1)
+        black = render.extract_black_and_gray(src)
+        assert black.mode == "L"
+        assert black.size == src.size
+        for (x, y) in ((x, y) for y in range(src.height) for x in range(src.width)):
+            pixel = src.getpixel((x, y))
+            (h, s, v) = render.rgb_to_hsv(pixel[:3])
+            alpha = pixel[3] if mode == "RGBA" else 100
+            assert black.getpixel((x, y)) == render.gray_to_black_or_white(h=h, s=s, v=v, alpha=alpha, x=x, y=y)
+
+
+def test_dithered_gray_repeats_every_four_pixels():
+    # A middling gray is a checkerboard, for any image size
+    src = Image.new("RGBA", (10, 7), (160, 160, 160, 255))
+    black = np.asarray(render.extract_black_and_gray(src))
+    assert set(np.unique(black)) == {render.BLACK, render.WHITE}
+    assert (black[:, :-4] == black[:, 4:]).all()
+    assert (black[:-4, :] == black[4:, :]).all()
+    assert (black[:, :-1] != black[:, 1:]).all()
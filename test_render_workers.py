@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Tests for the bounded render worker pool."""
+
+import asyncio
+import threading
+
+import pytest
+
+from eink_backend.render_workers import RenderQueueFullError, RenderTimeoutError, RenderWorkers
+
+
+def test_render_does_not_block_the_event_loop():
+    workers = RenderWorkers(workers=1, max_queued=0)
+    release = threading.Event()
+
+    async def scenario():
+        render = asyncio.ensure_future(workers.run(lambda: release.wait(5) and "done"))
+        # Other requests are served while the render runs
+        await asyncio.sleep(0.05)
+        assert not render.done()
+        assert workers.status()["pending"] == 1
+        release.set()
+        return await render
+
+    assert asyncio.run(scenario()) == "done"
+    assert workers.status()["completed"] == 1
+    assert workers.status()["pending"] == 0
+    workers.shutdown()
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    workers = RenderWorkers(workers=1, max_queued=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(workers.run(release.wait, 5))
+        queued = asyncio.ensure_future(workers.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(RenderQueueFullError) as ex:
+            await workers.run(release.wait, 5)
+        assert ex.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(running, queued)
+
+    asyncio.run(scenario())
+    assert workers.status()["rejected"] == 1
+    workers.shutdown()
+
+
+def test_timed_out_render_keeps_its_slot_until_it_finishes():
+    workers = RenderWorkers(workers=1, max_queued=0, job_timeout=0.05)
+    release = threading.Event()
+
+    async def scenario():
+        with pytest.raises(RenderTimeoutError):
+            await workers.run(release.wait, 5)
+        # The thread is still busy, so there's no room yet
+        with pytest.raises(RenderQueueFullError):
+            await workers.run(lambda: None)
+        release.set()
+        await asyncio.sleep(0.05)
+        return await workers.run(lambda: "ok")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert workers.status()["timed_out"] == 1
+    workers.shutdown()
+
+
+def test_errors_are_raised_to_the_caller():
+    workers = RenderWorkers()
+
+    def fail():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        asyncio.run(workers.run(fail))
+    assert workers.status()["failed"] == 1
+    assert workers.status()["pending"] == 0
+    workers.shutdown()
+
+
+def test_shutdown_cancels_the_queued_jobs():
+    workers = RenderWorkers(workers=1, max_queued=2)
+    release = threading.Event()
+
+    async def scenario():
+        renders = [asyncio.ensure_future(workers.run(lambda: release.wait(5) and "done")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert workers.status()["pending"] == 3
+        workers.shutdown()
+        release.set()
+        return await asyncio.gather(*renders, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert results[0] == "done"
+    assert all(isinstance(result, asyncio.CancelledError) for result in results[1:])
+    assert workers.status()["pending"] == 0
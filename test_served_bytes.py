@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Tests for the in-memory bytes of the served files."""
+
+import gzip
+import os
+
+from eink_backend.served_bytes import ServedBytes
+
+
+def test_hits_and_invalidation(tmp_path):
+    icon = tmp_path / "black-sun.png"
+    icon.write_bytes(b"icon 1")
+    cache = ServedBytes(revalidate_after=3600)
+    first = cache.get(icon)
+    assert first.body == b"icon 1"
+    assert first.media_type == "image/png"
+    assert cache.get(icon) is first
+
+    # Written again: served from memory until it's invalidated
+    icon.write_bytes(b"icon 2")
+    assert cache.get(icon).body == b"icon 1"
+    cache.invalidate(icon)
+    assert cache.get(icon).body == b"icon 2"
+    assert cache.status()["hits"] == 2
+    assert cache.status()["misses"] == 2
+
+
+def test_revalidates_mutable_files_but_not_immutable_ones(tmp_path):
+    css = tmp_path / "main.css"
+    css.write_text("body {}")
+    cache = ServedBytes(revalidate_after=0)
+    assert cache.get(css).body == b"body {}"
+    assert cache.get(css, immutable=True).body == b"body {}"
+
+    css.write_text("body { color: red; }")
+    os.utime(css, ns=(os.stat(css).st_mtime_ns + 10**9,) * 2)
+    assert cache.get(css, immutable=True).body == b"body {}"
+    assert cache.get(css).body == b"body { color: red; }"
+
+
+def test_compressed_variants(tmp_path):
+    css = tmp_path / "main.css"
+    css.write_text(".row { display: flex; }\n" * 100)
+    served = ServedBytes().get(css)
+    assert served.media_type == "text/css"
+    (encoding, body) = served.negotiate("gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == served.body
+    assert served.negotiate("gzip;q=0") == (None, served.body)
+    assert served.negotiate(None) == (None, served.body)
+
+    icon = tmp_path / "icon.png"
+    icon.write_bytes(bytes(1000))
+    assert ServedBytes().get(icon).encoded == {}
+
+
+def test_bounded_by_size(tmp_path):
+    cache = ServedBytes(max_bytes=4000)
+    for index in range(5):
+        (tmp_path / f"{index}.png").write_bytes(bytes(1000))
+        cache.get(tmp_path / f"{index}.png")
+    status = cache.status()
+    assert status["entries"] == 4
+    assert status["bytes"] == 4000
+    assert status["evictions"] == 1
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Tests for coalescing identical in-flight calls."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from eink_backend.single_flight import SingleFlight
+
+
+def test_overlapping_calls_run_once():
+    flights = SingleFlight(name="test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "weather"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("weather", fetch)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("weather", fetch))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+
+    assert results == ["weather"] * 4
+    assert len(calls) == 1
+    assert flights.status() == {"in_flight": 0, "calls": 4, "coalesced": 3}
+
+
+def test_calls_that_dont_overlap_run_again():
+    flights = SingleFlight(name="test")
+    assert flights.do("a", lambda: 1) == 1
+    assert flights.do("a", lambda: 2) == 2
+    assert flights.do("b", lambda: 3) == 3
+    assert flights.status()["coalesced"] == 0
+
+
+def test_waiters_get_the_exception_too():
+    flights = SingleFlight(name="test")
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def fail():
+            await release.wait()
+            raise KeyError("calendar")
+
+        leader = asyncio.ensure_future(flights.do_async("calendar", fail))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do_async("calendar", fail))
+        await asyncio.sleep(0)
+        release.set()
+        for task in (leader, follower):
+            with pytest.raises(KeyError):
+                await task
+
+    asyncio.run(scenario())
+    assert flights.status() == {"in_flight": 0, "calls": 2, "coalesced": 1}
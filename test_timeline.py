@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Tests for the timeline of distinct frames over a range of time."""
+
+import datetime
+import io
+
+import pytest
+from PIL import Image
+
+from eink_backend.timeline import collapse, contact_sheet, sample_times
+
+UTC = datetime.timezone.utc
+START = datetime.datetime(2026, 3, 6, 12, tzinfo=UTC)
+HOUR = datetime.timedelta(hours=1)
+
+
+def test_sample_times():
+    assert sample_times(START, START + 3 * HOUR, HOUR, max_samples=10) == [START, START + HOUR, START + 2 * HOUR]
+    # A partial last step still gets a sample
+    assert len(sample_times(START, START + 150 * datetime.timedelta(minutes=1), HOUR, max_samples=10)) == 3
+    with pytest.raises(ValueError):
+        sample_times(START, START, HOUR, max_samples=10)
+    with pytest.raises(ValueError):
+        sample_times(START, START + 24 * HOUR, HOUR, max_samples=10)
+
+
+def test_collapse_merges_consecutive_samples():
+    times = [START + index * HOUR for index in range(5)]
+    end = START + 5 * HOUR
+    frames = collapse(times, ["weekday", "weekday", "shabbat", "shabbat", "weekday"], end=end)
+    assert [frame.content_hash for frame in frames] == ["weekday", "shabbat"]
+    assert frames[0].spans == [(START, START + 2 * HOUR), (START + 4 * HOUR, end)]
+    assert frames[1].spans == [(START + 2 * HOUR, START + 4 * HOUR)]
+    assert frames[0].label(tz=UTC) == "Fri 06/03 12:00 - Fri 06/03 14:00 (+1)"
+
+
+def test_contact_sheet():
+    buffer = io.BytesIO()
+    Image.new("1", (528, 880), 1).save(buffer, format="PNG")
+    sheet = Image.open(io.BytesIO(contact_sheet([("a", buffer.getvalue())] * 5, columns=4, thumbnail_width=132)))
+    assert sheet.width == 4 * (132 + 8) + 8
+    assert sheet.height == 2 * (220 + 28 + 8) + 8
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Tests for rendering `/timeline` from the cached data, with a fake layout and browser."""
+
+import asyncio
+import datetime
+import hashlib
+import io
+import logging
+import time
+from string import Template
+
+import pytest
+from PIL import Image
+
+from eink_backend import data_cache, main
+from eink_backend.artifacts import ArtifactStore
+from eink_backend.cache_codecs import CODECS
+from eink_backend.chores import ChoreData
+from eink_backend.device_profiles import DEFAULT_PROFILE, DEFAULT_PROFILE_NAME
+from eink_backend.frame_cache import FrameCache
+from eink_backend.seating import SeatingData
+from eink_backend.weather import WeatherDaily, WeatherForecast, WeatherHourly
+
+UTC = datetime.timezone.utc
+FETCHED = datetime.datetime(2026, 3, 1, 8, tzinfo=UTC)
+
+
+def _weather() -> WeatherForecast:
+    hourly = WeatherHourly(
+        timestamp=FETCHED,
+        temperature_2m=14.5,
+        apparent_temperature=13.0,
+        rain_mm=0.0,
+        wind_speed_10m=12.3,
+        wind_direction_10m=270,
+        uv_index=3.5,
+        weather_code="02d",
+    )
+    return WeatherForecast(
+        current=hourly,
+        hourlies=[hourly],
+        tomorrow=WeatherDaily(timestamp=FETCHED, apparent_temperature_min=8.0, apparent_temperature_max=17.5, weather_code="10d"),
+    )
+
+
+def _fake_screenshot(html_content: str, profile=DEFAULT_PROFILE) -> bytes:
+    """A plain image whose shade depends on the HTML, and no screenshot of a Saturday."""
+    if "Saturday" in html_content:
+        raise RuntimeError("The browser crashed")
+    shade = hashlib.sha256(html_content.encode("utf-8")).digest()[0]
+    buffer = io.BytesIO()
+    Image.new("RGB", (profile.layout_width, profile.height), (shade, shade, shade)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def renders(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, "DB_PATH", tmp_path / "data_cache.sqlite")
+    monkeypatch.setattr(data_cache, "_codecs", dict(CODECS))
+    data_cache.invalidate_memory()
+    data_cache.init_db(logging.getLogger())
+    monkeypatch.setattr(main, "frame_cache", FrameCache(cache_dir=tmp_path / "frame-cache"))
+    monkeypatch.setattr(main, "frame_artifacts", ArtifactStore(root=tmp_path / "frames"))
+    # The layouts are in /app/assets; this one only changes with the day
+    monkeypatch.setattr(
+        main, "load_template_by_time", lambda now_utc, profile=DEFAULT_PROFILE: (Template("<p>$day_of_week$stale_data</p>"), set())
+    )
+    monkeypatch.setattr(main, "screenshot_html", _fake_screenshot)
+    # Bound to the event loop of the test that first waits on it
+    monkeypatch.setattr(main, "timeline_slots", asyncio.Semaphore(2))
+    refreshes = []
+    monkeypatch.setattr(main, "request_data_refresh", refreshes.append)
+    for (data_type, data) in [
+        ("weather", _weather()),
+        ("calendar", "<table></table>"),
+        ("chores", ChoreData(chores=[])),
+        ("seating", SeatingData(seats=[])),
+    ]:
+        data_cache.save_cached_data(data_type, data, now_utc=FETCHED)
+    yield refreshes
+    data_cache.close_connections()
+    data_cache.invalidate_memory()
+
+
+def test_days_past_the_expiration_of_the_data(renders):
+    # Long past even serving the data stale
+    start = FETCHED + datetime.timedelta(days=3)
+    times = [start + datetime.timedelta(hours=hours) for hours in range(0, 72, 6)]
+    (keys, first_of_key, errors) = main.timeline_frame_keys(color="joined", times=times)
+    assert errors == {}
+    assert len(first_of_key) == 4
+    assert all("stale" not in html_content for (_, html_content) in first_of_key.values())
+    assert renders == []
+
+
+def test_samples_that_cant_be_rendered():
+    data_cache.invalidate_memory()
+    with data_cache._transaction() as conn:
+        conn.execute("DELETE FROM data_cache WHERE data_type = 'seating'")
+    (keys, first_of_key, errors) = main.timeline_frame_keys(color="joined", times=[FETCHED])
+    assert (keys, first_of_key) == ([None], {})
+    assert "seating" in errors[FETCHED]
+
+
+def test_timeline_reports_failed_frames(renders):
+    # Wednesday to Sunday, the Saturday's frame fails to render
+    start = FETCHED + datetime.timedelta(days=3)
+    result = asyncio.run(main.timeline_endpoint(
+        start=start.strftime("%Y%m%d-%H%M%S"),
+        end=(start + datetime.timedelta(days=4)).strftime("%Y%m%d-%H%M%S"),
+        step_minutes=360,
+        color=main.ColorName.JOINED,
+        profile=DEFAULT_PROFILE_NAME,
+        format=main.TimelineFormat.JSON,
+    ))
+    assert (result["samples"], result["rendered"], result["distinct"]) == (16, 4, 4)
+    assert result["failed"]["samples"] == 4
+    assert result["failed"]["errors"] == ["The browser crashed"]
+    assert len(result["failed"]["spans"]) == 1
+    assert renders == []
+    # The frames are kept for the client to fetch, and the frame cache is left alone
+    for frame in result["frames"]:
+        assert main.frame_artifacts.path(frame["content_hash"]).exists()
+    assert main.frame_artifacts.status()["kept"] == 4
+    assert main.frame_cache.status()["entries"] == 0
+
+
+def test_overlapping_timelines_with_different_steps(monkeypatch):
+    frame_keys = main.timeline_frame_keys
+
+    def timeline_frame_keys(**kwargs):
+        # Slow enough for the two requests to be in flight together
+        time.sleep(0.2)
+        return frame_keys(**kwargs)
+
+    monkeypatch.setattr(main, "timeline_frame_keys", timeline_frame_keys)
+    start = FETCHED + datetime.timedelta(days=3)
+
+    def timeline(step: datetime.timedelta):
+        return main.timeline_endpoint(
+            start=start.strftime("%Y%m%d-%H%M%S"),
+            end=(start + 4 * step).strftime("%Y%m%d-%H%M%S"),
+            step_minutes=step.total_seconds() / 60,
+            color=main.ColorName.JOINED,
+            profile=DEFAULT_PROFILE_NAME,
+            format=main.TimelineFormat.JSON,
+        )
+
+    async def scenario():
+        return await asyncio.gather(timeline(datetime.timedelta(hours=1)), timeline(datetime.timedelta(days=1)))
+
+    (hourly, daily) = asyncio.run(scenario())
+    # Same start and number of samples: Wednesday only, and Wednesday to Saturday
+    assert (hourly["samples"], hourly["distinct"], hourly["failed"]["samples"]) == (4, 1, 0)
+    assert (daily["samples"], daily["distinct"], daily["failed"]["samples"]) == (4, 3, 1)
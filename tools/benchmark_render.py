@@ -0,0 +1,138 @@
+"""Benchmark of the color-plane extraction in render.py.
+
+Times the vectorized functions in `eink_backend.render` against the per-pixel
+loops they replaced (kept here as the reference), on an 80x80 weather icon and
+on a full 528x880 frame, and checks that both give the same pixels.
+
+Usage:
+    python tools/benchmark_render.py [--repeat N]
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Allow running from the repo root without installing the package
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from eink_backend import render
+
+
+# ---------------------------------------------------------------------------
+# The per-pixel implementations, as they were before vectorizing
+# ---------------------------------------------------------------------------
+
+def extract_red_loop(src: Image.Image) -> Image.Image:
+    color_channels = src.split()
+    if len(color_channels) == 4:
+        red_img, green_img, blue_img, alpha_img = color_channels
+    else:
+        red_img, green_img, blue_img = color_channels
+        alpha_img = None
+    red_data = red_img.getdata()
+    green_data = green_img.getdata()
+    blue_data = blue_img.getdata()
+    grayscale = Image.new("LA", (src.width, src.height), 0)
+    grayscale_data = []
+    for i in range(0, len(red_data)):
+        (h, s, v) = render.rgb_to_hsv((red_data[i], green_data[i], blue_data[i]))
+        if (h <= 0.1 or h >= 0.9) and (v >= 0.8) and (s >= 0.3):
+            grayscale_data.append(0)
+        else:
+            grayscale_data.append(255)
+    grayscale.putdata(grayscale_data)
+    if alpha_img:
+        grayscale.putalpha(alpha_img)
+    return grayscale
+
+
+def extract_black_and_gray_loop(src: Image.Image) -> Image.Image:
+    red_data = src.getchannel("R").getdata()
+    green_data = src.getchannel("G").getdata()
+    blue_data = src.getchannel("B").getdata()
+    grayscale = Image.new("L", (src.width, src.height), 0)
+    alpha_data = None
+    if src.has_transparency_data:
+        alpha_data = src.getchannel("A").getdata()
+    grayscale_data = []
+    for i in range(0, len(red_data)):
+        x = i % src.width
+        y = int(i / src.width)
+        alpha = alpha_data[i] if alpha_data else 100
+        (h, s, v) = render.rgb_to_hsv((red_data[i], green_data[i], blue_data[i]))
+        grayscale_data.append(render.gray_to_black_or_white(h=h, s=s, v=v, x=x, y=y, alpha=alpha))
+    grayscale.putdata(grayscale_data)
+    return grayscale
+
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+def _sample_image(width: int, height: int) -> Image.Image:
+    """Random colors, plus bands of grays and of pure reds, with a random alpha."""
+    rng = np.random.default_rng(seed=528)
+    pixels = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+    band = height // 4
+    pixels[:band, :, 1] = pixels[:band, :, 0]
+    pixels[:band, :, 2] = pixels[:band, :, 0]
+    pixels[band:2 * band, :, 1:3] = 0
+    pixels[2 * band:3 * band, :, 3] = 255
+    return Image.fromarray(pixels, mode="RGBA")
+
+
+SIZES = {
+    "weather icon 80x80": (80, 80),
+    "full frame 528x880": (528, 880),
+}
+
+
+def _quiet(fn: Callable[[Image.Image], Image.Image]) -> Callable[[Image.Image], Image.Image]:
+    def quiet_fn(image: Image.Image) -> Image.Image:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn(image)
+    return quiet_fn
+
+
+def _time(fn: Callable[[Image.Image], Image.Image], image: Image.Image, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(image)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the best is kept)")
+    args = parser.parse_args()
+
+    cases: Dict[str, Tuple[Callable[[Image.Image], Image.Image], Callable[[Image.Image], Image.Image]]] = {
+        "extract_red": (extract_red_loop, render.extract_red),
+        "extract_black_and_gray": (extract_black_and_gray_loop, render.extract_black_and_gray),
+    }
+    print(f"{'function':<24} {'image':<20} {'loop':>10} {'numpy':>10} {'speedup':>8}")
+    for name, (loop_fn, vectorized_fn) in cases.items():
+        # `extract_black_and_gray()` prints a line about the alpha channel on every call
+        vectorized_fn = _quiet(vectorized_fn)
+        for size_name, (width, height) in SIZES.items():
+            image = _sample_image(width, height)
+            if loop_fn(image).tobytes() != vectorized_fn(image).tobytes():
+                raise SystemExit(f"{name} gives different pixels on the {size_name}")
+            loop_s = _time(loop_fn, image, args.repeat)
+            vectorized_s = _time(vectorized_fn, image, args.repeat)
+            print(
+                f"{name:<24} {size_name:<20} {loop_s * 1000:>8.1f}ms {vectorized_s * 1000:>8.2f}ms "
+                f"{loop_s / vectorized_s:>7.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()